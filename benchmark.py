@@ -0,0 +1,543 @@
+"""Offline benchmarks for the bot's handlers against a fake Telegram Bot API
+
+Runs synthetic workloads (upload bursts, download storms on one viral link,
+direct deliveries, listing pagination, stats views and filename searches) through the real
+handlers with a stand-in Bot that answers locally after a configurable latency
+and can inject RetryAfter errors. Reports ops/s, p50/p99 latency and peak RSS
+per scenario.
+
+    python benchmark.py --records 100000
+    python benchmark.py --backend sqlite --records 1000000 --json after.json --compare before.json
+
+Storage, outbox and snapshot files live in a temporary directory, so the bot's
+own data files are never touched.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+import importlib
+from datetime import datetime, timedelta
+
+from telegram import Update, User, Message, MessageId
+from telegram.error import RetryAfter
+
+ADMIN_ID = 1
+FIRST_USER_ID = 1000
+FILES_CHANNEL_ID = -1001
+LOGS_CHANNEL_ID = -1002
+SCENARIOS = ('upload_burst', 'download_storm', 'send_file', 'listing', 'stats', 'search')
+
+# Module under test, imported once the environment points it at the temp directory
+bot_module = None
+
+
+# Calls the bot sends through its rate-limited scheduler, which retries RetryAfter;
+# replies and edits are awaited directly, so no errors are injected into them
+SCHEDULED_METHODS = {
+    'send_document', 'send_photo', 'send_video', 'send_audio', 'send_voice',
+    'copy_message', 'send_media_group'
+}
+
+
+class FakeBot:
+    """Bot API stand-in: every call sleeps for the configured latency, then answers locally
+
+    A share of scheduled sends (retry_rate), and of messages to the logs channel,
+    raises RetryAfter(retry_after) instead.
+    """
+    def __init__(self, latency=0.0, jitter=0.0, retry_rate=0.0, retry_after=0.05):
+        self.latency = latency
+        self.jitter = jitter
+        self.retry_rate = retry_rate
+        self.retry_after = retry_after
+        self.message_ids = iter(range(1, 1 << 62))
+        self.calls = {}
+        self.retries = 0
+        self.last_markup = {}  # chat_id -> reply_markup of the latest message or edit
+        self.me = User(id=1 << 40, first_name="Benchmark", is_bot=True, username="BenchmarkBot")
+
+    async def _call(self, method, scheduled=None):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if scheduled is None:
+            scheduled = method in SCHEDULED_METHODS
+        if scheduled and self.retry_rate and random.random() < self.retry_rate:
+            self.retries += 1
+            raise RetryAfter(self.retry_after)
+
+    def _message(self, chat_id, text=None):
+        message = Message.de_json({
+            'message_id': next(self.message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'channel' if chat_id < 0 else 'private'},
+            'text': text
+        }, self)
+        return message
+
+    async def get_me(self, **kwargs):
+        await self._call('get_me')
+        return self.me
+
+    async def send_message(self, chat_id, text, reply_markup=None, **kwargs):
+        await self._call('send_message', scheduled=chat_id == LOGS_CHANNEL_ID)
+        self.last_markup[chat_id] = reply_markup
+        return self._message(chat_id, text)
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, reply_markup=None, **kwargs):
+        await self._call('edit_message_text')
+        self.last_markup[chat_id] = reply_markup
+        return self._message(chat_id, text)
+
+    async def answer_callback_query(self, callback_query_id, **kwargs):
+        await self._call('answer_callback_query')
+        return True
+
+    async def answer_inline_query(self, inline_query_id, results, **kwargs):
+        await self._call('answer_inline_query')
+        return True
+
+    async def delete_message(self, chat_id, message_id, **kwargs):
+        await self._call('delete_message')
+        return True
+
+    async def copy_message(self, chat_id, from_chat_id, message_id, **kwargs):
+        await self._call('copy_message')
+        return MessageId(next(self.message_ids))
+
+    async def send_media_group(self, chat_id, media, **kwargs):
+        await self._call('send_media_group')
+        return tuple(self._message(chat_id) for _ in media)
+
+    async def _send_file(self, method, chat_id):
+        await self._call(method)
+        return self._message(chat_id)
+
+    async def send_document(self, chat_id, document, **kwargs):
+        return await self._send_file('send_document', chat_id)
+
+    async def send_photo(self, chat_id, photo, **kwargs):
+        return await self._send_file('send_photo', chat_id)
+
+    async def send_video(self, chat_id, video, **kwargs):
+        return await self._send_file('send_video', chat_id)
+
+    async def send_audio(self, chat_id, audio, **kwargs):
+        return await self._send_file('send_audio', chat_id)
+
+    async def send_voice(self, chat_id, voice, **kwargs):
+        return await self._send_file('send_voice', chat_id)
+
+
+class FakeContext:
+    """The parts of CallbackContext the handlers use"""
+    def __init__(self, bot, args=None):
+        self.bot = bot
+        self.args = args or []
+        self.user_data = {}
+
+
+class RSSMonitor:
+    """Peak resident set size, sampled in the background and after each op"""
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = 0
+        self.task = None
+        self.page_size = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+    def sample(self):
+        try:
+            with open('/proc/self/statm') as f:
+                rss = int(f.read().split()[1]) * self.page_size
+        except OSError:
+            import resource
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # Lifetime peak
+        self.peak = max(self.peak, rss)
+        return rss
+
+    async def _run(self):
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+    def reset(self):
+        self.peak = 0
+        self.sample()
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+
+def user_json(user_id):
+    return {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}", 'username': f"user{user_id}"}
+
+def message_json(user_id, **content):
+    return dict({
+        'message_id': random.randint(1, 1 << 30),
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': user_json(user_id)
+    }, **content)
+
+def document_update(bot, user_id, n):
+    """Update carrying a new document upload"""
+    return Update.de_json({'update_id': n, 'message': message_json(user_id, document={
+        'file_id': f"BQACAgEAAx{n:012d}", 'file_unique_id': f"AgAD{n:012d}",
+        'file_name': f"report_{n}.pdf", 'file_size': 1024 * (n % 5000 + 1), 'mime_type': 'application/pdf'
+    })}, bot)
+
+def text_update(bot, user_id, text, n=0):
+    return Update.de_json({'update_id': n, 'message': message_json(user_id, text=text)}, bot)
+
+def callback_update(bot, user_id, data, n=0):
+    return Update.de_json({'update_id': n, 'callback_query': {
+        'id': str(n), 'from': user_json(user_id), 'chat_instance': str(user_id),
+        'data': data, 'message': message_json(user_id, text="menu")
+    }}, bot)
+
+def inline_update(bot, user_id, query, n=0, offset=''):
+    return Update.de_json({'update_id': n, 'inline_query': {
+        'id': str(n), 'from': user_json(user_id), 'query': query, 'offset': offset
+    }}, bot)
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+async def timed_ops(op, count, concurrency, rss):
+    """Run op(i) for i in range(count) with at most concurrency in flight; returns (latencies, errors, seconds)"""
+    latencies = []
+    errors = 0
+    ops = iter(range(count))
+
+    async def runner():
+        nonlocal errors
+        for i in ops:
+            start = time.perf_counter()
+            try:
+                await op(i)
+            except Exception as e:
+                errors += 1
+                if errors <= 3:
+                    print(f"  op {i} failed: {e!r}", file=sys.stderr)
+            latencies.append(time.perf_counter() - start)
+            if i % 100 == 0:
+                rss.sample()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(runner() for _ in range(max(1, concurrency))))
+    return latencies, errors, time.perf_counter() - start
+
+def preload_records(count, users):
+    """Insert count synthetic records spread over users, in bulk; returns the IDs"""
+    storage = bot_module.storage
+    start_date = datetime(2024, 1, 1)
+    # The json backend rewrites its whole file per save_many, so it gets one batch
+    batch_size = count if isinstance(storage.backend, bot_module.JSONFileBackend) else 10000
+    unique_ids = []
+    batch = []
+    for n in range(count):
+        unique_id = bot_module.id_allocator.next_id()
+        unique_ids.append(unique_id)
+        batch.append((unique_id, {
+            'file_id': f"BQACAgEAAx{n:012d}",
+            'file_unique_id': f"AgADpre{n:012d}",
+            'file_name': f"archive_{n}.zip",
+            'file_size': 1024 * (n % 5000 + 1),
+            'file_type': ('document', 'photo', 'video', 'audio', 'voice')[n % 5],
+            'uploader_id': FIRST_USER_ID + n % users,
+            'username': f"user{FIRST_USER_ID + n % users}",
+            'upload_date': (start_date + timedelta(seconds=n)).isoformat(),
+            'channel_message_id': n + 1,
+            'downloads': n % 100
+        }))
+        if len(batch) >= batch_size:
+            storage.backend.save_many(batch)
+            batch = []
+    if batch:
+        storage.backend.save_many(batch)
+    return unique_ids
+
+
+class Benchmark:
+    """Scenario runner; each scenario returns rows of (name, latencies, errors, seconds)"""
+    def __init__(self, args, bot):
+        self.args = args
+        self.bot = bot
+        self.rss = RSSMonitor()
+        self.unique_ids = []
+
+    def context(self, args=None):
+        return FakeContext(self.bot, args)
+
+    async def upload_burst(self):
+        """Many users uploading new documents at once"""
+        users = self.args.users
+
+        async def op(i):
+            update = document_update(self.bot, FIRST_USER_ID + i % users, 10 ** 9 + i)
+            await bot_module.handle_file(update, self.context())
+
+        return [('upload_burst', *await timed_ops(op, self.args.ops, self.args.concurrency, self.rss))]
+
+    async def download_storm(self):
+        """One viral link: every user opens it and presses Get File"""
+        unique_id = self.unique_ids[-1]
+
+        async def open_link(i):
+            update = text_update(self.bot, FIRST_USER_ID + i, f"/start file_{unique_id}", i)
+            await bot_module.handle_start_parameter(update, self.context([f"file_{unique_id}"]))
+
+        async def get_file(i):
+            data = bot_module.callback_router.data('g', unique_id)
+            update = callback_update(self.bot, FIRST_USER_ID + i, data, i)
+            await bot_module.button_callback(update, self.context())
+
+        ops, concurrency = self.args.ops, self.args.concurrency
+        return [
+            ('download_storm:start', *await timed_ops(open_link, ops, concurrency, self.rss)),
+            ('download_storm:get', *await timed_ops(get_file, ops, concurrency, self.rss)),
+        ]
+
+    async def send_file(self):
+        """Direct deliveries of random stored files"""
+        storage = bot_module.storage
+
+        async def op(i):
+            unique_id = random.choice(self.unique_ids)
+            file_data = storage.get_from_cache(unique_id)
+            if not await bot_module.send_file_to_user(self.context(), FIRST_USER_ID + i, file_data, unique_id):
+                raise RuntimeError(f"delivery of {unique_id} failed")
+
+        return [('send_file', *await timed_ops(op, self.args.ops, self.args.concurrency, self.rss))]
+
+    async def _walk_pages(self, viewer_id, first_page, pages):
+        """Open a listing and keep pressing Older; returns per-page latencies"""
+        latencies = []
+        data = first_page
+        for n in range(pages):
+            start = time.perf_counter()
+            await bot_module.button_callback(callback_update(self.bot, viewer_id, data, n), self.context())
+            latencies.append(time.perf_counter() - start)
+            if n % 50 == 0:
+                self.rss.sample()
+            markup = self.bot.last_markup.get(viewer_id)
+            older = [
+                button.callback_data for row in (markup.inline_keyboard if markup else ())
+                for button in row if button.callback_data
+                and bot_module.callback_router.resolve(button.callback_data)[1][:1] == ('o',)
+            ]
+            if not older:
+                data = first_page  # Reached the oldest page - start over
+            else:
+                data = older[0]
+        return latencies
+
+    async def listing(self):
+        """My Files and All Files pagination over the preloaded records"""
+        pages = self.args.pages
+        rows = []
+        for name, viewer_id, first_page in (
+            ('listing:allfiles', ADMIN_ID, 'allfiles'),
+            ('listing:myfiles', FIRST_USER_ID, 'myfiles'),
+        ):
+            start = time.perf_counter()
+            latencies = await self._walk_pages(viewer_id, first_page, pages)
+            rows.append((name, latencies, 0, time.perf_counter() - start))
+        return rows
+
+    async def stats(self):
+        """Admin and user statistics views"""
+        rows = []
+        for name, viewer_id in (('stats:admin', ADMIN_ID), ('stats:user', FIRST_USER_ID)):
+            async def op(i, viewer_id=viewer_id):
+                await bot_module.button_callback(callback_update(self.bot, viewer_id, 'stats', i), self.context())
+            rows.append((name, *await timed_ops(op, self.args.ops, 1, self.rss)))
+        return rows
+
+    async def search(self):
+        """/search as an admin (every file) and inline queries as a user (own files)"""
+        records = max(1, self.args.records)
+
+        def query():
+            n = random.randrange(records)
+            return random.choice(('archive', 'zip', str(n), str(n)[:3], f"chive {str(n)[:2]}"))
+
+        async def command(i):
+            terms = query().split()
+            update = text_update(self.bot, ADMIN_ID, "/search " + " ".join(terms), i)
+            await bot_module.search_command(update, self.context(terms))
+
+        async def inline(i):
+            await bot_module.inline_search(inline_update(self.bot, FIRST_USER_ID, query(), i), self.context())
+
+        ops, concurrency = self.args.ops, self.args.concurrency
+        return [
+            ('search:command', *await timed_ops(command, ops, concurrency, self.rss)),
+            ('search:inline', *await timed_ops(inline, ops, concurrency, self.rss)),
+        ]
+
+    async def run(self):
+        """Preload, then run the selected scenarios; returns result dicts"""
+        results = []
+        self.rss.reset()
+        start = time.perf_counter()
+        self.unique_ids = preload_records(self.args.records, self.args.users)
+        elapsed = time.perf_counter() - start
+        results.append(self.result('preload', [elapsed / max(1, self.args.records)] * self.args.records, 0, elapsed))
+
+        for scenario in self.args.scenarios:
+            self.rss.reset()
+            for name, latencies, errors, seconds in await getattr(self, scenario)():
+                results.append(self.result(name, latencies, errors, seconds))
+        await self.rss.stop()
+        return results
+
+    def result(self, name, latencies, errors, seconds):
+        latencies = sorted(latencies)
+        return {
+            'scenario': name,
+            'ops': len(latencies),
+            'errors': errors,
+            'ops_per_sec': len(latencies) / seconds if seconds else 0.0,
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'peak_rss_mb': self.rss.peak / (1024 * 1024),
+        }
+
+
+def print_results(results, bot):
+    print(f"\n{'scenario':<24}{'ops':>8}{'errors':>8}{'ops/s':>12}{'p50 ms':>10}{'p99 ms':>10}{'peak RSS MB':>13}")
+    for r in results:
+        print(
+            f"{r['scenario']:<24}{r['ops']:>8}{r['errors']:>8}{r['ops_per_sec']:>12.1f}"
+            f"{r['p50_ms']:>10.2f}{r['p99_ms']:>10.2f}{r['peak_rss_mb']:>13.1f}"
+        )
+    calls = ", ".join(f"{method}={count}" for method, count in sorted(bot.calls.items()))
+    print(f"\nBot API calls: {calls}")
+    print(f"Injected RetryAfter: {bot.retries}")
+
+def compare_results(results, baseline_path, tolerance):
+    """Print scenarios slower than the baseline by more than tolerance; returns how many"""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {r['scenario']: r for r in json.load(f)['results']}
+    regressions = 0
+    for r in results:
+        before = baseline.get(r['scenario'])
+        if before is None:
+            continue
+        slower_rate = before['ops_per_sec'] and r['ops_per_sec'] < before['ops_per_sec'] * (1 - tolerance)
+        slower_p99 = before['p99_ms'] and r['p99_ms'] > before['p99_ms'] * (1 + tolerance)
+        if slower_rate or slower_p99:
+            regressions += 1
+            print(
+                f"REGRESSION {r['scenario']}: {before['ops_per_sec']:.1f} -> {r['ops_per_sec']:.1f} ops/s, "
+                f"p99 {before['p99_ms']:.2f} -> {r['p99_ms']:.2f} ms"
+            )
+    if not regressions:
+        print(f"No regressions against {baseline_path} (tolerance {tolerance:.0%})")
+    return regressions
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks for filestore_bot")
+    parser.add_argument('--backend', choices=('json', 'sqlite'), default='sqlite')
+    parser.add_argument('--records', type=int, default=100000, help="records preloaded before the scenarios")
+    parser.add_argument('--users', type=int, default=100, help="distinct uploaders")
+    parser.add_argument('--ops', type=int, default=1000, help="operations per scenario")
+    parser.add_argument('--pages', type=int, default=200, help="listing pages walked per view")
+    parser.add_argument('--concurrency', type=int, default=50, help="operations in flight")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds per fake Bot API call")
+    parser.add_argument('--jitter', type=float, default=0.0, help="extra random seconds per call")
+    parser.add_argument('--retry-rate', type=float, default=0.0, help="share of calls answered with RetryAfter")
+    parser.add_argument('--retry-after', type=float, default=0.05, help="RetryAfter seconds")
+    parser.add_argument('--rate-limits', action='store_true', help="keep the bot's send rate limits")
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help="write results to this file")
+    parser.add_argument('--compare', help="baseline results file; exit 1 on regressions")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown against the baseline")
+    return parser.parse_args(argv)
+
+def configure_environment(args, workdir):
+    """Point the bot's configuration at workdir before it is imported"""
+    os.environ.update({
+        'STORAGE_BACKEND': args.backend,
+        'CACHE_FILE': os.path.join(workdir, 'file_cache.json'),
+        'DATABASE_FILE': os.path.join(workdir, 'file_store.db'),
+        'BUNDLES_FILE': os.path.join(workdir, 'bundles.json'),
+        'LOG_OUTBOX_FILE': os.path.join(workdir, 'log_outbox.jsonl'),
+        'RECOVERY_SNAPSHOT_FILE': os.path.join(workdir, 'recovery_snapshot.json'),
+        'RECOVERY_EXPORT_FILE': '',
+        'ADMIN_USER_IDS': str(ADMIN_ID),
+        'FILES_CHANNEL_ID': str(FILES_CHANNEL_ID),
+        'LOGS_CHANNEL_ID': str(LOGS_CHANNEL_ID),
+        'BOT_TOKEN': '1:benchmark',
+    })
+    if not args.rate_limits:
+        # Measure the bot, not Telegram's flood limits
+        os.environ.update({
+            'SEND_GLOBAL_RATE': '1000000',
+            'SEND_CHAT_RATE': '1000000',
+            'SEND_GROUP_PER_MINUTE': '60000000',
+            'SEND_BURST': '1000000',
+        })
+
+async def run(args):
+    bot = FakeBot(args.latency, args.jitter, args.retry_rate, args.retry_after)
+    await bot_module.refresh_bot_identity(bot)
+    bot_module.log_writer.start(bot)
+    bot_module.storage.start_flusher()
+    try:
+        results = await Benchmark(args, bot).run()
+    finally:
+        await bot_module.storage.stop_flusher()
+        await bot_module.log_writer.stop()
+        await bot_module.scheduler.stop()
+        bot_module.storage.close()
+    return results, bot
+
+def main(argv=None):
+    global bot_module
+    args = parse_args(argv)
+    if args.records < 1:
+        sys.exit("--records must be at least 1")
+    random.seed(args.seed)
+    cwd = os.getcwd()
+    json_path = os.path.abspath(args.json) if args.json else None
+
+    with tempfile.TemporaryDirectory(prefix='filestore-bench-') as workdir:
+        configure_environment(args, workdir)
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        os.chdir(workdir)  # bot_messages.json and other relative paths
+        logging.disable(logging.WARNING)  # Per-update INFO/WARNING logs would dominate the timings
+        bot_module = importlib.import_module('filestore_bot')
+        try:
+            results, bot = asyncio.run(run(args))
+        finally:
+            os.chdir(cwd)
+
+    print_results(results, bot)
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+    if args.compare and compare_results(results, args.compare, args.tolerance):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,32 @@
 import os
+import sys
+import asyncio
 import logging
+import signal
 import re
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
-import hashlib
+from telegram import (
+    Update, InlineKeyboardButton, InlineKeyboardMarkup, MessageEntity, MessageOriginChannel,
+    InputMediaAudio, InputMediaDocument, InputMediaPhoto, InputMediaVideo,
+    InlineQueryResultCachedAudio, InlineQueryResultCachedDocument, InlineQueryResultCachedPhoto,
+    InlineQueryResultCachedVideo, InlineQueryResultCachedVoice
+)
+from telegram.ext import (
+    Application, BaseUpdateProcessor, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler,
+    InlineQueryHandler
+)
+from telegram.error import BadRequest, Forbidden, RetryAfter, NetworkError, TelegramError
+from telegram.helpers import escape_markdown
+from telegram.request import HTTPXRequest
 import json
-from datetime import datetime
+import sqlite3
+import bisect
+import heapq
+import itertools
+import time
+import functools
+import hmac
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
 
 # Configure logging
 logging.basicConfig(
@@ -36,25 +57,166 @@ else:
     ADMIN_USER_IDS = [5948619751]
 
 # Local cache file (optional, for faster lookups)
-CACHE_FILE = 'file_cache.json'
+CACHE_FILE = os.getenv("CACHE_FILE", 'file_cache.json')
+
+# Metadata storage backend: "sqlite" (default) or "json" (local cache file, rewritten
+# on every change - only for small catalogs)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite").lower()
+
+# SQLite database file (used when STORAGE_BACKEND=sqlite)
+DATABASE_FILE = os.getenv("DATABASE_FILE", 'file_store.db')
+
+# Worker number (0-1023) embedded in generated file IDs, unique per bot process
+WORKER_ID = int(os.getenv("WORKER_ID", "0"))
+
+# Bundles (multi-file share links) for the json backend; sqlite keeps them in DATABASE_FILE
+BUNDLES_FILE = os.getenv("BUNDLES_FILE", 'bundles.json')
+
+# Seconds to wait for the rest of a media group (album) before storing it
+MEDIA_GROUP_WAIT = float(os.getenv("MEDIA_GROUP_WAIT", "1.5"))
+
+# Most files a /bundle command can put in one bundle
+BUNDLE_MAX_FILES = int(os.getenv("BUNDLE_MAX_FILES", "100"))
+
+# Number of files per My Files / All Files page
+FILES_PAGE_SIZE = 15
+
+# Filename search: results per /search page and per inline query batch, and the
+# most index terms one query word may expand to through substring (trigram) matches
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "10"))
+SEARCH_INLINE_LIMIT = int(os.getenv("SEARCH_INLINE_LIMIT", "20"))
+SEARCH_MAX_EXPANSION = int(os.getenv("SEARCH_MAX_EXPANSION", "500"))
 
 # Messages configuration file
 MESSAGES_FILE = 'bot_messages.json'
 
+# Durable outbox for log channel messages not yet delivered
+LOG_OUTBOX_FILE = os.getenv("LOG_OUTBOX_FILE", 'log_outbox.jsonl')
+
+# Log writer tuning: in-memory queue bound, events per batch and seconds to
+# wait for a batch to fill
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "1000"))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "10"))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "2"))
+
+# Outbound rate limits (Telegram allows ~30 msg/s overall, ~1 msg/s per private
+# chat and ~20 msg/min per group or channel) and RetryAfter retries per send
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))
+SEND_GROUP_RATE = float(os.getenv("SEND_GROUP_PER_MINUTE", "20")) / 60
+SEND_BURST = int(os.getenv("SEND_BURST", "3"))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "3"))
+
+# Download counts are kept in memory and written in batches every
+# DOWNLOAD_FLUSH_INTERVAL seconds or once DOWNLOAD_FLUSH_THRESHOLD are pending
+DOWNLOAD_FLUSH_INTERVAL = float(os.getenv("DOWNLOAD_FLUSH_INTERVAL", "5"))
+DOWNLOAD_FLUSH_THRESHOLD = int(os.getenv("DOWNLOAD_FLUSH_THRESHOLD", "100"))
+
+# Update delivery: "polling" (default) or "webhook". Only the update types the
+# handlers use are requested from Telegram.
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY, Update.INLINE_QUERY]
+
+# Webhook server settings. WEBHOOK_URL is the public base URL Telegram posts to;
+# leave it empty on extra workers behind the same proxy so only one registers it.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", os.getenv("PORT", "8080")))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+# Worker processes in webhook mode. With WORKERS > 1 the webhook server hands each
+# update to one of the workers, picked by user so a user's updates stay on one
+# process. Workers share the sqlite backend.
+WORKERS = int(os.getenv("WORKERS", "1"))
+
+# Updates handled at the same time (1 handles them one by one). Updates of the
+# same user are always handled in the order they arrived.
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "64"))
+
+# Seconds between checks for records and messages changed by other processes
+CACHE_SYNC_INTERVAL = float(os.getenv("CACHE_SYNC_INTERVAL", "1"))
+
+# In-memory record cache: max records, seconds a record stays fresh, and seconds
+# an unknown file ID is remembered as missing
+RECORD_CACHE_SIZE = int(os.getenv("RECORD_CACHE_SIZE", "10000"))
+RECORD_CACHE_TTL = float(os.getenv("RECORD_CACHE_TTL", "3600"))
+NEGATIVE_CACHE_TTL = float(os.getenv("NEGATIVE_CACHE_TTL", "60"))
+
+# Rendered file cards, captions and listing rows kept in memory
+RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE", "5000"))
+
+# How files reach users: "copy" copies the files channel message (survives a bot
+# token change), "file_id" re-sends the stored file_id; copy falls back to file_id
+DELIVERY_MODE = os.getenv("DELIVERY_MODE", "copy").lower()
+
+# Local HTTP port serving metrics in Prometheus text format (0 disables it).
+# Webhook worker processes listen on METRICS_PORT + their index.
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+
+# Latency histogram bucket bounds in seconds
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Send priorities (lower goes first)
+PRIORITY_DOWNLOAD = 0
+PRIORITY_UPLOAD = 1
+PRIORITY_LOG = 2
+PRIORITY_NAMES = {PRIORITY_DOWNLOAD: 'download', PRIORITY_UPLOAD: 'upload', PRIORITY_LOG: 'log'}
+
+# Snapshot of metadata recovered from the logs channel
+RECOVERY_SNAPSHOT_FILE = os.getenv("RECOVERY_SNAPSHOT_FILE", 'recovery_snapshot.json')
+
+# Optional logs channel export (Telegram Desktop result.json) ingested on startup
+RECOVERY_EXPORT_FILE = os.getenv("RECOVERY_EXPORT_FILE", "")
+
 
 def is_admin(user_id):
     """Check if a user is an admin."""
     return user_id in ADMIN_USER_IDS
 
+class MessageTemplate:
+    """A message compiled once into literal chunks and {variable} slots"""
+    __slots__ = ('parts', 'slots', 'static')
+    PLACEHOLDER = re.compile(r'\{([A-Za-z_]\w*)\}')
+
+    def __init__(self, text):
+        pieces = self.PLACEHOLDER.split(text)
+        # Odd pieces are variable names; keep them as "{name}" so missing values render as written
+        self.slots = tuple((i, pieces[i]) for i in range(1, len(pieces), 2))
+        for i, name in self.slots:
+            pieces[i] = "{" + name + "}"
+        self.parts = pieces
+        self.static = text if not self.slots else None
+
+    def render(self, values):
+        """Fill in the variables (messages without any are returned as is)"""
+        if self.static is not None:
+            return self.static
+        parts = self.parts.copy()
+        for i, name in self.slots:
+            if name in values:
+                parts[i] = str(values[name])
+        return ''.join(parts)
+
 class MessageManager:
     """Manage custom bot messages"""
     def __init__(self):
+        self.mtime = None
+        self.checked_at = time.monotonic()
         self.messages = self.load_messages()
+        self.compile_templates()
+    
+    def compile_templates(self):
+        """Compile every message into a reusable template"""
+        self.templates = {name: MessageTemplate(text) for name, text in self.messages.items()}
     
     def load_messages(self):
         """Load messages from JSON file or create defaults"""
         if os.path.exists(MESSAGES_FILE):
             try:
+                self.mtime = os.path.getmtime(MESSAGES_FILE)
                 with open(MESSAGES_FILE, 'r', encoding='utf-8') as f:
                     return json.load(f)
             except json.JSONDecodeError:
@@ -105,6 +267,8 @@ class MessageManager:
                 "*Commands:*\n"
                 "/start - Start the bot\n"
                 "/myfiles - View your files\n"
+                "/bundle - Share several files with one link\n"
+                "/search - Find files by name\n"
                 "/stats - View statistics\n"
                 "/help - Show this help message\n"
                 "/about - About this bot\n\n"
@@ -147,27 +311,43 @@ class MessageManager:
             msgs = messages if messages else self.messages
             with open(MESSAGES_FILE, 'w', encoding='utf-8') as f:
                 json.dump(msgs, f, indent=2, ensure_ascii=False)
+            self.mtime = os.path.getmtime(MESSAGES_FILE)
             logger.info("Messages saved successfully")
             return True
         except Exception as e:
             logger.error(f"Error saving messages: {e}")
             return False
     
+    def refresh(self):
+        """Reload messages if the file was saved by another process"""
+        self.checked_at = time.monotonic()
+        try:
+            mtime = os.path.getmtime(MESSAGES_FILE)
+        except OSError:
+            return
+        if mtime != self.mtime:
+            self.messages = self.load_messages()
+            self.compile_templates()
+            logger.info("Messages reloaded")
+    
     def get_message(self, message_type, **kwargs):
         """Get a message with variable replacement"""
-        message = self.messages.get(message_type, "")
-        
-        # Replace variables
-        for key, value in kwargs.items():
-            placeholder = "{" + key + "}"
-            message = message.replace(placeholder, str(value))
-        
-        return message
+        if time.monotonic() - self.checked_at >= CACHE_SYNC_INTERVAL:
+            self.refresh()
+        template = self.templates.get(message_type)
+        if template is None:
+            return ""
+        return template.render(kwargs)
+    
+    def render_preview(self, text, **kwargs):
+        """Render unsaved message text without touching the stored messages"""
+        return MessageTemplate(text).render(kwargs)
     
     def update_message(self, message_type, new_content):
         """Update a specific message"""
         if message_type in self.messages:
             self.messages[message_type] = new_content
+            self.templates[message_type] = MessageTemplate(new_content)
             return self.save_messages()
         return False
     
@@ -175,321 +355,2968 @@ class MessageManager:
         """Get list of all message types"""
         return list(self.messages.keys())
 
-class FileStorage:
-    """Channel-based storage - no local cache needed"""
-    def __init__(self, bot_application=None):
-        self.bot = None
-        self.cache = {}  # Temporary in-memory cache for current session
-        logger.info("FileStorage initialized - using channel-based storage")
-    
-    def set_bot(self, bot):
-        """Set bot instance for channel operations"""
-        self.bot = bot
-    
-    async def get_file_from_channel(self, unique_id):
-        """Retrieve file metadata from logs channel by searching messages"""
+def load_json_records(path):
+    """Load file records from a JSON cache file"""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (json.JSONDecodeError, OSError) as e:
+        logger.error(f"Error reading cache file {path}: {e}")
+        return {}
+
+def write_json_atomic(path, data):
+    """Write JSON to a temp file and atomically replace the target"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+class FileRecord:
+    """Compact file metadata record, read like the dict records it replaces
+
+    upload_date is kept as integer microseconds since the epoch (unusual date
+    strings are kept verbatim), file_type and username are interned, and
+    file_size_bytes and share_link are derived. to_dict() gives back the
+    JSON fields used by the cache file and logs.
+    """
+    __slots__ = (
+        'unique_id', 'file_id', 'file_unique_id', 'file_name', 'file_size', 'file_type',
+        'uploader_id', 'username', 'uploaded_at', 'channel_message_id', 'downloads'
+    )
+    FIELDS = (
+        'file_id', 'file_unique_id', 'file_name', 'file_size', 'file_size_bytes', 'file_type',
+        'uploader_id', 'username', 'upload_date', 'channel_message_id', 'downloads', 'share_link'
+    )
+    KEYS = frozenset(FIELDS)
+    EPOCH = datetime(1970, 1, 1)
+
+    def __init__(self, unique_id, file_id, file_name, file_size, file_type, uploader_id, username,
+                 upload_date, channel_message_id=None, downloads=0, file_unique_id=None):
+        self.unique_id = unique_id
+        self.file_id = file_id
+        self.file_unique_id = file_unique_id
+        self.file_name = file_name
+        self.file_size = file_size or 0
+        self.file_type = sys.intern(file_type or 'document')
+        self.uploader_id = uploader_id
+        self.username = sys.intern(username) if username else username
+        self.uploaded_at = self.encode_date(upload_date)
+        self.channel_message_id = channel_message_id
+        self.downloads = downloads or 0
+
+    @classmethod
+    def from_dict(cls, unique_id, file_data):
+        """Build a record from a dict record (records are returned as is)"""
+        if isinstance(file_data, cls):
+            return file_data
+        return cls(
+            unique_id,
+            file_data['file_id'],
+            file_data['file_name'],
+            file_data.get('file_size') or file_data.get('file_size_bytes') or 0,
+            file_data.get('file_type', 'document'),
+            file_data['uploader_id'],
+            file_data.get('username'),
+            file_data['upload_date'],
+            file_data.get('channel_message_id'),
+            file_data.get('downloads', 0),
+            file_data.get('file_unique_id')
+        )
+
+    @classmethod
+    def encode_date(cls, upload_date):
+        """ISO date string to integer microseconds, if it round-trips exactly"""
         try:
-            # Search through recent messages in logs channel
-            async for message in self.bot.get_chat(LOGS_CHANNEL_ID).iter_history(limit=1000):
-                if message.text and f"`{unique_id}`" in message.text:
-                    # Extract JSON from message
-                    if "```json" in message.text:
-                        json_start = message.text.find("```json") + 7
-                        json_end = message.text.find("```", json_start)
-                        json_str = message.text[json_start:json_end].strip()
-                        file_data = json.loads(json_str)
-                        return file_data
-            return None
-        except Exception as e:
-            logger.error(f"Error retrieving file from channel: {e}")
-            return None
-    
-    async def add_to_cache(self, unique_id, file_data):
-        """Add file data to memory cache (channel logging handled separately)"""
-        self.cache[unique_id] = file_data
-        logger.info(f"Added file {unique_id} to memory cache")
-    
-    def get_from_cache(self, unique_id):
-        """Get file data from memory cache"""
-        return self.cache.get(unique_id)
-    
-    async def update_downloads(self, unique_id):
-        """Update download count - just increment in memory"""
-        if unique_id in self.cache:
-            self.cache[unique_id]['downloads'] = self.cache[unique_id].get('downloads', 0) + 1
-            logger.info(f"Updated download count for {unique_id}")
-    
-    def get_user_files(self, user_id):
-        """Get all files uploaded by a specific user from memory cache"""
-        return [(uid, data) for uid, data in self.cache.items() if data.get('uploader_id') == user_id]
-    
-    def get_all_files(self):
-        """Get all files in memory cache"""
-        return list(self.cache.items())
-    
-    def get_total_downloads(self):
-        """Get total downloads across all files in memory"""
-        return sum(data.get('downloads', 0) for data in self.cache.values())
+            parsed = datetime.fromisoformat(upload_date)
+        except (TypeError, ValueError):
+            return upload_date
+        if parsed.tzinfo is not None or parsed.isoformat() != upload_date:
+            return upload_date
+        return (parsed - cls.EPOCH) // timedelta(microseconds=1)
 
+    @property
+    def upload_date(self):
+        if isinstance(self.uploaded_at, int):
+            return (self.EPOCH + timedelta(microseconds=self.uploaded_at)).isoformat()
+        return self.uploaded_at
 
-# Initialize storage
-storage = FileStorage()
+    @property
+    def file_size_bytes(self):
+        return self.file_size
 
-# Initialize message manager
-message_manager = MessageManager()
+    @property
+    def share_link(self):
+        return build_share_link(self.unique_id) if bot_username else None
 
-def get_main_menu_keyboard(user_id):
-    """Get main menu keyboard based on user role"""
-    if is_admin(user_id):
-        return InlineKeyboardMarkup([
-            [InlineKeyboardButton("📁 My Files", callback_data="myfiles"),
-             InlineKeyboardButton("📂 All Files", callback_data="allfiles")],
-            [InlineKeyboardButton("📊 Statistics", callback_data="stats"),
-             InlineKeyboardButton("🔄 Rebuild Cache", callback_data="rebuild")],
-            [InlineKeyboardButton("✏️ Edit Messages", callback_data="editmessages")],
-            [InlineKeyboardButton("ℹ️ Help", callback_data="help"),
-             InlineKeyboardButton("ℹ️ About", callback_data="about")]
-        ])
-    else:
-        return InlineKeyboardMarkup([
-            [InlineKeyboardButton("📁 My Files", callback_data="myfiles")],
-            [InlineKeyboardButton("📊 Statistics", callback_data="stats")],
-            [InlineKeyboardButton("ℹ️ Help", callback_data="help"),
-             InlineKeyboardButton("ℹ️ About", callback_data="about")]
-        ])
+    @property
+    def size_str(self):
+        return format_size(self.file_size)
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Send a message when the command /start is issued."""
-    user_id = update.message.from_user.id
-    user_name = update.message.from_user.first_name
-    user_is_admin = is_admin(user_id)
-    
-    # Get custom start message with variable replacement
-    welcome_text = message_manager.get_message(
-        'start_message',
-        user_name=user_name,
-        user_id=user_id
-    )
-    
-    if user_is_admin:
-        welcome_text += "\n\n👑 *Admin Mode Active*"
-    
-    await update.message.reply_text(
-        welcome_text, 
-        parse_mode='Markdown', 
-        reply_markup=get_main_menu_keyboard(user_id)
+    def __getitem__(self, key):
+        if key in self.KEYS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.KEYS
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.KEYS else default
+
+    def to_dict(self):
+        """The record as the dict written to the cache file"""
+        data = {key: getattr(self, key) for key in self.FIELDS}
+        if data['file_unique_id'] is None:
+            del data['file_unique_id']  # Records stored before content dedup
+        return data
+
+    copy = to_dict
+
+    def __repr__(self):
+        return f"FileRecord({self.unique_id!r}, {self.file_name!r})"
+
+SEARCH_TOKEN = re.compile(r'[^\W_]+')
+SEARCH_MIN_TERM = 2  # Shorter query words match too much to be useful
+
+def tokenize_name(file_name):
+    """Distinct casefolded words of a file name, in order"""
+    return list(dict.fromkeys(SEARCH_TOKEN.findall(file_name.casefold())))
+
+def query_terms(text):
+    """Words of a search query that are long enough to look up"""
+    return [term for term in tokenize_name(text) if len(term) >= SEARCH_MIN_TERM]
+
+def name_trigrams(term):
+    """Distinct three-character substrings of a term"""
+    return {term[i:i + 3] for i in range(len(term) - 2)}
+
+class SearchIndex:
+    """In-memory inverted index over file name words
+
+    A query word matches every indexed word it is a prefix of, plus (from three
+    characters on) every word containing it, found through a trigram index over
+    the vocabulary. All query words must match.
+    """
+    def __init__(self):
+        self.postings = {}  # word -> set of unique_ids
+        self.terms = []  # vocabulary, for prefix ranges (sorted when terms_sorted)
+        self.terms_sorted = True
+        self.trigrams = {}  # trigram -> set of words containing it
+
+    def _sorted_terms(self):
+        """The vocabulary, sorting it once after new words were appended"""
+        if not self.terms_sorted:
+            self.terms.sort()
+            self.terms_sorted = True
+        return self.terms
+
+    def add(self, unique_id, file_name):
+        for term in tokenize_name(file_name):
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = set()
+                self.terms.append(term)  # Sorted on the next lookup, so a bulk load sorts once
+                self.terms_sorted = False
+                for trigram in name_trigrams(term):
+                    self.trigrams.setdefault(trigram, set()).add(term)
+            postings.add(unique_id)
+
+    def remove(self, unique_id, file_name):
+        for term in tokenize_name(file_name):
+            postings = self.postings.get(term)
+            if postings is None:
+                continue
+            postings.discard(unique_id)
+            if postings:
+                continue
+            del self.postings[term]
+            terms = self._sorted_terms()
+            pos = bisect.bisect_left(terms, term)
+            if pos < len(terms) and terms[pos] == term:
+                del terms[pos]
+            for trigram in name_trigrams(term):
+                words = self.trigrams.get(trigram)
+                if words is not None:
+                    words.discard(term)
+                    if not words:
+                        del self.trigrams[trigram]
+
+    def match_terms(self, query):
+        """Indexed words matched by one query word"""
+        terms = self._sorted_terms()
+        start = bisect.bisect_left(terms, query)
+        end = bisect.bisect_left(terms, query + '\U0010ffff', start)
+        matched = terms[start:end]
+        if len(query) >= 3:
+            groups = [self.trigrams.get(trigram, ()) for trigram in name_trigrams(query)]
+            groups.sort(key=len)
+            candidates = set(groups[0]).intersection(*groups[1:])
+            inner = [term for term in candidates if query in term and not term.startswith(query)]
+            matched.extend(inner[:SEARCH_MAX_EXPANSION])
+        return matched
+
+    def lookup(self, terms):
+        """unique_ids whose name matches every query word (may be the index's own set: do not modify)"""
+        matches = []
+        for query in terms:
+            matched = self.match_terms(query)
+            if len(matched) == 1:
+                uids = self.postings[matched[0]]
+            else:
+                uids = set().union(*(self.postings[term] for term in matched))
+            if not uids:
+                return set()
+            matches.append(uids)
+        if not matches:
+            return set()
+        matches.sort(key=len)
+        return matches[0] if len(matches) == 1 else matches[0].intersection(*matches[1:])
+
+class JSONFileBackend:
+    """Local JSON file storage backend for small catalogs"""
+    def __init__(self, path=CACHE_FILE, bundles_path=BUNDLES_FILE):
+        self.path = path
+        self.bundles_path = bundles_path
+        self.bundles = load_json_records(bundles_path)  # bundle_id -> {'files', 'owner_id', 'created_at'}
+        self.records = {
+            unique_id: FileRecord.from_dict(unique_id, file_data)
+            for unique_id, file_data in load_json_records(path).items()
+        }
+        self.by_date = []  # sorted list of (upload_date, unique_id)
+        self.by_uploader = {}  # uploader_id -> sorted list of (upload_date, unique_id)
+        self.uploader_stats = {}  # uploader_id -> [files, downloads]
+        self.by_content = {}  # (file_unique_id, file_size) -> list of unique_ids, oldest first
+        self.by_downloads = {}  # download count -> set of unique_ids
+        self.download_counts = []  # sorted keys of by_downloads
+        self.totals = {'files': 0, 'downloads': 0, 'bytes': 0}
+        self.type_counts = {}  # file_type -> files
+        self.search = SearchIndex()
+        for unique_id, file_data in self.records.items():
+            self._index(unique_id, file_data)
+        logger.info(f"JSON backend loaded {len(self.records)} records from {path}")
+
+    @staticmethod
+    def _content_key(file_data):
+        """Content identity of a record"""
+        return file_data['file_unique_id'], file_data.get('file_size') or 0
+
+    def _index(self, unique_id, file_data):
+        """Add a record to the per-uploader index and counters"""
+        uploader_id = file_data.get('uploader_id')
+        key = (file_data.get('upload_date', ''), unique_id)
+        bisect.insort(self.by_date, key)
+        bisect.insort(self.by_uploader.setdefault(uploader_id, []), key)
+        if file_data.get('file_unique_id'):
+            self.by_content.setdefault(self._content_key(file_data), []).append(unique_id)
+        stats = self.uploader_stats.setdefault(uploader_id, [0, 0])
+        stats[0] += 1
+        stats[1] += file_data.get('downloads', 0)
+        self.totals['files'] += 1
+        self.totals['downloads'] += file_data.get('downloads', 0)
+        self.totals['bytes'] += file_data.get('file_size') or 0
+        file_type = file_data.get('file_type', 'document')
+        self.type_counts[file_type] = self.type_counts.get(file_type, 0) + 1
+        self._rank(unique_id, file_data.get('downloads', 0))
+        self.search.add(unique_id, file_data.get('file_name', ''))
+
+    def _unindex(self, unique_id, file_data):
+        """Remove a record from the per-uploader index and counters"""
+        uploader_id = file_data.get('uploader_id')
+        key = (file_data.get('upload_date', ''), unique_id)
+        entries = self.by_uploader.get(uploader_id, [])
+        for sorted_keys in (self.by_date, entries):
+            pos = bisect.bisect_left(sorted_keys, key)
+            if pos < len(sorted_keys) and sorted_keys[pos] == key:
+                del sorted_keys[pos]
+        if file_data.get('file_unique_id'):
+            content_key = self._content_key(file_data)
+            aliases = self.by_content.get(content_key, [])
+            if unique_id in aliases:
+                aliases.remove(unique_id)
+            if not aliases:
+                self.by_content.pop(content_key, None)
+        stats = self.uploader_stats.get(uploader_id)
+        if stats:
+            stats[0] -= 1
+            stats[1] -= file_data.get('downloads', 0)
+        self.totals['files'] -= 1
+        self.totals['downloads'] -= file_data.get('downloads', 0)
+        self.totals['bytes'] -= file_data.get('file_size') or 0
+        file_type = file_data.get('file_type', 'document')
+        self.type_counts[file_type] -= 1
+        if not self.type_counts[file_type]:
+            del self.type_counts[file_type]
+        self._unrank(unique_id, file_data.get('downloads', 0))
+        self.search.remove(unique_id, file_data.get('file_name', ''))
+        if not entries:
+            self.by_uploader.pop(uploader_id, None)
+            self.uploader_stats.pop(uploader_id, None)
+
+    def _rank(self, unique_id, downloads):
+        """Add a record to the download count buckets"""
+        bucket = self.by_downloads.get(downloads)
+        if bucket is None:
+            bucket = self.by_downloads[downloads] = set()
+            bisect.insort(self.download_counts, downloads)
+        bucket.add(unique_id)
+
+    def _unrank(self, unique_id, downloads):
+        """Remove a record from the download count buckets"""
+        bucket = self.by_downloads.get(downloads)
+        if bucket is None:
+            return
+        bucket.discard(unique_id)
+        if not bucket:
+            del self.by_downloads[downloads]
+            del self.download_counts[bisect.bisect_left(self.download_counts, downloads)]
+
+    def _put(self, unique_id, file_data):
+        """Replace a record in memory, keeping indexes in sync"""
+        file_data = FileRecord.from_dict(unique_id, file_data)
+        previous = self.records.get(unique_id)
+        if previous is not None:
+            self._unindex(unique_id, previous)
+        self.records[unique_id] = file_data
+        self._index(unique_id, file_data)
+
+    def _flush(self):
+        """Persist all records to disk"""
+        try:
+            write_json_atomic(self.path, {uid: record.to_dict() for uid, record in self.records.items()})
+        except OSError as e:
+            logger.error(f"Error writing cache file: {e}")
+
+    def load(self, unique_id):
+        """Get a single record by unique ID"""
+        return self.records.get(unique_id)
+
+    def save(self, unique_id, file_data):
+        """Insert or replace a record (records must not be mutated in place)"""
+        self._put(unique_id, file_data)
+        self._flush()
+
+    def save_many(self, items):
+        """Insert or replace many records with a single write"""
+        for unique_id, file_data in items:
+            self._put(unique_id, file_data)
+        self._flush()
+
+    def add_downloads_many(self, counts):
+        """Add a batch of download counts with one write, returns the new counts"""
+        updated = {}
+        for unique_id, count in counts.items():
+            file_data = self.records.get(unique_id)
+            if file_data is None:
+                continue
+            self._unrank(unique_id, file_data.get('downloads', 0))
+            file_data['downloads'] = file_data.get('downloads', 0) + count
+            self._rank(unique_id, file_data['downloads'])
+            self.uploader_stats[file_data.get('uploader_id')][1] += count
+            self.totals['downloads'] += count
+            updated[unique_id] = file_data['downloads']
+        if updated:
+            self._flush()
+        return updated
+
+    def load_bundle(self, bundle_id):
+        """Get a bundle ({'files', 'owner_id', 'created_at'}) by ID"""
+        return self.bundles.get(bundle_id)
+
+    def save_bundles(self, items):
+        """Insert or replace bundles with a single write"""
+        for bundle_id, bundle in items:
+            self.bundles[bundle_id] = bundle
+        try:
+            write_json_atomic(self.bundles_path, self.bundles)
+        except OSError as e:
+            logger.error(f"Error writing bundles file: {e}")
+
+    def find_by_content(self, file_unique_id, file_size):
+        """Get records with the same Telegram content identity, oldest first"""
+        unique_ids = self.by_content.get((file_unique_id, file_size or 0), [])
+        return [(uid, self.records[uid]) for uid in unique_ids]
+
+    def user_stats(self, user_id):
+        """Get (files, downloads) for an uploader"""
+        files, downloads = self.uploader_stats.get(user_id, (0, 0))
+        return files, downloads
+
+    def page_files(self, user_id=None, before=None, after=None, limit=15):
+        """Get one page of records (oldest first) next to a (upload_date, unique_id) cursor
+
+        Returns (items, has_older, has_newer). Without a cursor the newest page is returned.
+        """
+        keys = self.by_date if user_id is None else self.by_uploader.get(user_id, [])
+        if after is not None:
+            start = bisect.bisect_right(keys, after)
+            end = min(start + limit, len(keys))
+        else:
+            end = bisect.bisect_left(keys, before) if before is not None else len(keys)
+            start = max(0, end - limit)
+        items = [(uid, self.records[uid]) for _, uid in keys[start:end]]
+        return items, start > 0, end < len(keys)
+
+    def _ranked_walk(self, unique_ids, order, count):
+        """The first count of unique_ids in ranking order, found by walking every record in that order"""
+        date_key = lambda uid: (self.records[uid]['upload_date'], uid)
+        if order == 'recent':
+            return list(itertools.islice((uid for _, uid in reversed(self.by_date) if uid in unique_ids), count))
+        ranked = []
+        for downloads in reversed(self.download_counts):
+            bucket = self.by_downloads[downloads]
+            small, large = (bucket, unique_ids) if len(bucket) < len(unique_ids) else (unique_ids, bucket)
+            ranked.extend(sorted((uid for uid in small if uid in large), key=date_key, reverse=True))
+            if len(ranked) >= count:
+                break
+        return ranked[:count]
+
+    def search_files(self, terms, user_id=None, order='downloads', offset=0, limit=10):
+        """Get one page of records whose name matches every query word
+
+        Ranked by downloads (then recency) or by recency alone. Returns (items, has_more).
+        """
+        unique_ids = self.search.lookup(terms)
+        count = offset + limit + 1
+        if user_id is not None:
+            keys = self.by_uploader.get(user_id, [])
+            if len(keys) < len(unique_ids):
+                unique_ids = [uid for _, uid in keys if uid in unique_ids]
+            else:
+                unique_ids = [uid for uid in unique_ids if self.records[uid].get('uploader_id') == user_id]
+        if user_id is None and count * len(self.records) < len(unique_ids) ** 2:
+            # Common words: walking records in ranking order stops long before the last match
+            ranked = self._ranked_walk(unique_ids, order, count)
+        elif order == 'recent':
+            ranked = heapq.nlargest(count, unique_ids, key=lambda uid: (self.records[uid]['upload_date'], uid))
+        else:
+            rank = lambda uid: (self.records[uid].get('downloads', 0), self.records[uid]['upload_date'], uid)
+            ranked = heapq.nlargest(count, unique_ids, key=rank)
+        items = [(uid, self.records[uid]) for uid in ranked[offset:offset + limit]]
+        return items, len(ranked) > offset + limit
+
+    def count(self):
+        """Number of stored records"""
+        return len(self.records)
+
+    def stats_snapshot(self):
+        """Get the global statistics counters"""
+        return {
+            'total_files': self.totals['files'],
+            'total_downloads': self.totals['downloads'],
+            'total_uploaders': len(self.uploader_stats),
+            'total_bytes': self.totals['bytes'],
+            'files_by_type': dict(self.type_counts)
+        }
+
+    def latest_change(self):
+        """Single-process backend: there are no outside changes"""
+        return 0
+
+    def changes_since(self, seq):
+        """Single-process backend: nothing to invalidate"""
+        return seq, []
+
+    def prune_changes(self):
+        """Single-process backend: no change log to prune"""
+
+    def close(self):
+        """Flush records on shutdown"""
+        self._flush()
+
+class SQLiteBackend:
+    """Embedded SQLite storage backend in WAL mode with secondary indexes"""
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS files (
+            unique_id TEXT PRIMARY KEY,
+            file_id TEXT NOT NULL,
+            file_name TEXT NOT NULL,
+            file_size INTEGER NOT NULL DEFAULT 0,
+            file_type TEXT NOT NULL,
+            uploader_id INTEGER NOT NULL,
+            username TEXT,
+            upload_date TEXT NOT NULL,
+            channel_message_id INTEGER,
+            downloads INTEGER NOT NULL DEFAULT 0,
+            share_link TEXT,
+            file_unique_id TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_files_uploader ON files (uploader_id, upload_date);
+        CREATE INDEX IF NOT EXISTS idx_files_date ON files (upload_date);
+        CREATE INDEX IF NOT EXISTS idx_files_type ON files (file_type, upload_date);
+        CREATE INDEX IF NOT EXISTS idx_files_downloads ON files (downloads, upload_date, unique_id);
+        CREATE INDEX IF NOT EXISTS idx_files_uploader_downloads ON files (uploader_id, downloads, upload_date, unique_id);
+
+        -- Per-uploader counters, kept in sync by triggers
+        CREATE TABLE IF NOT EXISTS uploader_stats (
+            uploader_id INTEGER PRIMARY KEY,
+            files INTEGER NOT NULL DEFAULT 0,
+            downloads INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TRIGGER IF NOT EXISTS trg_files_insert AFTER INSERT ON files BEGIN
+            INSERT INTO uploader_stats (uploader_id, files, downloads) VALUES (NEW.uploader_id, 1, NEW.downloads)
+            ON CONFLICT (uploader_id) DO UPDATE SET files = files + 1, downloads = downloads + NEW.downloads;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_files_delete AFTER DELETE ON files BEGIN
+            UPDATE uploader_stats SET files = files - 1, downloads = downloads - OLD.downloads
+            WHERE uploader_id = OLD.uploader_id;
+            DELETE FROM uploader_stats WHERE uploader_id = OLD.uploader_id AND files <= 0;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_files_update AFTER UPDATE OF uploader_id, downloads ON files BEGIN
+            UPDATE uploader_stats SET files = files - 1, downloads = downloads - OLD.downloads
+            WHERE uploader_id = OLD.uploader_id;
+            INSERT INTO uploader_stats (uploader_id, files, downloads) VALUES (NEW.uploader_id, 1, NEW.downloads)
+            ON CONFLICT (uploader_id) DO UPDATE SET files = files + 1, downloads = downloads + NEW.downloads;
+            DELETE FROM uploader_stats WHERE uploader_id = OLD.uploader_id AND files <= 0;
+        END;
+
+        -- Global counters ('files', 'downloads', 'bytes', 'uploaders', 'type:<file_type>')
+        CREATE TABLE IF NOT EXISTS global_stats (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TRIGGER IF NOT EXISTS trg_stats_insert AFTER INSERT ON files BEGIN
+            INSERT INTO global_stats (name, value) VALUES
+                ('files', 1), ('downloads', NEW.downloads), ('bytes', NEW.file_size), ('type:' || NEW.file_type, 1)
+            ON CONFLICT (name) DO UPDATE SET value = value + excluded.value;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_stats_delete AFTER DELETE ON files BEGIN
+            INSERT INTO global_stats (name, value) VALUES
+                ('files', -1), ('downloads', -OLD.downloads), ('bytes', -OLD.file_size), ('type:' || OLD.file_type, -1)
+            ON CONFLICT (name) DO UPDATE SET value = value + excluded.value;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_stats_update AFTER UPDATE OF downloads, file_size, file_type ON files BEGIN
+            INSERT INTO global_stats (name, value) VALUES
+                ('downloads', NEW.downloads - OLD.downloads), ('bytes', NEW.file_size - OLD.file_size),
+                ('type:' || OLD.file_type, -1), ('type:' || NEW.file_type, 1)
+            ON CONFLICT (name) DO UPDATE SET value = value + excluded.value;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_uploaders_insert AFTER INSERT ON uploader_stats BEGIN
+            INSERT INTO global_stats (name, value) VALUES ('uploaders', 1)
+            ON CONFLICT (name) DO UPDATE SET value = value + 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_uploaders_delete AFTER DELETE ON uploader_stats BEGIN
+            UPDATE global_stats SET value = value - 1 WHERE name = 'uploaders';
+        END;
+
+        -- Bundles: ordered lists of unique_ids shared with one link
+        CREATE TABLE IF NOT EXISTS bundles (
+            bundle_id TEXT PRIMARY KEY,
+            owner_id INTEGER NOT NULL,
+            created_at TEXT NOT NULL,
+            files TEXT NOT NULL  -- JSON array of unique_ids
+        );
+
+        -- Filename search: words of each file name, and the trigrams of every word
+        CREATE TABLE IF NOT EXISTS file_terms (
+            term TEXT NOT NULL,
+            unique_id TEXT NOT NULL,
+            PRIMARY KEY (term, unique_id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_file_terms_file ON file_terms (unique_id);
+        CREATE TABLE IF NOT EXISTS term_trigrams (
+            trigram TEXT NOT NULL,
+            term TEXT NOT NULL,
+            PRIMARY KEY (trigram, term)
+        ) WITHOUT ROWID;
+        CREATE TRIGGER IF NOT EXISTS trg_terms_delete AFTER DELETE ON files BEGIN
+            DELETE FROM file_terms WHERE unique_id = OLD.unique_id;
+        END;
+
+        -- Change log read by other processes to invalidate their cached records.
+        -- Download count flushes are left out - they would flood the log.
+        CREATE TABLE IF NOT EXISTS file_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            unique_id TEXT NOT NULL
+        );
+        CREATE TRIGGER IF NOT EXISTS trg_changes_insert AFTER INSERT ON files BEGIN
+            INSERT INTO file_changes (unique_id) VALUES (NEW.unique_id);
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_changes_update AFTER UPDATE OF
+            file_id, file_name, file_size, file_type, uploader_id, username, upload_date,
+            channel_message_id, share_link, file_unique_id ON files BEGIN
+            INSERT INTO file_changes (unique_id) VALUES (NEW.unique_id);
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_changes_delete AFTER DELETE ON files BEGIN
+            INSERT INTO file_changes (unique_id) VALUES (OLD.unique_id);
+        END;
+    """
+    COLUMNS = (
+        'unique_id', 'file_id', 'file_name', 'file_size', 'file_type', 'uploader_id',
+        'username', 'upload_date', 'channel_message_id', 'downloads', 'share_link', 'file_unique_id'
     )
+    CHANGES_KEPT = 10000  # Change log entries kept for lagging processes
 
-async def store_file_in_channel(context, file_obj, file_type):
-    """Store file in the files channel and return message ID"""
-    try:
-        if file_type == 'document':
-            msg = await context.bot.send_document(
-                chat_id=FILES_CHANNEL_ID,
-                document=file_obj.file_id
+    def __init__(self, path=DATABASE_FILE, seed_file=CACHE_FILE, seed_bundles_file=BUNDLES_FILE):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        self._migrate()
+        self.conn.commit()
+
+        # Backfill counters for databases created before the triggers existed
+        if self._stat('files') is None and self.count() > 0:
+            self.rebuild_stats()
+
+        # Build the search index for databases created before it existed
+        if self.count() > 0 and self.conn.execute("SELECT 1 FROM file_terms LIMIT 1").fetchone() is None:
+            self.rebuild_search_index()
+
+        # Import the legacy JSON cache on first start
+        if self.count() == 0 and seed_file:
+            records = load_json_records(seed_file)
+            if records:
+                self.save_many(records.items())
+                logger.info(f"Imported {len(records)} records from {seed_file}")
+        if seed_bundles_file and self.conn.execute("SELECT 1 FROM bundles LIMIT 1").fetchone() is None:
+            bundles = load_json_records(seed_bundles_file)
+            if bundles:
+                self.save_bundles(bundles.items())
+                logger.info(f"Imported {len(bundles)} bundles from {seed_bundles_file}")
+        logger.info(f"SQLite backend opened {path} ({self.count()} records)")
+
+    def _migrate(self):
+        """Add columns, indexes and triggers introduced after the first schema version"""
+        trigger = self.conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'trg_changes_update'"
+        ).fetchone()
+        if trigger and 'UPDATE OF' not in trigger[0]:
+            # Older databases logged download count updates too
+            self.conn.execute("DROP TRIGGER trg_changes_update")
+            self.conn.executescript(self.SCHEMA)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(files)")}
+        if 'file_unique_id' not in columns:
+            self.conn.execute("ALTER TABLE files ADD COLUMN file_unique_id TEXT")
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_files_content ON files (file_unique_id, file_size) "
+            "WHERE file_unique_id IS NOT NULL"
+        )
+
+    def rebuild_stats(self):
+        """Recompute all counters with a full scan"""
+        with self.conn:
+            self.conn.execute("DELETE FROM uploader_stats")
+            self.conn.execute("DELETE FROM global_stats")
+            self.conn.execute(
+                "INSERT INTO uploader_stats (uploader_id, files, downloads) "
+                "SELECT uploader_id, COUNT(*), SUM(downloads) FROM files GROUP BY uploader_id"
             )
-        elif file_type == 'photo':
-            msg = await context.bot.send_photo(
-                chat_id=FILES_CHANNEL_ID,
-                photo=file_obj.file_id
+            self.conn.execute(
+                "INSERT INTO global_stats (name, value) "
+                "SELECT 'files', COUNT(*) FROM files UNION ALL "
+                "SELECT 'downloads', COALESCE(SUM(downloads), 0) FROM files UNION ALL "
+                "SELECT 'bytes', COALESCE(SUM(file_size), 0) FROM files UNION ALL "
+                "SELECT 'type:' || file_type, COUNT(*) FROM files GROUP BY file_type"
             )
-        elif file_type == 'video':
-            msg = await context.bot.send_video(
-                chat_id=FILES_CHANNEL_ID,
-                video=file_obj.file_id
+        logger.info("Rebuilt SQLite statistics counters")
+
+    def _index_names(self, items):
+        """Replace the search words of (unique_id, file_name) pairs (inside a transaction)"""
+        self.conn.executemany("DELETE FROM file_terms WHERE unique_id = ?", [(uid,) for uid, name in items])
+        postings = [(term, uid) for uid, name in items for term in tokenize_name(name)]
+        self.conn.executemany("INSERT OR IGNORE INTO file_terms (term, unique_id) VALUES (?, ?)", postings)
+        terms = {term for term, uid in postings if len(term) >= 3}
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO term_trigrams (trigram, term) VALUES (?, ?)",
+            [(trigram, term) for term in terms for trigram in name_trigrams(term)]
+        )
+
+    def rebuild_search_index(self):
+        """Re-tokenize every file name with a full scan"""
+        with self.conn:
+            self.conn.execute("DELETE FROM file_terms")
+            self.conn.execute("DELETE FROM term_trigrams")
+            cursor = self.conn.execute("SELECT unique_id, file_name FROM files")
+            while True:
+                rows = cursor.fetchmany(10000)
+                if not rows:
+                    break
+                self._index_names(rows)
+        logger.info("Rebuilt SQLite search index")
+
+    def _stat(self, name):
+        """Get a global counter value, or None if it was never set"""
+        row = self.conn.execute("SELECT value FROM global_stats WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def _row_to_record(self, row):
+        """Convert a database row to (unique_id, FileRecord)"""
+        # Columns: unique_id, file_id .. downloads, share_link (derived), file_unique_id
+        return row[0], FileRecord(*row[:10], file_unique_id=row[11])
+
+    def _record_to_row(self, unique_id, file_data):
+        """Convert file_data to a database row"""
+        return (
+            unique_id,
+            file_data['file_id'],
+            file_data['file_name'],
+            file_data.get('file_size') or 0,
+            file_data.get('file_type', 'document'),
+            file_data['uploader_id'],
+            file_data.get('username'),
+            file_data['upload_date'],
+            file_data.get('channel_message_id'),
+            file_data.get('downloads', 0),
+            file_data.get('share_link'),
+            file_data.get('file_unique_id')
+        )
+
+    def _select(self, where="", params=()):
+        """Run a SELECT over all columns and return records"""
+        cursor = self.conn.execute(
+            f"SELECT {', '.join(self.COLUMNS)} FROM files {where}", params
+        )
+        return [self._row_to_record(row) for row in cursor]
+
+    def load(self, unique_id):
+        """Get a single record by unique ID"""
+        records = self._select("WHERE unique_id = ?", (unique_id,))
+        return records[0][1] if records else None
+
+    def save(self, unique_id, file_data):
+        """Insert or replace a record"""
+        self.save_many([(unique_id, file_data)])
+
+    def save_many(self, items):
+        """Insert or replace many records in one transaction"""
+        placeholders = ', '.join('?' for _ in self.COLUMNS)
+        # Upsert (not REPLACE) so the update trigger keeps the counters right
+        updates = ', '.join(f"{col} = excluded.{col}" for col in self.COLUMNS[1:])
+        rows = [self._record_to_row(uid, d) for uid, d in items]
+        with self.conn:
+            self.conn.executemany(
+                f"INSERT INTO files ({', '.join(self.COLUMNS)}) VALUES ({placeholders}) "
+                f"ON CONFLICT (unique_id) DO UPDATE SET {updates}",
+                rows
             )
-        elif file_type == 'audio':
-            msg = await context.bot.send_audio(
-                chat_id=FILES_CHANNEL_ID,
-                audio=file_obj.file_id
+            self._index_names([(row[0], row[2]) for row in rows])
+
+    def add_downloads_many(self, counts):
+        """Add a batch of download counts in one transaction, returns the new counts"""
+        updated = {}
+        with self.conn:
+            for unique_id, count in counts.items():
+                row = self.conn.execute(
+                    "UPDATE files SET downloads = downloads + ? WHERE unique_id = ? RETURNING downloads",
+                    (count, unique_id)
+                ).fetchone()
+                if row:
+                    updated[unique_id] = row[0]
+        return updated
+
+    def load_bundle(self, bundle_id):
+        """Get a bundle ({'files', 'owner_id', 'created_at'}) by ID"""
+        row = self.conn.execute(
+            "SELECT owner_id, created_at, files FROM bundles WHERE bundle_id = ?", (bundle_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {'files': json.loads(row[2]), 'owner_id': row[0], 'created_at': row[1]}
+
+    def save_bundles(self, items):
+        """Insert or replace bundles in one transaction"""
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO bundles (bundle_id, owner_id, created_at, files) VALUES (?, ?, ?, ?)",
+                [(bundle_id, b['owner_id'], b['created_at'], json.dumps(b['files'])) for bundle_id, b in items]
             )
-        elif file_type == 'voice':
-            msg = await context.bot.send_voice(
-                chat_id=FILES_CHANNEL_ID,
-                voice=file_obj.file_id
+
+    def find_by_content(self, file_unique_id, file_size):
+        """Get records with the same Telegram content identity, oldest first"""
+        return self._select(
+            "WHERE file_unique_id = ? AND file_size = ? ORDER BY upload_date",
+            (file_unique_id, file_size or 0)
+        )
+
+    def user_stats(self, user_id):
+        """Get (files, downloads) for an uploader"""
+        row = self.conn.execute(
+            "SELECT files, downloads FROM uploader_stats WHERE uploader_id = ?", (user_id,)
+        ).fetchone()
+        return (row[0], row[1]) if row else (0, 0)
+
+    def page_files(self, user_id=None, before=None, after=None, limit=15):
+        """Get one page of records (oldest first) next to a (upload_date, unique_id) cursor
+
+        Returns (items, has_older, has_newer). Without a cursor the newest page is returned.
+        """
+        scope, scope_params = ("uploader_id = ? AND ", (user_id,)) if user_id is not None else ("", ())
+        if after is not None:
+            items = self._select(
+                f"WHERE {scope}(upload_date, unique_id) > (?, ?) "
+                "ORDER BY upload_date, unique_id LIMIT ?",
+                scope_params + tuple(after) + (limit,)
             )
         else:
-            return None
-        
-        logger.info(f"Stored {file_type} file in channel, message_id: {msg.message_id}")
-        return msg.message_id
-    except Exception as e:
-        logger.error(f"Error storing file in channel: {e}")
-        return None
+            cursor_filter = "(upload_date, unique_id) < (?, ?)" if before is not None else "1"
+            items = self._select(
+                f"WHERE {scope}{cursor_filter} ORDER BY upload_date DESC, unique_id DESC LIMIT ?",
+                scope_params + (tuple(before) if before is not None else ()) + (limit,)
+            )
+            items.reverse()
+        if not items:
+            return items, False, False
 
-async def log_to_channel(context, log_data):
-    """Log metadata and user activity to logs channel"""
-    try:
-        # Store complete metadata as JSON in the log for easy recovery
-        metadata_json = json.dumps({
-            'unique_id': log_data['unique_id'],
-            'file_id': log_data['file_id'],
-            'file_name': log_data['file_name'],
-            'file_size_bytes': log_data.get('file_size_bytes'),
-            'file_type': log_data['file_type'],
-            'uploader_id': log_data['uploader_id'],
-            'username': log_data.get('username'),
-            'upload_date': log_data['upload_date'],
-            'channel_message_id': log_data['channel_message_id']
-        }, indent=2)
-        
-        log_text = (
-            f"📊 *File Upload Log*\n\n"
-            f"🆔 *Unique ID:* `{log_data['unique_id']}`\n"
-            f"📄 *File Name:* `{log_data['file_name']}`\n"
-            f"💾 *Size:* {log_data['file_size']}\n"
-            f"👤 *Uploader ID:* `{log_data['uploader_id']}`\n"
-            f"👤 *Username:* @{log_data.get('username', 'N/A')}\n"
-            f"📅 *Date:* {log_data['upload_date']}\n"
-            f"📍 *Channel Message ID:* {log_data['channel_message_id']}\n"
-            f"🔗 *Share Link:* {log_data['share_link']}\n\n"
-            f"```json\n{metadata_json}\n```"
-        )
-        await context.bot.send_message(
-            chat_id=LOGS_CHANNEL_ID,
-            text=log_text,
-            parse_mode='Markdown'
+        def exists(comparison, key):
+            return self.conn.execute(
+                f"SELECT 1 FROM files WHERE {scope}(upload_date, unique_id) {comparison} (?, ?) LIMIT 1",
+                scope_params + key
+            ).fetchone() is not None
+
+        first_uid, first = items[0]
+        last_uid, last = items[-1]
+        return (
+            items,
+            exists('<', (first['upload_date'], first_uid)),
+            exists('>', (last['upload_date'], last_uid))
         )
-        logger.info(f"Logged file {log_data['unique_id']} to logs channel")
-    except Exception as e:
-        logger.error(f"Error logging to channel: {e}")
 
-async def log_download_activity(context, file_id, file_name, downloader_user):
-    """Log download activity with detailed user information"""
-    try:
-        download_log = {
-            'file_id': file_id,
-            'file_name': file_name,
-            'downloader_id': downloader_user.id,
-            'downloader_username': downloader_user.username,
-            'downloader_first_name': downloader_user.first_name,
-            'downloader_last_name': downloader_user.last_name,
-            'download_timestamp': datetime.now().isoformat()
-        }
-        
-        download_json = json.dumps(download_log, indent=2, ensure_ascii=False)
-        
-        log_text = (
-            f"📥 *Download Activity*\n\n"
-            f"🆔 *File ID:* `{file_id}`\n"
-            f"📄 *File:* `{file_name}`\n\n"
-            f"👤 *Downloader Info:*\n"
-            f"├ *User ID:* `{downloader_user.id}`\n"
-            f"├ *Username:* @{downloader_user.username or 'N/A'}\n"
-            f"├ *Name:* {downloader_user.first_name} {downloader_user.last_name or ''}\n"
-            f"└ *Time:* {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
-            f"```json\n{download_json}\n```"
+    def _match_terms(self, query):
+        """Indexed words containing a query word but not starting with it (trigram lookup)"""
+        trigrams = sorted(name_trigrams(query))
+        candidates = " INTERSECT ".join("SELECT term FROM term_trigrams WHERE trigram = ?" for _ in trigrams)
+        rows = self.conn.execute(
+            f"SELECT term FROM ({candidates}) WHERE instr(term, ?) > 1 LIMIT ?",
+            (*trigrams, query, SEARCH_MAX_EXPANSION)
         )
-        
-        await context.bot.send_message(
-            chat_id=LOGS_CHANNEL_ID,
-            text=log_text,
-            parse_mode='Markdown'
+        return [row[0] for row in rows]
+
+    def search_files(self, terms, user_id=None, order='downloads', offset=0, limit=10):
+        """Get one page of records whose name matches every query word
+
+        A query word matches the indexed words it starts, plus (from three
+        characters on) the words containing it. Ranked by downloads (then
+        recency) or by recency alone. Returns (items, has_more).
+        """
+        if not terms:
+            return [], False
+        # Rows of file_terms matching each query word: its prefix range, or a word containing it
+        word_filters = []
+        for query in terms:
+            inner = self._match_terms(query) if len(query) >= 3 else []
+            in_inner = f" OR term IN ({', '.join('?' for _ in inner)})" if inner else ""
+            word_filters.append((f"((term >= ? AND term < ?){in_inner})", (query, query + '\U0010ffff', *inner)))
+        # Either collect the matches of the rarest word and sort them, or walk the
+        # files in ranking order and keep those whose words all match. The walk
+        # visits about (offset + limit) * files / results rows (results estimated
+        # as if the words were independent), so it wins for common words. Counting
+        # stops at count_limit: past it the walk is used either way.
+        files = max(1, self.count() if user_id is None else self.user_stats(user_id)[0])
+        visits = (offset + limit + 1) * files
+        count_limit = int(2 * visits ** 0.5) + 1
+        matches = [
+            self.conn.execute(
+                f"SELECT count(*) FROM (SELECT 1 FROM file_terms WHERE {word_filter} LIMIT ?)",
+                (*word_params, count_limit)
+            ).fetchone()[0]
+            for word_filter, word_params in word_filters
+        ]
+        results = files
+        for count in matches:
+            results *= count / files
+        walk = min(matches) >= count_limit or visits < min(matches) * max(results, 1)
+        rarest = matches.index(min(matches))
+        filters, params = [], []
+        if user_id is not None:
+            filters.append("uploader_id = ?")
+            params.append(user_id)
+        for i, (word_filter, word_params) in enumerate(word_filters):
+            if walk or i != rarest:
+                filters.append(
+                    "EXISTS (SELECT 1 FROM file_terms WHERE file_terms.unique_id = files.unique_id "
+                    f"AND {word_filter})"
+                )
+            else:
+                filters.append(f"unique_id IN (SELECT unique_id FROM file_terms WHERE {word_filter})")
+            params.extend(word_params)
+        ordering = "upload_date DESC" if order == 'recent' else "downloads DESC, upload_date DESC"
+        if not walk:
+            ordering = "+" + ordering.replace(", ", ", +")  # Unary + keeps the planner off the ranking indexes
+        items = self._select(
+            f"WHERE {' AND '.join(filters)} ORDER BY {ordering}, unique_id DESC LIMIT ? OFFSET ?",
+            (*params, limit + 1, offset)
         )
-        logger.info(f"Logged download activity for file {file_id} by user {downloader_user.id}")
-    except Exception as e:
-        logger.error(f"Error logging download activity: {e}")
+        return items[:limit], len(items) > limit
 
-async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle received files and generate shareable links."""
-    message = update.message
-    user = message.from_user
-    
-    # Send processing message
-    processing_msg = await message.reply_text("⏳ Processing your file... Please wait.")
-    
-    # Determine file type and get file object
-    file_type = None
-    if message.document:
-        file = message.document
-        file_name = file.file_name
-        file_size = file.file_size
-        file_type = 'document'
-    elif message.photo:
-        file = message.photo[-1]  # Get highest quality
-        file_name = f"photo_{file.file_unique_id}.jpg"
-        file_size = file.file_size
-        file_type = 'photo'
-    elif message.video:
-        file = message.video
-        file_name = file.file_name or f"video_{file.file_unique_id}.mp4"
-        file_size = file.file_size
-        file_type = 'video'
-    elif message.audio:
+    def count(self):
+        """Number of stored records"""
+        files = self._stat('files')
+        if files is None:
+            return self.conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+        return files
+
+    def stats_snapshot(self):
+        """Get the global statistics counters"""
+        counters = dict(self.conn.execute("SELECT name, value FROM global_stats"))
+        return {
+            'total_files': counters.get('files', 0),
+            'total_downloads': counters.get('downloads', 0),
+            'total_uploaders': counters.get('uploaders', 0),
+            'total_bytes': counters.get('bytes', 0),
+            'files_by_type': {
+                name[5:]: value for name, value in counters.items()
+                if name.startswith('type:') and value > 0
+            }
+        }
+
+    def latest_change(self):
+        """Sequence number of the newest change log entry"""
+        return self.conn.execute("SELECT max(seq) FROM file_changes").fetchone()[0] or 0
+
+    def changes_since(self, seq):
+        """Return (latest seq, unique ids changed after seq), or None for the ids if
+        the entries after seq were already pruned"""
+        rows = self.conn.execute(
+            "SELECT seq, unique_id FROM file_changes WHERE seq > ? ORDER BY seq", (seq,)
+        ).fetchall()
+        if not rows:
+            return seq, []
+        if rows[0][0] != seq + 1:
+            return rows[-1][0], None
+        return rows[-1][0], {row[1] for row in rows}
+
+    def prune_changes(self):
+        """Drop change log entries every process has had time to read"""
+        with self.conn:
+            self.conn.execute(
+                "DELETE FROM file_changes WHERE seq <= (SELECT max(seq) FROM file_changes) - ?",
+                (self.CHANGES_KEPT,)
+            )
+
+    def close(self):
+        """Close the database connection"""
+        self.conn.close()
+
+def create_storage_backend():
+    """Create the metadata backend selected by STORAGE_BACKEND"""
+    if STORAGE_BACKEND == 'json':
+        return JSONFileBackend(CACHE_FILE)
+    if STORAGE_BACKEND != 'sqlite':
+        logger.warning(f"Unknown STORAGE_BACKEND '{STORAGE_BACKEND}', using sqlite")
+    return SQLiteBackend(DATABASE_FILE)
+
+class RecordCache:
+    """Size-bounded LRU of file records with a TTL and negative entries for unknown IDs"""
+    MISS = object()  # Returned by get() when the backend has to be asked
+
+    def __init__(self, max_size=RECORD_CACHE_SIZE, ttl=RECORD_CACHE_TTL, negative_ttl=NEGATIVE_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.entries = OrderedDict()  # unique_id -> (expires_at, record or None), oldest use first
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, unique_id):
+        """Cached record, None for a known-missing ID, or MISS"""
+        entry = self.entries.get(unique_id)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self.entries[unique_id]
+            self.misses += 1
+            return self.MISS
+        self.entries.move_to_end(unique_id)
+        if entry[1] is None:
+            self.negative_hits += 1
+        else:
+            self.hits += 1
+        return entry[1]
+
+    def peek(self, unique_id):
+        """Cached record without touching LRU order or counters"""
+        entry = self.entries.get(unique_id)
+        return entry[1] if entry is not None else None
+
+    def put(self, unique_id, record):
+        """Cache a record, or None to remember that the ID does not exist"""
+        ttl = self.ttl if record is not None else self.negative_ttl
+        self.entries[unique_id] = (time.monotonic() + ttl, record)
+        self.entries.move_to_end(unique_id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, unique_id):
+        """Drop one entry (everything for None)"""
+        if unique_id is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(unique_id, None)
+
+    def hit_ratio(self):
+        lookups = self.hits + self.negative_hits + self.misses
+        return (self.hits + self.negative_hits) / lookups if lookups else 0.0
+
+    def stats(self):
+        return {
+            'size': len(self.entries),
+            'hits': self.hits,
+            'negative_hits': self.negative_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+class FileStorage:
+    """File metadata storage backed by a persistent backend"""
+    def __init__(self, backend=None):
+        self.bot = None
+        self.backend = backend or create_storage_backend()
+        self.cache = RecordCache()  # Hot records (and known-missing IDs)
+        self.pending_downloads = {}  # Download counts not yet written to the backend
+        self.pending_total = 0
+        self.flusher = None
+        self.change_seq = self.backend.latest_change()
+        self.listeners = []  # (callback, run on download counts); called with a changed unique_id, or None for everything
+        logger.info(f"FileStorage initialized - using {type(self.backend).__name__}")
+
+    def set_bot(self, bot):
+        """Set bot instance for channel operations"""
+        self.bot = bot
+    
+    def add_listener(self, callback, downloads=True):
+        """Register a callback run whenever a record changes
+
+        With downloads=False it is skipped when only download counts changed.
+        """
+        self.listeners.append((callback, downloads))
+
+    def _notify(self, unique_ids, downloads_only=False):
+        for callback, downloads in self.listeners:
+            if downloads_only and not downloads:
+                continue
+            if unique_ids is None:
+                callback(None)
+            else:
+                for unique_id in unique_ids:
+                    callback(unique_id)
+
+    def import_records(self, items):
+        """Bulk-insert recovered records that are not stored yet, returns count"""
+        missing = [(uid, d) for uid, d in items if self.backend.load(uid) is None]
+        if missing:
+            self.backend.save_many(missing)
+            for uid, d in missing:
+                self.cache.invalidate(uid)  # May be cached as missing
+            self._notify([uid for uid, d in missing])
+        return len(missing)
+
+    async def add_to_cache(self, unique_id, file_data):
+        """Persist file data and add it to the memory cache (channel logging handled separately)"""
+        file_data = FileRecord.from_dict(unique_id, file_data)
+        self.backend.save(unique_id, file_data)
+        self.cache.put(unique_id, file_data)
+        self._notify([unique_id])
+        logger.info(f"Stored file {unique_id} in {type(self.backend).__name__}")
+
+    async def add_many_to_cache(self, items):
+        """Persist several (unique_id, file_data) records with one write"""
+        records = [(unique_id, FileRecord.from_dict(unique_id, file_data)) for unique_id, file_data in items]
+        if not records:
+            return
+        self.backend.save_many(records)
+        for unique_id, record in records:
+            self.cache.put(unique_id, record)
+        self._notify([unique_id for unique_id, record in records])
+        logger.info(f"Stored {len(records)} files in {type(self.backend).__name__}")
+
+    def save_bundle(self, bundle_id, unique_ids, owner_id, created_at=None):
+        """Store an ordered list of files under one bundle ID"""
+        bundle = {
+            'files': list(unique_ids),
+            'owner_id': owner_id,
+            'created_at': created_at or datetime.now().isoformat()
+        }
+        self.backend.save_bundles([(bundle_id, bundle)])
+        return bundle
+
+    def get_bundle(self, bundle_id):
+        """Get a bundle ({'files', 'owner_id', 'created_at'}) or None"""
+        return self.backend.load_bundle(bundle_id)
+
+    def import_bundles(self, items):
+        """Store recovered (bundle_id, bundle) pairs that are missing, returns count"""
+        missing = [(bundle_id, bundle) for bundle_id, bundle in items if self.backend.load_bundle(bundle_id) is None]
+        if missing:
+            self.backend.save_bundles(missing)
+        return len(missing)
+
+    def exists(self, unique_id):
+        """Check whether a file ID is taken"""
+        return self.cache.peek(unique_id) is not None or self.backend.load(unique_id) is not None
+
+    def get_from_cache(self, unique_id):
+        """Get file data from memory cache, loading it from the backend on a miss"""
+        file_data = self.cache.get(unique_id)
+        if file_data is RecordCache.MISS:
+            file_data = self.backend.load(unique_id)
+            self.cache.put(unique_id, file_data)  # Unknown IDs are cached as missing
+        return file_data
+
+    async def update_downloads(self, unique_id):
+        """Count a download; it is persisted by the next batched flush"""
+        self.pending_downloads[unique_id] = self.pending_downloads.get(unique_id, 0) + 1
+        self.pending_total += 1
+        if self.pending_total >= DOWNLOAD_FLUSH_THRESHOLD:
+            self.flush_downloads()
+
+    def flush_downloads(self):
+        """Write pending download counts to the backend in one batch"""
+        if not self.pending_downloads:
+            return 0
+        pending = self.pending_downloads
+        self.pending_downloads = {}
+        self.pending_total = 0
+        try:
+            updated = self.backend.add_downloads_many(pending)
+        except Exception as e:
+            # Keep the counts for the next flush
+            logger.error(f"Error flushing download counts: {e}")
+            for unique_id, count in pending.items():
+                self.pending_downloads[unique_id] = self.pending_downloads.get(unique_id, 0) + count
+                self.pending_total += count
+            return 0
+        for unique_id, downloads in updated.items():
+            file_data = self.cache.peek(unique_id)
+            if file_data is not None:
+                file_data['downloads'] = downloads
+        self._notify(updated, downloads_only=True)
+        logger.info(f"Flushed {sum(pending.values())} downloads for {len(updated)} files")
+        return len(updated)
+
+    def sync_cache(self):
+        """Drop cached records that other processes changed"""
+        try:
+            self.change_seq, changed = self.backend.changes_since(self.change_seq)
+        except sqlite3.Error as e:
+            logger.error(f"Error reading change log: {e}")
+            return
+        if changed is None:
+            self.cache.invalidate(None)
+        else:
+            for unique_id in changed:
+                self.cache.invalidate(unique_id)
+        if changed is None or changed:
+            self._notify(changed)
+
+    def start_flusher(self, interval=None):
+        """Start the periodic download count flush and cache sync"""
+        if self.flusher is None:
+            self.flusher = asyncio.create_task(self._run_flusher(interval or DOWNLOAD_FLUSH_INTERVAL))
+
+    async def stop_flusher(self):
+        """Stop the periodic flush and write whatever is pending"""
+        if self.flusher is not None:
+            self.flusher.cancel()
+            try:
+                await self.flusher
+            except asyncio.CancelledError:
+                pass
+            self.flusher = None
+        self.flush_downloads()
+
+    async def _run_flusher(self, interval):
+        next_flush = time.monotonic() + interval
+        while True:
+            await asyncio.sleep(min(interval, CACHE_SYNC_INTERVAL))
+            self.sync_cache()
+            if time.monotonic() >= next_flush:
+                self.flush_downloads()
+                try:
+                    self.backend.prune_changes()
+                except sqlite3.Error as e:
+                    logger.error(f"Error pruning change log: {e}")
+                next_flush = time.monotonic() + interval
+
+    def find_by_content(self, file_unique_id, file_size):
+        """Get stored files with the same content (Telegram file_unique_id and size)"""
+        return self.backend.find_by_content(file_unique_id, file_size)
+
+    def get_user_stats(self, user_id):
+        """Get (files uploaded, total downloads) for a user"""
+        return self.backend.user_stats(user_id)
+
+    def get_files_page(self, user_id=None, before=None, after=None, limit=15):
+        """Get one page of files (oldest first) as (items, has_older, has_newer)"""
+        return self.backend.page_files(user_id, before, after, limit)
+
+    def search_files(self, terms, user_id=None, order='downloads', offset=0, limit=SEARCH_PAGE_SIZE):
+        """Get one page of files whose name matches every query word as (items, has_more)"""
+        return self.backend.search_files(terms, user_id, order, offset, limit)
+
+    def count_files(self):
+        """Get total number of stored files"""
+        return self.backend.count()
+
+    def get_stats(self):
+        """Get a snapshot of the global statistics counters"""
+        return self.backend.stats_snapshot()
+
+    def close(self):
+        """Flush and close the storage backend"""
+        self.flush_downloads()
+        self.backend.close()
+
+class IdAllocator:
+    """Time-ordered, collision-checked file ID generator
+
+    IDs pack (milliseconds since ID_EPOCH, worker number, sequence) into 63 bits,
+    like Snowflake IDs, and encode them as fixed-width base62. Sorting IDs as
+    strings sorts them by creation time, and workers with different numbers
+    never produce the same ID without coordinating.
+    """
+    ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+    ID_LENGTH = 11
+    ID_EPOCH_MS = 1735689600000  # 2025-01-01 UTC
+    WORKER_BITS = 10
+    SEQUENCE_BITS = 12
+
+    def __init__(self, worker_id=WORKER_ID):
+        if not 0 <= worker_id < (1 << self.WORKER_BITS):
+            raise ValueError(f"WORKER_ID must be between 0 and {(1 << self.WORKER_BITS) - 1}")
+        self.worker_id = worker_id
+        self.last_ms = 0
+        self.sequence = 0
+
+    @classmethod
+    def encode(cls, number):
+        """Encode a non-negative integer as fixed-width base62"""
+        chars = []
+        for _ in range(cls.ID_LENGTH):
+            number, digit = divmod(number, 62)
+            chars.append(cls.ALPHABET[digit])
+        return ''.join(reversed(chars))
+
+    def _next_number(self):
+        """Next (timestamp, worker, sequence) number, never going backwards"""
+        now_ms = max(int(time.time() * 1000) - self.ID_EPOCH_MS, self.last_ms)
+        if now_ms == self.last_ms:
+            self.sequence = (self.sequence + 1) & ((1 << self.SEQUENCE_BITS) - 1)
+            if self.sequence == 0:
+                # Sequence exhausted for this millisecond - borrow the next one
+                now_ms += 1
+        else:
+            self.sequence = 0
+        self.last_ms = now_ms
+        return (
+            (now_ms << (self.WORKER_BITS + self.SEQUENCE_BITS))
+            | (self.worker_id << self.SEQUENCE_BITS)
+            | self.sequence
+        )
+
+    def next_id(self, exists=None):
+        """Allocate a new ID, skipping any that exists(id) reports as taken"""
+        while True:
+            unique_id = self.encode(self._next_number())
+            if exists is None or not exists(unique_id):
+                return unique_id
+            logger.warning(f"ID collision on {unique_id}, allocating another")
+
+class LogRecovery:
+    """Rebuild file metadata by replaying the JSON blocks posted to the logs channel"""
+    SNAPSHOT_VERSION = 1
+    FIELDS = (
+        'file_id', 'file_name', 'file_size', 'file_type', 'uploader_id',
+        'username', 'upload_date', 'channel_message_id', 'downloads', 'file_unique_id'
+    )
+    DOWNLOADS = FIELDS.index('downloads')
+    REQUIRED = ('file_name', 'uploader_id', 'upload_date')
+
+    def __init__(self, snapshot_path=RECOVERY_SNAPSHOT_FILE):
+        self.snapshot_path = snapshot_path
+        self.last_message_id = 0
+        self.records = {}  # unique_id -> list of FIELDS values
+        self.bundles = {}  # bundle_id -> {'files', 'owner_id', 'created_at'}
+        self.pending = set()  # Records changed since the last restore
+        self.pending_bundles = set()
+        self.unsaved = 0  # Messages ingested since the last snapshot write
+        self.load_snapshot()
+
+    def load_snapshot(self):
+        """Load the snapshot and checkpoint from disk"""
+        snapshot = load_json_records(self.snapshot_path)
+        if not snapshot:
+            return
+        if snapshot.get('version') != self.SNAPSHOT_VERSION:
+            logger.warning("Recovery snapshot format changed, ignoring it")
+            return
+        self.last_message_id = snapshot.get('last_message_id', 0)
+        self.records = snapshot.get('records', {})
+        self.bundles = snapshot.get('bundles', {})
+        self.pending = set(snapshot.get('pending', [])) & self.records.keys()
+        self.pending_bundles = set(snapshot.get('pending_bundles', [])) & self.bundles.keys()
+        fields = snapshot.get('fields', [])
+        if fields != list(self.FIELDS):
+            # Remap records written with an older field list
+            positions = [fields.index(field) if field in fields else None for field in self.FIELDS]
+            defaults = [0 if field == 'downloads' else None for field in self.FIELDS]
+            self.records = {
+                uid: [values[pos] if pos is not None else defaults[i] for i, pos in enumerate(positions)]
+                for uid, values in self.records.items()
+            }
+        logger.info(f"Loaded recovery snapshot: {len(self.records)} records, checkpoint {self.last_message_id}")
+
+    def save_snapshot(self):
+        """Write the snapshot and checkpoint to disk"""
+        if not self.unsaved:
+            return
+        snapshot = {
+            'version': self.SNAPSHOT_VERSION,
+            'fields': list(self.FIELDS),
+            'last_message_id': self.last_message_id,
+            'records': self.records,
+            'bundles': self.bundles,
+            'pending': list(self.pending),
+            'pending_bundles': list(self.pending_bundles)
+        }
+        tmp_path = f"{self.snapshot_path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, self.snapshot_path)
+            self.unsaved = 0
+        except OSError as e:
+            logger.error(f"Error writing recovery snapshot: {e}")
+
+    @staticmethod
+    def extract_log_json(text):
+        """Extract the JSON block from a log message text"""
+        if not text:
+            return None
+        if "```json" in text:
+            json_start = text.find("```json") + 7
+            json_end = text.find("```", json_start)
+            candidate = text[json_start:json_end].strip()
+        else:
+            # Rendered messages keep the JSON block as plain text
+            json_start = text.find("{\n")
+            if json_start < 0:
+                json_start = text.find("{")
+            if json_start < 0:
+                return None
+            candidate = text[json_start:]
+        try:
+            block, _ = json.JSONDecoder().raw_decode(candidate)
+        except json.JSONDecodeError:
+            return None
+        return block if isinstance(block, dict) else None
+
+    def ingest_block(self, block):
+        """Apply one upload or download log block, returns True if it was used"""
+        if 'unique_id' in block and 'file_id' in block:
+            # Upload log
+            if any(block.get(key) is None for key in self.REQUIRED):
+                logger.warning(f"Skipping malformed upload log for {block['unique_id']}")
+                return False
+            unique_id = block['unique_id']
+            previous = self.records.get(unique_id)
+            self.records[unique_id] = [
+                block['file_id'],
+                block['file_name'],
+                block.get('file_size_bytes') or 0,
+                block.get('file_type', 'document'),
+                block['uploader_id'],
+                block.get('username'),
+                block['upload_date'],
+                block.get('channel_message_id'),
+                previous[self.DOWNLOADS] if previous else 0,
+                block.get('file_unique_id')
+            ]
+            self.pending.add(unique_id)
+            return True
+        if 'download_timestamp' in block and block.get('file_id') in self.records:
+            # Download log - 'file_id' holds the unique ID
+            self.records[block['file_id']][self.DOWNLOADS] += 1
+            self.pending.add(block['file_id'])
+            return True
+        if 'bundle_id' in block and isinstance(block.get('files'), list):
+            # Media group upload log - the new files plus the bundle's file order
+            if block.get('uploader_id') is None or block.get('upload_date') is None:
+                logger.warning(f"Skipping malformed bundle log for {block['bundle_id']}")
+                return False
+            shared = {key: block.get(key) for key in ('uploader_id', 'username', 'upload_date')}
+            for entry in block['files']:
+                if isinstance(entry, dict):
+                    self.ingest_block({**shared, **entry})
+            self.bundles[block['bundle_id']] = {
+                'files': block.get('file_ids', []),
+                'owner_id': block['uploader_id'],
+                'created_at': block['upload_date']
+            }
+            self.pending_bundles.add(block['bundle_id'])
+            return True
+        if isinstance(block.get('downloads'), list):
+            # Batched download log
+            used = [self.ingest_block(entry) for entry in block['downloads'] if isinstance(entry, dict)]
+            return any(used)
+        return False
+
+    def ingest_messages(self, messages):
+        """Ingest (message_id, text) pairs newer than the checkpoint, returns count used"""
+        ingested = 0
+        for message_id, text in messages:
+            if message_id is not None and message_id <= self.last_message_id:
+                continue
+            block = self.extract_log_json(text)
+            if block and self.ingest_block(block):
+                ingested += 1
+            if message_id is not None:
+                self.last_message_id = max(self.last_message_id, message_id)
+            self.unsaved += 1
+        return ingested
+
+    @staticmethod
+    def iter_export_messages(path):
+        """Yield (message_id, text) from a Telegram Desktop channel export (result.json)"""
+        with open(path, 'r', encoding='utf-8') as f:
+            export = json.load(f)
+        for message in export.get('messages', []):
+            text = message.get('text', '')
+            if isinstance(text, list):
+                # Formatted text is a list of entities - the JSON block is the 'pre' entity
+                pre_blocks = [part['text'] for part in text if isinstance(part, dict) and part.get('type') == 'pre']
+                text = pre_blocks[0] if pre_blocks else ''.join(
+                    part if isinstance(part, str) else part.get('text', '') for part in text
+                )
+            yield message.get('id'), text
+
+    def ingest_export(self, path):
+        """Ingest a channel export file and save the snapshot"""
+        ingested = self.ingest_messages(self.iter_export_messages(path))
+        self.save_snapshot()
+        logger.info(f"Ingested {ingested} log entries from {path} (checkpoint {self.last_message_id})")
+        return ingested
+
+    def iter_records(self, unique_ids=None):
+        """Yield (unique_id, file_data) for the given (default: all) recovered records"""
+        for unique_id in self.records if unique_ids is None else unique_ids:
+            file_data = dict(zip(self.FIELDS, self.records[unique_id]))
+            file_data['file_size_bytes'] = file_data['file_size']
+            file_data['share_link'] = None
+            yield unique_id, file_data
+
+    def restore(self, file_storage, full=False):
+        """Insert recovered records missing from storage, returns count
+
+        Only records ingested since the last restore are checked, unless
+        full is set or storage is empty (e.g. the database was lost).
+        """
+        if full or (self.records and not file_storage.count_files()):
+            records, bundles = None, self.bundles.keys()
+        elif self.pending or self.pending_bundles:
+            records, bundles = self.pending, self.pending_bundles
+        else:
+            return 0
+        restored = file_storage.import_records(self.iter_records(records))
+        restored_bundles = file_storage.import_bundles((bundle_id, self.bundles[bundle_id]) for bundle_id in bundles)
+        if self.pending or self.pending_bundles:
+            self.pending, self.pending_bundles = set(), set()
+            self.unsaved += 1  # Keep the snapshot from replaying them next start
+        if restored or restored_bundles:
+            logger.info(f"Restored {restored} records and {restored_bundles} bundles from recovery snapshot")
+        return restored
+
+class LogWriter:
+    """Background logs channel writer with batching and a durable on-disk outbox
+
+    Events are appended to a JSON-lines outbox before they are queued, and an
+    ack line is appended once they are delivered. Events left unacknowledged by
+    a crash are replayed on the next start.
+    """
+    MAX_MESSAGE_LENGTH = 3500  # Stay below Telegram's 4096 character limit
+    COMPACT_AFTER_LINES = 5000
+
+    def __init__(self, outbox_path=LOG_OUTBOX_FILE, max_queue=LOG_QUEUE_SIZE, batch_size=LOG_BATCH_SIZE,
+                 flush_interval=LOG_FLUSH_INTERVAL):
+        self.outbox_path = outbox_path
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.next_seq = 1
+        self.acked_seq = 0
+        self.queued_seq = 0
+        self.spilled = False  # Queue was full - newer events are only in the outbox
+        self.outbox_lines = 0
+        self.worker = None
+
+    def _read_outbox(self):
+        """Read pending (unacknowledged) events from the outbox"""
+        events = []
+        if not os.path.exists(self.outbox_path):
+            return events
+        with open(self.outbox_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Torn write from a crash
+                if 'ack' in entry:
+                    self.acked_seq = max(self.acked_seq, entry['ack'])
+                else:
+                    events.append(entry)
+                self.next_seq = max(self.next_seq, entry.get('seq', entry.get('ack', 0)) + 1)
+        return [event for event in events if event['seq'] > self.acked_seq]
+
+    def _append(self, entry):
+        """Append one line to the outbox"""
+        try:
+            with open(self.outbox_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.outbox_lines += 1
+        except OSError as e:
+            logger.error(f"Error writing log outbox: {e}")
+
+    def _compact(self):
+        """Rewrite the outbox with only the pending events"""
+        pending = self._read_outbox()
+        tmp_path = f"{self.outbox_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'ack': self.acked_seq, 'seq': self.acked_seq}) + "\n")
+            for event in pending:
+                f.write(json.dumps(event, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.outbox_path)
+        self.outbox_lines = len(pending) + 1
+
+    def _offer(self, event):
+        """Put an event on the queue, spilling to the outbox only when the queue is full"""
+        if self.spilled:
+            return
+        try:
+            self.queue.put_nowait(event)
+            self.queued_seq = event['seq']
+        except asyncio.QueueFull:
+            self.spilled = True
+            logger.warning("Log queue full, buffering events in the outbox")
+
+    def _refill(self):
+        """Move spilled events from the outbox back onto the queue"""
+        self.spilled = False
+        for event in self._read_outbox():
+            if event['seq'] > self.queued_seq:
+                self._offer(event)
+
+    def enqueue(self, kind, data):
+        """Persist a log event and queue it for delivery"""
+        event = {'seq': self.next_seq, 'kind': kind, 'data': data}
+        self.next_seq += 1
+        self._append(event)
+        self._offer(event)
+
+    def pending_count(self):
+        """Number of events not yet delivered"""
+        return self.next_seq - 1 - self.acked_seq
+
+    def start(self, bot):
+        """Replay the outbox and start the background worker"""
+        pending = self._read_outbox()
+        if pending:
+            logger.info(f"Replaying {len(pending)} undelivered log events from the outbox")
+        for event in pending:
+            self._offer(event)
+        self.worker = asyncio.create_task(self.run(bot))
+
+    async def stop(self, timeout=10):
+        """Try to deliver queued events, then stop the worker (leftovers stay in the outbox)"""
+        if self.worker is None:
+            return
+        try:
+            await asyncio.wait_for(self._drain(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Log writer stopped with {self.pending_count()} events left in the outbox")
+        self.worker.cancel()
+        try:
+            await self.worker
+        except asyncio.CancelledError:
+            pass
+        self.worker = None
+
+    async def _drain(self):
+        """Wait until every event, including spilled ones, is delivered"""
+        while self.pending_count() > 0 and not self.worker.done():
+            await asyncio.sleep(0.1)
+
+    async def run(self, bot):
+        """Worker loop: collect a batch, deliver it, acknowledge it"""
+        batch = None  # A batch that failed is retried before anything newer
+        backoff = 1
+        while True:
+            if batch is None:
+                if self.spilled and self.queue.empty():
+                    self._refill()
+                batch = [await self.queue.get()]
+                if self.queue.qsize() < self.batch_size - 1:
+                    # Give the batch a moment to fill
+                    await asyncio.sleep(self.flush_interval)
+                while len(batch) < self.batch_size and not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+
+            try:
+                await self._deliver(bot, batch)
+            except Exception as e:
+                # Acks are cumulative, so later batches must not be acked past this one
+                logger.error(f"Error delivering log batch, retrying in {backoff}s: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+                continue
+            backoff = 1
+            self.acked_seq = max(self.acked_seq, batch[-1]['seq'])
+            batch = None
+            self._append({'ack': self.acked_seq})
+            if self.outbox_lines > self.COMPACT_AFTER_LINES:
+                try:
+                    self._compact()
+                except OSError as e:
+                    logger.error(f"Error compacting log outbox: {e}")
+
+    async def _deliver(self, bot, batch):
+        """Send a batch, coalescing consecutive download events into one message"""
+        downloads = []
+        for event in batch:
+            if event['kind'] == 'download':
+                downloads.append(event['data'])
+                if len(format_download_log(downloads)) > self.MAX_MESSAGE_LENGTH:
+                    await self._send(bot, format_download_log(downloads[:-1]))
+                    downloads = downloads[-1:]
+                continue
+            if downloads:
+                await self._send(bot, format_download_log(downloads))
+                downloads = []
+            if event['kind'] == 'bundle':
+                await self._send(bot, format_bundle_log(event['data']))
+            else:
+                await self._send(bot, format_upload_log(event['data']))
+        if downloads:
+            await self._send(bot, format_download_log(downloads))
+
+    async def _send(self, bot, text):
+        """Send one message to the logs channel at log priority"""
+        backoff = 1
+        parse_mode = 'Markdown'
+        while True:
+            try:
+                await scheduler.send(
+                    bot.send_message, LOGS_CHANNEL_ID, PRIORITY_LOG,
+                    text=text, parse_mode=parse_mode
+                )
+                return
+            except RetryAfter as e:
+                logger.warning(f"Logs channel flood limit, retrying in {e.retry_after}s")
+                await asyncio.sleep(e.retry_after)
+            except BadRequest as e:
+                if parse_mode and "can't parse entities" in str(e).lower():
+                    # Keep the JSON block for recovery - resend as plain text
+                    logger.warning(f"Log message Markdown rejected, sending as plain text: {e}")
+                    parse_mode = None
+                    continue
+                # Permanent - drop the message so the queue keeps moving
+                logger.error(f"Error logging to channel: {e}")
+                return
+            except NetworkError as e:
+                # Transient - keep the event and retry with backoff
+                logger.warning(f"Network error logging to channel, retrying in {backoff}s: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+            except TelegramError as e:
+                logger.error(f"Error logging to channel: {e}")
+                return
+
+class MediaGroupCollector:
+    """Collect the messages of a media group (album) so they can be stored together
+
+    Telegram delivers an album as separate messages sharing a media_group_id;
+    the group is handed on once no new message arrived for `wait` seconds.
+    """
+    def __init__(self, wait=MEDIA_GROUP_WAIT):
+        self.wait = wait
+        self.groups = {}  # media_group_id -> (messages, timer task)
+
+    def add(self, message, callback):
+        """Buffer a message; callback(messages) runs once its group is complete"""
+        group_id = message.media_group_id
+        messages, timer = self.groups.get(group_id, ([], None))
+        if timer is not None:
+            timer.cancel()
+        messages.append(message)
+        self.groups[group_id] = (messages, asyncio.create_task(self._complete(group_id, callback)))
+
+    async def _complete(self, group_id, callback):
+        await asyncio.sleep(self.wait)
+        messages, _ = self.groups.pop(group_id)
+        messages.sort(key=lambda m: m.message_id)
+        try:
+            await callback(messages)
+        except Exception as e:
+            logger.error(f"Error handling media group {group_id}: {e}")
+
+class TokenBucket:
+    """Token bucket rate limiter"""
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        """Add the tokens earned since the last update"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Seconds until a token is available (0 if one is available now)"""
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self, now):
+        """Take one token"""
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, seconds):
+        """Stop handing out tokens for a while (after a RetryAfter)"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    def idle(self, now):
+        """True if the bucket is full and can be dropped"""
+        return self.delay(now) == 0 and self.tokens >= self.capacity
+
+class SendScheduler:
+    """Outbound Telegram send scheduler with global and per-chat token buckets
+
+    Callers wait for a slot in priority order; a sender blocked by its own chat
+    limit does not hold back other chats. RetryAfter blocks the chat's bucket
+    and the send is requeued.
+    """
+    MAX_BUCKETS = 10000
+
+    def __init__(self, global_rate=SEND_GLOBAL_RATE, chat_rate=SEND_CHAT_RATE,
+                 group_rate=SEND_GROUP_RATE, burst=SEND_BURST, max_retries=SEND_MAX_RETRIES):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.buckets = {}  # chat_id -> TokenBucket
+        self.waiters = []  # sorted list of (priority, seq, chat_id, future)
+        self.counter = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.dispatcher = None
+
+    def _bucket(self, chat_id):
+        """Get the bucket for a chat, pruning idle buckets when there are many"""
+        bucket = self.buckets.get(chat_id)
+        if bucket is None:
+            if len(self.buckets) >= self.MAX_BUCKETS:
+                now = time.monotonic()
+                self.buckets = {cid: b for cid, b in self.buckets.items() if not b.idle(now)}
+            # Negative IDs are groups and channels, which have a lower limit
+            rate = self.group_rate if chat_id < 0 else self.chat_rate
+            bucket = self.buckets[chat_id] = TokenBucket(rate, self.burst)
+        return bucket
+
+    async def acquire(self, chat_id, priority):
+        """Wait for a send slot to a chat"""
+        now = time.monotonic()
+        bucket = self._bucket(chat_id)
+        if not self.waiters and self.global_bucket.delay(now) <= 0 and bucket.delay(now) <= 0:
+            # Fast path - nothing queued and both buckets have tokens
+            self.global_bucket.consume(now)
+            bucket.consume(now)
+            return
+        
+        if self.dispatcher is None or self.dispatcher.done():
+            self.dispatcher = asyncio.create_task(self._dispatch())
+        future = asyncio.get_running_loop().create_future()
+        bisect.insort(self.waiters, (priority, next(self.counter), chat_id, future))
+        self.wakeup.set()
+        await future
+
+    async def _dispatch(self):
+        """Hand out slots to waiters in priority order as tokens become available"""
+        while True:
+            self.waiters = [waiter for waiter in self.waiters if not waiter[3].done()]
+            if not self.waiters:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            
+            now = time.monotonic()
+            wait = self.global_bucket.delay(now)
+            if wait <= 0:
+                wait = None
+                for index, (_, _, chat_id, future) in enumerate(self.waiters):
+                    bucket = self._bucket(chat_id)
+                    chat_wait = bucket.delay(now)
+                    if chat_wait <= 0:
+                        self.global_bucket.consume(now)
+                        bucket.consume(now)
+                        del self.waiters[index]
+                        future.set_result(None)
+                        wait = 0
+                        break
+                    wait = chat_wait if wait is None else min(wait, chat_wait)
+                if wait == 0:
+                    continue
+            
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def send(self, method, chat_id, priority, **kwargs):
+        """Call a Bot API send method for chat_id once a slot is free, retrying on RetryAfter"""
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            await self.acquire(chat_id, priority)
+            metrics.observe('send_wait_seconds', time.perf_counter() - start, priority=PRIORITY_NAMES[priority])
+            try:
+                return await method(chat_id=chat_id, **kwargs)
+            except RetryAfter as e:
+                self._bucket(chat_id).block(float(e.retry_after))
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(f"Flood limit for chat {chat_id}, requeued for {e.retry_after}s")
+
+    def queue_depth(self):
+        """Number of sends waiting for a slot"""
+        return len(self.waiters)
+
+    async def stop(self):
+        """Stop the dispatcher"""
+        if self.dispatcher is not None:
+            self.dispatcher.cancel()
+            try:
+                await self.dispatcher
+            except asyncio.CancelledError:
+                pass
+            self.dispatcher = None
+
+
+# Bot username, resolved once in post_init
+bot_username = None
+
+async def refresh_bot_identity(bot):
+    """Resolve and cache the bot username (call again after a token or username change)"""
+    global bot_username
+    me = await bot.get_me()
+    bot_username = me.username
+    render_cache.invalidate(None)  # Listing rows embed share links
+    logger.info(f"Bot identity resolved: @{bot_username}")
+    return bot_username
+
+def build_share_link(unique_id):
+    """Build the share link for a file from the cached bot username"""
+    return f"https://t.me/{bot_username}?start=file_{unique_id}"
+
+def build_bundle_link(bundle_id):
+    """Build the share link for a bundle of files"""
+    return f"https://t.me/{bot_username}?start=bundle_{bundle_id}"
+
+# Emoji shown for each file type
+TYPE_EMOJI = {
+    'document': '📄',
+    'photo': '🖼️',
+    'video': '🎥',
+    'audio': '🎵',
+    'voice': '🎤'
+}
+
+def type_emoji(file_type):
+    """Emoji for a file type"""
+    return TYPE_EMOJI.get(file_type, '📄')
+
+def format_size(file_size):
+    """Human readable file size (KB below 1 MB)"""
+    size_mb = file_size / (1024 * 1024)
+    return f"{size_mb:.2f} MB" if size_mb >= 1 else f"{file_size / 1024:.2f} KB"
+
+def render_download_card(unique_id, file_data):
+    """Card shown to non-admins opening a share link"""
+    file_type = file_data.get('file_type', 'document')
+    return (
+        f"🔒 *File Ready for Download*\n\n"
+        f"{type_emoji(file_type)} *File Details:*\n"
+        f"├ *Name:* `{file_data['file_name']}`\n"
+        f"├ *Size:* {format_size(file_data.get('file_size', 0))}\n"
+        f"├ *Type:* {file_type.title()}\n"
+        f"└ *Downloads:* {file_data.get('downloads', 0)}\n\n"
+        f"👇 Click below to get your file!\n\n"
+        f"💡 *Support us by joining our backup channel!*"
+    )
+
+def render_caption(unique_id, file_data):
+    """Caption sent with a delivered file"""
+    return (
+        f"{type_emoji(file_data.get('file_type', 'document'))} {file_data['file_name']}\n"
+        f"🆔 File ID: {unique_id}\n📥 Downloads: {file_data.get('downloads', 0)}"
+    )
+
+def render_file_row(unique_id, file_data, show_all):
+    """One entry of the My Files / All Files listing"""
+    max_name = 35 if show_all else 40
+    file_name = file_data['file_name']
+    
+    # Truncate long filenames
+    display_name = file_name[:max_name] + "..." if len(file_name) > max_name else file_name
+    
+    row = f"{type_emoji(file_data.get('file_type', 'document'))} *{display_name}*\n├ 🆔 ID: `{unique_id}`\n"
+    if show_all:
+        row += f"├ 👤 By: @{file_data.get('username', 'Unknown')} (`{file_data.get('uploader_id', 'N/A')}`)\n"
+    row += (
+        f"├ 💾 Size: {format_size(file_data.get('file_size', 0))}\n"
+        f"├ 📥 Downloads: {file_data.get('downloads', 0)}\n"
+        f"├ 📅 Date: {file_data['upload_date'][:10]}\n"
+        f"└ 🔗 [{'Link' if show_all else 'Share Link'}]({build_share_link(unique_id)})\n\n"
+    )
+    return row
+
+class RenderCache:
+    """Rendered text per file, dropped whenever the file's record changes
+
+    Download counts are flushed in batches, so cached counts lag by at most
+    DOWNLOAD_FLUSH_INTERVAL.
+    """
+    def __init__(self, max_files=RENDER_CACHE_SIZE):
+        self.max_files = max_files
+        self.entries = {}  # unique_id -> {kind: text}
+
+    def get(self, kind, unique_id, file_data, render):
+        """Cached text of one kind for a file, rendered with render(unique_id, file_data) on a miss"""
+        rendered = self.entries.get(unique_id)
+        if rendered is None:
+            if len(self.entries) >= self.max_files:
+                del self.entries[next(iter(self.entries))]  # Oldest first
+            rendered = self.entries[unique_id] = {}
+        text = rendered.get(kind)
+        if text is None:
+            text = rendered[kind] = render(unique_id, file_data)
+        return text
+
+    def invalidate(self, unique_id):
+        """Drop a file's rendered text (everything for None)"""
+        if unique_id is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(unique_id, None)
+
+# Bot API send method and file argument per file type
+SEND_METHODS = {
+    'document': ('send_document', 'document'),
+    'photo': ('send_photo', 'photo'),
+    'video': ('send_video', 'video'),
+    'audio': ('send_audio', 'audio'),
+    'voice': ('send_voice', 'voice')
+}
+
+# Inline query result class and its file argument per file type
+INLINE_RESULTS = {
+    'document': (InlineQueryResultCachedDocument, 'document_file_id'),
+    'photo': (InlineQueryResultCachedPhoto, 'photo_file_id'),
+    'video': (InlineQueryResultCachedVideo, 'video_file_id'),
+    'audio': (InlineQueryResultCachedAudio, 'audio_file_id'),
+    'voice': (InlineQueryResultCachedVoice, 'voice_file_id')
+}
+
+class DeliveryEngine:
+    """Deliver stored files by copying their files channel message, falling back to file_id
+
+    Which way worked is remembered per file, so a file whose channel message
+    cannot be copied is not retried on every download.
+    """
+    COPY = 'copy'
+    FILE_ID = 'file_id'
+
+    def __init__(self, mode=DELIVERY_MODE, max_files=RECORD_CACHE_SIZE):
+        self.mode = mode
+        self.max_files = max_files
+        self.capabilities = OrderedDict()  # unique_id -> COPY or FILE_ID
+        self.sent = {self.COPY: 0, self.FILE_ID: 0}
+        self.fallbacks = 0
+
+    def method_for(self, unique_id, file_data):
+        """Delivery method to try first for a file"""
+        if self.mode != self.COPY or not file_data.get('channel_message_id'):
+            return self.FILE_ID
+        return self.capabilities.get(unique_id, self.COPY)
+
+    def _remember(self, unique_id, method):
+        self.capabilities[unique_id] = method
+        self.capabilities.move_to_end(unique_id)
+        if len(self.capabilities) > self.max_files:
+            self.capabilities.popitem(last=False)
+
+    def invalidate(self, unique_id):
+        """Forget what worked for a file (everything for None)"""
+        if unique_id is None:
+            self.capabilities.clear()
+        else:
+            self.capabilities.pop(unique_id, None)
+
+    async def send(self, bot, chat_id, unique_id, file_data, caption, priority=PRIORITY_DOWNLOAD):
+        """Send one file to a chat; raises TelegramError if every method fails"""
+        fallback = False
+        if self.method_for(unique_id, file_data) == self.COPY:
+            try:
+                result = await scheduler.send(
+                    bot.copy_message, chat_id, priority,
+                    from_chat_id=FILES_CHANNEL_ID,
+                    message_id=file_data['channel_message_id'],
+                    caption=caption
+                )
+                self._remember(unique_id, self.COPY)
+                self.sent[self.COPY] += 1
+                return result
+            except (BadRequest, Forbidden) as e:
+                # Channel message deleted or not copyable, or no access to the channel
+                logger.warning(f"Copying file {unique_id} failed, sending by file_id: {e}")
+                fallback = True
+                self.fallbacks += 1
+        
+        method_name, argument = SEND_METHODS.get(file_data.get('file_type'), SEND_METHODS['document'])
+        result = await scheduler.send(
+            getattr(bot, method_name), chat_id, priority,
+            caption=caption, **{argument: file_data['file_id']}
+        )
+        if fallback:
+            # Use the file_id from now on - unless the user was the problem (e.g. blocked the bot)
+            self._remember(unique_id, self.FILE_ID)
+        self.sent[self.FILE_ID] += 1
+        return result
+
+class Metrics:
+    """In-process counters, latency histograms and gauges, rendered in Prometheus text format
+
+    Series per metric are capped at MAX_SERIES (the rest share an "other" label
+    value), so label values taken from callback data cannot grow without bound.
+    """
+    MAX_SERIES = 200
+
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = buckets
+        self.described = {}  # name -> (type, help text), in output order
+        self.counters = {}  # name -> {labels: [value]}
+        self.histograms = {}  # name -> {labels: [count per bucket..., +Inf count, sum]}
+        self.callbacks = {}  # name -> callback returning a value or {labels: value}
+
+    def describe(self, name, kind, text, callback=None):
+        """Declare a metric; a callback supplies its value(s) at scrape time"""
+        self.described[name] = (kind, text)
+        if callback is not None:
+            self.callbacks[name] = callback
+
+    def _series(self, table, name, labels, size):
+        series = table.setdefault(name, {})
+        key = tuple(sorted(labels.items()))
+        entry = series.get(key)
+        if entry is None:
+            if len(series) >= self.MAX_SERIES:
+                key = tuple((label, 'other') for label, _ in key)
+                entry = series.get(key)
+            if entry is None:
+                entry = series[key] = [0] * size
+        return entry
+
+    def inc(self, name, amount=1, **labels):
+        self._series(self.counters, name, labels, 1)[0] += amount
+
+    def observe(self, name, seconds, **labels):
+        entry = self._series(self.histograms, name, labels, len(self.buckets) + 2)
+        entry[bisect.bisect_left(self.buckets, seconds)] += 1
+        entry[-1] += seconds
+
+    def quantile(self, entry, q):
+        """Upper bucket bound below which a share q of a histogram's observations fall"""
+        total = sum(entry[:-1])
+        if not total:
+            return None
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), entry[:-1]):
+            seen += count
+            if seen >= q * total:
+                return bound
+        return float('inf')
+
+    def histogram_series(self, name):
+        """[(labels dict, call count, p50, p99)] for a histogram"""
+        return [
+            (dict(key), sum(entry[:-1]), self.quantile(entry, 0.5), self.quantile(entry, 0.99))
+            for key, entry in self.histograms.get(name, {}).items()
+        ]
+
+    def counter_total(self, name, **labels):
+        """Sum of a counter's series whose labels include the given ones"""
+        return sum(
+            entry[0] for key, entry in self.counters.get(name, {}).items()
+            if all(item in key for item in labels.items())
+        )
+
+    @staticmethod
+    def _labels(key):
+        if not key:
+            return ""
+        escaped = (
+            (label, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+            for label, value in key
+        )
+        return "{" + ",".join(f'{label}="{value}"' for label, value in escaped) + "}"
+
+    def render(self):
+        """All metrics in Prometheus text exposition format"""
+        lines = []
+        for name, (kind, text) in self.described.items():
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if name in self.callbacks:
+                try:
+                    values = self.callbacks[name]()
+                except Exception as e:
+                    logger.error(f"Error collecting metric {name}: {e}")
+                    continue
+                if not isinstance(values, dict):
+                    values = {(): values}
+                for key, value in values.items():
+                    lines.append(f"{name}{self._labels(key)} {value}")
+            elif kind == 'histogram':
+                for key, entry in self.histograms.get(name, {}).items():
+                    cumulative = 0
+                    for bound, count in zip(self.buckets + ('+Inf',), entry[:-1]):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{self._labels(key + (('le', bound),))} {cumulative}")
+                    lines.append(f"{name}_sum{self._labels(key)} {entry[-1]}")
+                    lines.append(f"{name}_count{self._labels(key)} {cumulative}")
+            else:
+                for key, entry in self.counters.get(name, {}).items():
+                    lines.append(f"{name}{self._labels(key)} {entry[0]}")
+        return "\n".join(lines) + "\n"
+
+def timed_handler(route=None):
+    """Decorator recording a handler's latency, labelled by route(update) when given"""
+    def decorate(handler):
+        @functools.wraps(handler)
+        async def wrapper(*args, **kwargs):
+            labels = {'handler': handler.__name__}
+            if route is not None:
+                labels['route'] = route(args[0])
+            start = time.perf_counter()
+            try:
+                return await handler(*args, **kwargs)
+            except Exception:
+                metrics.inc('bot_handler_errors_total', **labels)
+                raise
+            finally:
+                metrics.observe('bot_handler_seconds', time.perf_counter() - start, **labels)
+        return wrapper
+    return decorate
+
+def callback_route(update):
+    """Name of the callback route a button press goes to"""
+    route, _ = callback_router.resolve(update.callback_query.data or '')
+    return route.name if route is not None else 'unknown'
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPX request backend that counts and times every Bot API call per method"""
+    async def do_request(self, url, *args, **kwargs):
+        method = url.rsplit('/', 1)[-1]
+        start = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, *args, **kwargs)
+        except Exception:
+            metrics.inc('telegram_requests_total', method=method, result='network_error')
+            raise
+        finally:
+            metrics.observe('telegram_request_seconds', time.perf_counter() - start, method=method)
+        result = 'ok' if code == 200 else 'retry_after' if code == 429 else 'error'
+        metrics.inc('telegram_requests_total', method=method, result=result)
+        return code, payload
+
+# Metrics HTTP server runner, started in post_init when METRICS_PORT is set
+metrics_runner = None
+
+async def start_metrics_server(port=METRICS_PORT):
+    """Serve /metrics on METRICS_LISTEN:port, returns the runner to clean up"""
+    from aiohttp import web
+    
+    async def serve_metrics(request):
+        return web.Response(text=metrics.render(), content_type='text/plain', charset='utf-8',
+                            headers={'Cache-Control': 'no-store'})
+    
+    web_app = web.Application()
+    web_app.router.add_get('/metrics', serve_metrics)
+    runner = web.AppRunner(web_app)
+    await runner.setup()
+    await web.TCPSite(runner, METRICS_LISTEN, port).start()
+    logger.info(f"Metrics served on http://{METRICS_LISTEN}:{port}/metrics")
+    return runner
+
+# Initialize metrics (described here, fed by handlers, the scheduler and the request backend)
+metrics = Metrics()
+metrics.describe('bot_handler_seconds', 'histogram', "Update handler latency by handler and callback route")
+metrics.describe('bot_handler_errors_total', 'counter', "Update handlers that raised")
+metrics.describe('telegram_request_seconds', 'histogram', "Bot API call latency by method")
+metrics.describe('telegram_requests_total', 'counter', "Bot API calls by method and result (ok, error, retry_after, network_error)")
+metrics.describe('send_wait_seconds', 'histogram', "Time sends waited for a rate limit slot, by priority")
+
+class CallbackRoute:
+    """One callback route: its handler, encoded fields and guard"""
+    __slots__ = ('name', 'handler', 'code', 'version', 'fields', 'admin', 'answer')
+
+    def __init__(self, handler, code=None, version=1, fields=(), admin=False, answer=True):
+        self.name = handler.__name__
+        self.handler = handler
+        self.code = code
+        self.version = str(version)
+        self.fields = fields
+        self.admin = admin
+        self.answer = answer
+
+    def decode(self, payload, sep):
+        """Typed arguments from the data after the route code (ValueError if malformed)"""
+        if not self.fields:
+            return ()
+        parts = payload.split(sep, len(self.fields) - 1)
+        if len(parts) != len(self.fields):
+            raise ValueError(f"{self.name} expects {len(self.fields)} fields")
+        return tuple(field(part) for field, part in zip(self.fields, parts))
+
+class CallbackRouter:
+    """Button callback dispatch: exact data through a dict, coded data through a prefix table
+
+    Coded callback data is "<code>:<version>:<field>:...", each field converted
+    by the route's declared type. Buttons made before a route's version changed
+    are rejected as expired instead of being misread. Routes may also accept the
+    older "<legacy>_<field>_..." form so buttons already sent to users keep
+    working. Admin-only routes are guarded here, before the handler runs.
+    """
+    MAX_DATA_BYTES = 64  # Telegram's callback_data limit
+
+    def __init__(self):
+        self.exact_routes = {}  # data -> route
+        self.prefix_routes = {}  # code -> route
+        self.legacy_routes = {}  # old "<prefix>_" head -> route
+
+    def exact(self, *datas, admin=False, answer=True):
+        """Decorator routing fixed callback data to a handler(update, context)"""
+        def register(handler):
+            route = CallbackRoute(handler, admin=admin, answer=answer)
+            for data in datas:
+                self.exact_routes[data] = route
+            return handler
+        return register
+
+    def prefix(self, code, fields=(str,), version=1, legacy=None, admin=False, answer=True):
+        """Decorator routing "<code>:<version>:..." data to a handler(update, context, *fields)"""
+        def register(handler):
+            route = CallbackRoute(handler, code, version, fields, admin, answer)
+            self.prefix_routes[code] = route
+            if legacy:
+                self.legacy_routes[legacy] = route
+            return handler
+        return register
+
+    def data(self, code, *values):
+        """Encode callback data for a coded route"""
+        route = self.prefix_routes[code]
+        if len(values) != len(route.fields):
+            raise ValueError(f"{route.name} expects {len(route.fields)} fields")
+        data = ":".join((code, route.version) + tuple(str(value) for value in values))
+        if len(data.encode('utf-8')) > self.MAX_DATA_BYTES:
+            raise ValueError(f"Callback data for {route.name} is over {self.MAX_DATA_BYTES} bytes")
+        return data
+
+    def resolve(self, data):
+        """(route, typed arguments) for callback data, or (None, ()) if nothing matches"""
+        route = self.exact_routes.get(data)
+        if route is not None:
+            return route, ()
+        try:
+            head, sep, rest = data.partition(':')
+            if sep:
+                route = self.prefix_routes.get(head)
+                version, _, payload = rest.partition(':')
+                if route is None or version != route.version:
+                    return None, ()
+                return route, route.decode(payload, ':')
+            head, sep, rest = data.partition('_')
+            route = self.legacy_routes.get(head) if sep else None
+            if route is None:
+                return None, ()
+            return route, route.decode(rest, '_')
+        except ValueError:
+            return None, ()
+
+    async def dispatch(self, update, context):
+        """Run the route for a callback query, answering it once"""
+        query = update.callback_query
+        route, args = self.resolve(query.data or '')
+        if route is None:
+            await query.answer("⌛ This button has expired.", show_alert=True)
+            return
+        if route.admin and not is_admin(query.from_user.id):
+            await query.answer("❌ Admin access required!", show_alert=True)
+            return
+        if route.answer:
+            await query.answer()
+        await route.handler(update, context, *args)
+
+# Initialize callback router (routes are registered next to their handlers)
+callback_router = CallbackRouter()
+
+# Initialize storage
+storage = FileStorage()
+
+# Initialize rendered text cache, kept in step with storage
+render_cache = RenderCache()
+storage.add_listener(render_cache.invalidate)
+
+# Initialize file ID allocator
+id_allocator = IdAllocator()
+
+# Initialize logs channel recovery
+recovery = LogRecovery()
+
+# Initialize outbound send scheduler
+scheduler = SendScheduler()
+
+# Initialize file delivery, kept in step with storage
+delivery = DeliveryEngine()
+storage.add_listener(delivery.invalidate, downloads=False)
+
+# Initialize background logs channel writer
+log_writer = LogWriter()
+
+# Initialize message manager
+message_manager = MessageManager()
+
+# Initialize media group (album) collector
+media_groups = MediaGroupCollector()
+
+metrics.describe('record_cache_lookups_total', 'counter', "File record cache lookups by result", lambda: {
+    (('result', 'hit'),): storage.cache.hits,
+    (('result', 'negative_hit'),): storage.cache.negative_hits,
+    (('result', 'miss'),): storage.cache.misses
+})
+metrics.describe('record_cache_hit_ratio', 'gauge', "Share of record lookups answered from memory", storage.cache.hit_ratio)
+metrics.describe('record_cache_evictions_total', 'counter', "Records evicted from the cache", lambda: storage.cache.evictions)
+metrics.describe('record_cache_entries', 'gauge', "Records held in memory", lambda: len(storage.cache))
+metrics.describe('render_cache_entries', 'gauge', "Files with cached rendered text", lambda: len(render_cache.entries))
+metrics.describe('deliveries_total', 'counter', "Files delivered by method", lambda: {
+    (('method', method),): count for method, count in delivery.sent.items()
+})
+metrics.describe('queue_depth', 'gauge', "Items waiting in internal queues", lambda: {
+    (('queue', 'send'),): scheduler.queue_depth(),
+    (('queue', 'log'),): log_writer.queue.qsize(),
+    (('queue', 'downloads'),): storage.pending_total,
+    (('queue', 'media_groups'),): len(media_groups.groups)
+})
+metrics.describe('update_queue_depth', 'gauge', "Updates received but not yet dispatched")
+
+def get_main_menu_keyboard(user_id):
+    """Get main menu keyboard based on user role"""
+    if is_admin(user_id):
+        return InlineKeyboardMarkup([
+            [InlineKeyboardButton("📁 My Files", callback_data="myfiles"),
+             InlineKeyboardButton("📂 All Files", callback_data="allfiles")],
+            [InlineKeyboardButton("📊 Statistics", callback_data="stats"),
+             InlineKeyboardButton("🔄 Rebuild Cache", callback_data="rebuild")],
+            [InlineKeyboardButton("✏️ Edit Messages", callback_data="editmessages")],
+            [InlineKeyboardButton("ℹ️ Help", callback_data="help"),
+             InlineKeyboardButton("ℹ️ About", callback_data="about")]
+        ])
+    else:
+        return InlineKeyboardMarkup([
+            [InlineKeyboardButton("📁 My Files", callback_data="myfiles")],
+            [InlineKeyboardButton("📊 Statistics", callback_data="stats")],
+            [InlineKeyboardButton("ℹ️ Help", callback_data="help"),
+             InlineKeyboardButton("ℹ️ About", callback_data="about")]
+        ])
+
+# Compact cursor dates: YYYYMMDDTHHMMSS, optional microseconds and UTC offset (+HHMM or Z)
+CURSOR_DATE = re.compile(r'(\d{8})T(\d{6})(\d*)(Z|[+-]\d{4})?')
+
+def encode_cursor(upload_date, unique_id):
+    """Pack a (upload_date, unique_id) listing position into compact callback data
+
+    Dates that don't round-trip (not isoformat() output) are normalized first,
+    and None is returned for dates that can't be parsed at all.
+    """
+    compact = upload_date[:10].replace('-', '') + upload_date[10:].replace(':', '').replace('.', '')
+    position = f"{compact}~{unique_id}"
+    if decode_cursor(position) == (upload_date, unique_id):
+        return position
+    try:
+        normalized = datetime.fromisoformat(upload_date).isoformat()
+    except ValueError:
+        return None
+    return encode_cursor(normalized, unique_id) if normalized != upload_date else None
+
+def decode_cursor(cursor):
+    """Unpack a cursor created by encode_cursor, or None if it is malformed"""
+    compact, sep, unique_id = cursor.partition('~')
+    match = CURSOR_DATE.fullmatch(compact)
+    if not sep or not unique_id or match is None:
+        return None
+    date, clock, fraction, offset = match.groups()
+    upload_date = f"{date[0:4]}-{date[4:6]}-{date[6:8]}T{clock[0:2]}:{clock[2:4]}:{clock[4:6]}"
+    if fraction:
+        upload_date += f".{fraction}"
+    if offset and offset != 'Z':
+        offset = f"{offset[0:3]}:{offset[3:5]}"
+    return upload_date + (offset or ''), unique_id
+
+def build_files_page(viewer_id, show_all, direction=None, cursor=None):
+    """Build (text, navigation buttons) for one page of My Files / All Files
+
+    direction is 'o' (older than cursor) or 'n' (newer than cursor); without a
+    cursor the newest page is shown. Returns (None, None) when there are no files.
+    """
+    owner_id = None if show_all else viewer_id
+    position = decode_cursor(cursor) if cursor else None
+    if cursor and position is None:
+        logger.warning(f"Malformed files page cursor {cursor!r}, showing the newest page")
+    items, has_older, has_newer = storage.get_files_page(
+        owner_id,
+        before=position if direction == 'o' else None,
+        after=position if direction == 'n' else None,
+        limit=FILES_PAGE_SIZE
+    )
+    if not items and position:
+        # Stale cursor - fall back to the newest page
+        items, has_older, has_newer = storage.get_files_page(owner_id, limit=FILES_PAGE_SIZE)
+    if not items:
+        return None, None
+    
+    total_files = storage.count_files() if show_all else storage.get_user_stats(viewer_id)[0]
+    response = "📂 *All Files in System*\n\n" if show_all else "📁 *Your Uploaded Files*\n\n"
+    kind = 'row_all' if show_all else 'row'
+    render_row = lambda uid, d: render_file_row(uid, d, show_all)
+    response += ''.join(render_cache.get(kind, uid, d, render_row) for uid, d in items)
+    
+    if has_older or has_newer:
+        response += f"_Showing {len(items)} of {total_files} total files_\n\n"
+    
+    response += f"📊 *Total Files:* {total_files}"
+    
+    # Navigation buttons carry the cursor of the first/last item on this page
+    code = 'af' if show_all else 'mf'
+    nav_buttons = []
+    first_cursor = encode_cursor(items[0][1]['upload_date'], items[0][0]) if has_older else None
+    if first_cursor:
+        nav_buttons.append(InlineKeyboardButton(
+            "« Older", callback_data=callback_router.data(code, 'o', first_cursor)
+        ))
+    last_cursor = encode_cursor(items[-1][1]['upload_date'], items[-1][0]) if has_newer else None
+    if last_cursor:
+        nav_buttons.append(InlineKeyboardButton(
+            "Newer »", callback_data=callback_router.data(code, 'n', last_cursor)
+        ))
+    return response, nav_buttons
+
+# Search result orders as carried in callback data
+SEARCH_ORDERS = {'d': 'downloads', 'r': 'recent'}
+SEARCH_QUERY_BYTES = 40  # Room left for the query in 64-byte callback data
+
+def fit_search_terms(terms):
+    """Drop trailing query words until the query fits in callback data"""
+    terms = list(terms)
+    while terms and len(' '.join(terms).encode('utf-8')) > SEARCH_QUERY_BYTES:
+        terms.pop()
+    return terms
+
+def build_search_page(viewer_id, terms, order='d', offset=0):
+    """Build (text, keyboard) for one page of /search results
+
+    Admins search every file, other users only their own. Returns (None, None)
+    when nothing matches.
+    """
+    show_all = is_admin(viewer_id)
+    order = order if order in SEARCH_ORDERS else 'd'
+    offset = max(0, offset)
+    items, has_more = storage.search_files(terms, None if show_all else viewer_id, SEARCH_ORDERS[order], offset)
+    if not items and offset:
+        # Fewer matches than when the button was made - start over
+        offset = 0
+        items, has_more = storage.search_files(terms, None if show_all else viewer_id, SEARCH_ORDERS[order])
+    if not items:
+        return None, None
+    
+    text = ' '.join(terms)
+    response = (
+        f"🔍 *Search:* `{text}`\n"
+        f"_{'Most downloaded' if order == 'd' else 'Newest'} first, "
+        f"results {offset + 1}-{offset + len(items)}_\n\n"
+    )
+    kind = 'row_all' if show_all else 'row'
+    render_row = lambda uid, d: render_file_row(uid, d, show_all)
+    response += ''.join(render_cache.get(kind, uid, d, render_row) for uid, d in items)
+    
+    nav_buttons = []
+    if offset:
+        nav_buttons.append(InlineKeyboardButton(
+            "« Previous", callback_data=callback_router.data('sr', order, max(0, offset - SEARCH_PAGE_SIZE), text)
+        ))
+    if has_more:
+        nav_buttons.append(InlineKeyboardButton(
+            "Next »", callback_data=callback_router.data('sr', order, offset + len(items), text)
+        ))
+    other = 'r' if order == 'd' else 'd'
+    keyboard = [nav_buttons] if nav_buttons else []
+    keyboard.append([InlineKeyboardButton(
+        "🕒 Newest first" if other == 'r' else "📥 Most downloaded first",
+        callback_data=callback_router.data('sr', other, 0, text)
+    )])
+    return response, InlineKeyboardMarkup(keyboard)
+
+def build_inline_result(unique_id, file_data):
+    """Inline query result sending a stored file by its file_id"""
+    result_class, file_arg = INLINE_RESULTS.get(file_data.get('file_type'), INLINE_RESULTS['document'])
+    kwargs = {
+        file_arg: file_data['file_id'],
+        'caption': render_cache.get('caption', unique_id, file_data, render_caption)
+    }
+    if result_class is not InlineQueryResultCachedAudio:  # Audio titles come from the file's tags
+        kwargs['title'] = file_data['file_name']
+    return result_class(unique_id, **kwargs)
+
+def format_ms(seconds):
+    """Histogram bucket bound as milliseconds for the stats view"""
+    if seconds is None:
+        return "-"
+    return "slow" if seconds == float('inf') else f"≤{seconds * 1000:.0f}ms"
+
+def build_performance_text(limit=5):
+    """Admin stats section summarising handler latency, Bot API calls and queues"""
+    handlers = sorted(metrics.histogram_series('bot_handler_seconds'), key=lambda item: -item[1])[:limit]
+    handler_lines = "".join(
+        f"├ `{labels['handler']}{' ' + labels['route'] if labels.get('route') else ''}`: "
+        f"{count} × p50 {format_ms(p50)}, p99 {format_ms(p99)}\n"
+        for labels, count, p50, p99 in handlers
+    ) or "├ No updates handled yet\n"
+    api_calls = metrics.counter_total('telegram_requests_total')
+    api_errors = api_calls - metrics.counter_total('telegram_requests_total', result='ok')
+    flood_waits = metrics.counter_total('telegram_requests_total', result='retry_after')
+    return (
+        f"*Performance:*\n"
+        f"{handler_lines}"
+        f"├ 🌐 Bot API: {api_calls} calls, {api_errors} failed ({flood_waits} flood waits)\n"
+        f"└ 📬 Queues: {scheduler.queue_depth()} sends, {log_writer.queue.qsize()} logs, "
+        f"{storage.pending_total} download counts\n\n"
+    )
+
+def build_stats_text(user_id):
+    """Build the statistics view from the stored counters"""
+    if is_admin(user_id):
+        # Admin statistics
+        stats = storage.get_stats()
+        total_files = stats['total_files']
+        total_downloads = stats['total_downloads']
+        type_lines = "".join(
+            f"├ {file_type.title()}: {count}\n"
+            for file_type, count in sorted(stats['files_by_type'].items())
+        ) or "├ None yet\n"
+        return (
+            f"📊 *Bot Statistics (Admin View)*\n\n"
+            f"*Global Stats:*\n"
+            f"├ 📁 Total Files: {total_files}\n"
+            f"├ 📥 Total Downloads: {total_downloads}\n"
+            f"├ 💾 Total Size: {stats['total_bytes'] / (1024 * 1024 * 1024):.2f} GB\n"
+            f"└ 👥 Total Users: {stats['total_uploaders']}\n\n"
+            f"*Files by Type:*\n"
+            f"{type_lines}"
+            f"└ Total: {total_files}\n\n"
+            f"*Storage Info:*\n"
+            f"├ 🗄️ Files Channel: `{FILES_CHANNEL_ID}`\n"
+            f"├ 📝 Logs Channel: `{LOGS_CHANNEL_ID}`\n"
+            f"├ 💾 Cached Entries: {len(storage.cache)} ({storage.cache.hit_ratio():.0%} hits)\n"
+            f"└ 📤 Delivered: {delivery.sent['copy']} copied, {delivery.sent['file_id']} by file ID\n\n"
+            f"{build_performance_text()}"
+            f"*Average Stats:*\n"
+            f"├ Avg Downloads/File: {total_downloads/total_files if total_files > 0 else 0:.1f}\n"
+            f"└ Storage Status: {'✅ Healthy' if total_files > 0 else '⚠️ Empty'}"
+        )
+    
+    # User statistics - only show personal stats
+    user_file_count, user_downloads = storage.get_user_stats(user_id)
+    
+    return (
+        f"📊 *Your Statistics*\n\n"
+        f"*Your Activity:*\n"
+        f"├ 📁 Files Uploaded: {user_file_count}\n"
+        f"├ 📥 Total Downloads: {user_downloads}\n"
+        f"└ 📈 Avg Downloads/File: {user_downloads/user_file_count if user_file_count > 0 else 0:.1f}\n\n"
+        f"💡 *Tip:* Upload more files to track your sharing activity!"
+    )
+
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Send a message when the command /start is issued."""
+    user_id = update.message.from_user.id
+    user_name = update.message.from_user.first_name
+    user_is_admin = is_admin(user_id)
+    
+    # Get custom start message with variable replacement
+    welcome_text = message_manager.get_message(
+        'start_message',
+        user_name=user_name,
+        user_id=user_id
+    )
+    
+    if user_is_admin:
+        welcome_text += "\n\n👑 *Admin Mode Active*"
+    
+    await update.message.reply_text(
+        welcome_text, 
+        parse_mode='Markdown', 
+        reply_markup=get_main_menu_keyboard(user_id)
+    )
+
+async def store_file_in_channel(context, file_obj, file_type):
+    """Store file in the files channel and return message ID"""
+    try:
+        if file_type == 'document':
+            msg = await scheduler.send(
+                context.bot.send_document, FILES_CHANNEL_ID, PRIORITY_UPLOAD,
+                document=file_obj.file_id
+            )
+        elif file_type == 'photo':
+            msg = await scheduler.send(
+                context.bot.send_photo, FILES_CHANNEL_ID, PRIORITY_UPLOAD,
+                photo=file_obj.file_id
+            )
+        elif file_type == 'video':
+            msg = await scheduler.send(
+                context.bot.send_video, FILES_CHANNEL_ID, PRIORITY_UPLOAD,
+                video=file_obj.file_id
+            )
+        elif file_type == 'audio':
+            msg = await scheduler.send(
+                context.bot.send_audio, FILES_CHANNEL_ID, PRIORITY_UPLOAD,
+                audio=file_obj.file_id
+            )
+        elif file_type == 'voice':
+            msg = await scheduler.send(
+                context.bot.send_voice, FILES_CHANNEL_ID, PRIORITY_UPLOAD,
+                voice=file_obj.file_id
+            )
+        else:
+            return None
+        
+        logger.info(f"Stored {file_type} file in channel, message_id: {msg.message_id}")
+        return msg.message_id
+    except Exception as e:
+        logger.error(f"Error storing file in channel: {e}")
+        return None
+
+# Media group item types (voice messages cannot be sent in a group)
+INPUT_MEDIA = {
+    'photo': InputMediaPhoto,
+    'video': InputMediaVideo,
+    'document': InputMediaDocument,
+    'audio': InputMediaAudio
+}
+
+# Types that can share a media group (documents and audio only group with their own type)
+MEDIA_GROUP_KIND = {
+    'photo': 'visual',
+    'video': 'visual',
+    'document': 'document',
+    'audio': 'audio'
+}
+
+def plan_media_groups(file_types):
+    """Split positions into send batches: runs of one group kind, at most 10 each
+
+    Batches of one (voice messages, or a kind change) are sent on their own.
+    """
+    batches = []
+    last_kind = None
+    for i, file_type in enumerate(file_types):
+        kind = MEDIA_GROUP_KIND.get(file_type)
+        if kind is not None and kind == last_kind and len(batches[-1]) < 10:
+            batches[-1].append(i)
+        else:
+            batches.append([i])
+        last_kind = kind
+    return batches
+
+async def store_files_in_channel(context, files):
+    """Store (file_obj, file_type) pairs in the files channel, returns message IDs (None on failure)
+
+    Files are grouped as plan_media_groups allows and each group is sent with one
+    send_media_group call; anything that cannot go in a group, or a group
+    Telegram rejects, is stored one file at a time.
+    """
+    message_ids = [None] * len(files)
+    for chunk in plan_media_groups([file_type for file_obj, file_type in files]):
+        if len(chunk) < 2:
+            continue
+        media = [INPUT_MEDIA[files[i][1]](files[i][0].file_id) for i in chunk]
+        try:
+            messages = await scheduler.send(
+                context.bot.send_media_group, FILES_CHANNEL_ID, PRIORITY_UPLOAD, media=media
+            )
+        except TelegramError as e:
+            logger.warning(f"Storing media group failed, storing files one by one: {e}")
+            continue
+        for i, msg in zip(chunk, messages):
+            message_ids[i] = msg.message_id
+        logger.info(f"Stored media group of {len(chunk)} files in channel")
+    for i, (file_obj, file_type) in enumerate(files):
+        if message_ids[i] is None:
+            message_ids[i] = await store_file_in_channel(context, file_obj, file_type)
+    return message_ids
+
+def format_upload_log(log_data):
+    """Format the logs channel message for an upload"""
+    # Store complete metadata as JSON in the log for easy recovery
+    metadata_json = json.dumps({
+        'unique_id': log_data['unique_id'],
+        'file_id': log_data['file_id'],
+        'file_unique_id': log_data.get('file_unique_id'),
+        'file_name': log_data['file_name'],
+        'file_size_bytes': log_data.get('file_size_bytes'),
+        'file_type': log_data['file_type'],
+        'uploader_id': log_data['uploader_id'],
+        'username': log_data.get('username'),
+        'upload_date': log_data['upload_date'],
+        'channel_message_id': log_data['channel_message_id']
+    }, indent=2)
+    
+    return (
+        f"📊 *File Upload Log*\n\n"
+        f"🆔 *Unique ID:* `{log_data['unique_id']}`\n"
+        f"📄 *File Name:* `{log_data['file_name']}`\n"
+        f"💾 *Size:* {log_data['file_size']}\n"
+        f"👤 *Uploader ID:* `{log_data['uploader_id']}`\n"
+        f"👤 *Username:* @{escape_markdown(log_data.get('username') or 'N/A')}\n"
+        f"📅 *Date:* {log_data['upload_date']}\n"
+        f"📍 *Channel Message ID:* {log_data['channel_message_id']}\n"
+        f"🔗 *Share Link:* {log_data['share_link']}\n\n"
+        f"```json\n{metadata_json}\n```"
+    )
+
+def format_bundle_log(log_data):
+    """Format the logs channel message for a media group upload or a new bundle"""
+    files = log_data['files']
+    # New files use the upload log JSON fields (uploader and date are shared at the top);
+    # file_ids keeps the bundle order
+    bundle_json = json.dumps({
+        'bundle_id': log_data['bundle_id'],
+        'uploader_id': log_data['uploader_id'],
+        'username': log_data.get('username'),
+        'upload_date': log_data['upload_date'],
+        'file_ids': log_data['file_ids'],
+        'files': [{
+            'unique_id': entry['unique_id'],
+            'file_id': entry['file_id'],
+            'file_unique_id': entry.get('file_unique_id'),
+            'file_name': entry['file_name'],
+            'file_size_bytes': entry.get('file_size_bytes'),
+            'file_type': entry['file_type'],
+            'channel_message_id': entry['channel_message_id']
+        } for entry in files]
+    }, ensure_ascii=False, separators=(',', ':'))
+    
+    lines = "".join(
+        f"├ `{entry['unique_id']}` {escape_markdown(entry['file_name'][:40])} ({format_size(entry.get('file_size_bytes') or 0)})\n"
+        for entry in files
+    )
+    title = "Media Group Upload Log" if files else "Bundle Log"
+    header = (
+        f"📦 *{title}*\n\n"
+        f"🆔 *Bundle ID:* `{log_data['bundle_id']}`\n"
+        f"👤 *Uploader ID:* `{log_data['uploader_id']}`\n"
+        f"👤 *Username:* @{escape_markdown(log_data.get('username') or 'N/A')}\n"
+        f"📅 *Date:* {log_data['upload_date']}\n"
+        f"📁 *Files:* {len(log_data['file_ids'])} ({len(files)} new)\n"
+    )
+    text = header + lines + f"🔗 *Bundle Link:* {log_data['bundle_link']}\n\n```json\n{bundle_json}\n```"
+    if len(text) > 4096:
+        # Keep the JSON block intact for recovery
+        text = header + f"\n```json\n{bundle_json}\n```"
+    return text
+
+def format_download_log(download_logs):
+    """Format the logs channel message for one or more downloads"""
+    if len(download_logs) == 1:
+        download_log = download_logs[0]
+        download_json = json.dumps(download_log, indent=2, ensure_ascii=False)
+        download_time = datetime.fromisoformat(download_log['download_timestamp'])
+        
+        return (
+            f"📥 *Download Activity*\n\n"
+            f"🆔 *File ID:* `{download_log['file_id']}`\n"
+            f"📄 *File:* `{download_log['file_name']}`\n\n"
+            f"👤 *Downloader Info:*\n"
+            f"├ *User ID:* `{download_log['downloader_id']}`\n"
+            f"├ *Username:* @{escape_markdown(download_log['downloader_username'] or 'N/A')}\n"
+            f"├ *Name:* {escape_markdown(download_log['downloader_first_name'] or '')} "
+            f"{escape_markdown(download_log['downloader_last_name'] or '')}\n"
+            f"└ *Time:* {download_time.strftime('%Y-%m-%d %H:%M:%S')}\n\n"
+            f"```json\n{download_json}\n```"
+        )
+    
+    # Batched downloads - one line per event and one JSON block for recovery
+    lines = []
+    for download_log in download_logs:
+        download_time = datetime.fromisoformat(download_log['download_timestamp'])
+        lines.append(
+            f"├ `{download_log['file_id']}` → `{download_log['downloader_id']}` "
+            f"@{escape_markdown(download_log['downloader_username'] or 'N/A')} at {download_time.strftime('%H:%M:%S')}"
+        )
+    download_json = "{\"downloads\": [\n" + ",\n".join(
+        json.dumps(download_log, ensure_ascii=False) for download_log in download_logs
+    ) + "\n]}"
+    
+    return (
+        f"📥 *Download Activity ({len(download_logs)} downloads)*\n\n"
+        + "\n".join(lines) +
+        f"\n\n```json\n{download_json}\n```"
+    )
+
+async def log_to_channel(context, log_data):
+    """Queue upload metadata for the logs channel"""
+    log_writer.enqueue('upload', log_data)
+    logger.info(f"Queued log for file {log_data['unique_id']}")
+
+async def log_download_activity(context, file_id, file_name, downloader_user):
+    """Queue download activity with detailed user information for the logs channel"""
+    download_log = {
+        'file_id': file_id,
+        'file_name': file_name,
+        'downloader_id': downloader_user.id,
+        'downloader_username': downloader_user.username,
+        'downloader_first_name': downloader_user.first_name,
+        'downloader_last_name': downloader_user.last_name,
+        'download_timestamp': datetime.now().isoformat()
+    }
+    log_writer.enqueue('download', download_log)
+    logger.info(f"Queued download log for file {file_id} by user {downloader_user.id}")
+
+def extract_file(message):
+    """Get (file_obj, file_name, file_size, file_type) from a message, or None"""
+    if message.document:
+        file = message.document
+        return file, file.file_name, file.file_size, 'document'
+    if message.photo:
+        file = message.photo[-1]  # Get highest quality
+        return file, f"photo_{file.file_unique_id}.jpg", file.file_size, 'photo'
+    if message.video:
+        file = message.video
+        return file, file.file_name or f"video_{file.file_unique_id}.mp4", file.file_size, 'video'
+    if message.audio:
         file = message.audio
-        file_name = file.file_name or f"audio_{file.file_unique_id}.mp3"
-        file_size = file.file_size
-        file_type = 'audio'
-    elif message.voice:
+        return file, file.file_name or f"audio_{file.file_unique_id}.mp3", file.file_size, 'audio'
+    if message.voice:
         file = message.voice
-        file_name = f"voice_{file.file_unique_id}.ogg"
-        file_size = file.file_size
-        file_type = 'voice'
-    else:
-        await processing_msg.edit_text("❌ Unsupported file type!")
+        return file, f"voice_{file.file_unique_id}.ogg", file.file_size, 'voice'
+    return None
+
+@timed_handler()
+async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle received files and generate shareable links."""
+    message = update.message
+    user = message.from_user
+    
+    # Albums are stored together once all of their messages have arrived
+    if message.media_group_id:
+        media_groups.add(message, lambda messages: handle_media_group(context, messages))
         return
     
-    # Store file in channel
-    channel_msg_id = await store_file_in_channel(context, file, file_type)
+    # Send processing message
+    processing_msg = await message.reply_text("⏳ Processing your file... Please wait.")
     
-    if not channel_msg_id:
-        await processing_msg.edit_text(
-            "❌ *Error storing file*\n\n"
-            "Please check:\n"
-            "• Bot has admin rights in channels\n"
-            "• Bot can post messages\n"
-            "• Channel IDs are correct",
-            parse_mode='Markdown'
-        )
+    # Determine file type and get file object
+    extracted = extract_file(message)
+    if extracted is None:
+        await processing_msg.edit_text("❌ Unsupported file type!")
         return
+    file, file_name, file_size, file_type = extracted
     
-    # Generate unique ID
-    unique_id = hashlib.md5(f"{file.file_id}{datetime.now()}".encode()).hexdigest()[:8]
+    # Reuse an already stored copy of the same content
+    duplicates = storage.find_by_content(file.file_unique_id, file_size)
+    own_copy = next((item for item in duplicates if item[1].get('uploader_id') == user.id), None)
+    stored_copy = next((item for item in duplicates if item[1].get('channel_message_id')), None)
     
-    # Get bot username for link generation
-    bot = await context.bot.get_me()
-    share_link = f"https://t.me/{bot.username}?start=file_{unique_id}"
+    if own_copy:
+        # Same user uploaded this before - return the existing record
+        unique_id, file_data = own_copy
+        channel_msg_id = file_data['channel_message_id']
+        share_link = build_share_link(unique_id)
+        storage_note = "♻️ Already stored - existing link reused"
+    else:
+        if stored_copy:
+            # Stored by another user - alias the existing channel copy
+            channel_msg_id = stored_copy[1]['channel_message_id']
+            storage_note = f"♻️ Linked to existing copy `{stored_copy[0]}`"
+        else:
+            # Store file in channel
+            channel_msg_id = await store_file_in_channel(context, file, file_type)
+            storage_note = "Stored in database ✓"
+        
+        if not channel_msg_id:
+            await processing_msg.edit_text(
+                "❌ *Error storing file*\n\n"
+                "Please check:\n"
+                "• Bot has admin rights in channels\n"
+                "• Bot can post messages\n"
+                "• Channel IDs are correct",
+                parse_mode='Markdown'
+            )
+            return
+        
+        # Generate unique ID
+        unique_id = id_allocator.next_id(storage.exists)
+        
+        # Build link from the cached bot username
+        share_link = build_share_link(unique_id)
+        
+        # Prepare file data
+        file_data = {
+            'file_id': file.file_id,
+            'file_unique_id': file.file_unique_id,
+            'file_name': file_name,
+            'file_size': file_size,
+            'file_size_bytes': file_size,  # Store raw bytes for logs
+            'file_type': file_type,
+            'uploader_id': user.id,
+            'username': user.username,
+            'upload_date': datetime.now().isoformat(),
+            'channel_message_id': channel_msg_id,
+            'downloads': 0,
+            'share_link': share_link
+        }
+        
+        # Persist metadata
+        await storage.add_to_cache(unique_id, file_data)
     
     # Format file size
-    size_mb = file_size / (1024 * 1024)
-    size_str = f"{size_mb:.2f} MB" if size_mb >= 1 else f"{file_size / 1024:.2f} KB"
+    size_str = format_size(file_size)
     
-    # Prepare file data
-    file_data = {
-        'file_id': file.file_id,
-        'file_name': file_name,
-        'file_size': file_size,
-        'file_size_bytes': file_size,  # Store raw bytes for logs
-        'file_type': file_type,
-        'uploader_id': user.id,
-        'username': user.username,
-        'upload_date': datetime.now().isoformat(),
-        'channel_message_id': channel_msg_id,
-        'downloads': 0,
-        'share_link': share_link
-    }
-    
-    # Add to local cache
-    storage.add_to_cache(unique_id, file_data)
-    
-    # Log to channel
-    log_data = file_data.copy()
-    log_data['unique_id'] = unique_id
-    log_data['file_size'] = size_str
-    await log_to_channel(context, log_data)
-    
-    # Get file type emoji
-    type_emoji = {
-        'document': '📄',
-        'photo': '🖼️',
-        'video': '🎥',
-        'audio': '🎵',
-        'voice': '🎤'
-    }.get(file_type, '📄')
+    if not own_copy:
+        # Log to channel
+        log_data = file_data.copy()
+        log_data['unique_id'] = unique_id
+        log_data['file_size'] = size_str
+        await log_to_channel(context, log_data)
     
     # Create inline keyboard
     keyboard = [
-        [InlineKeyboardButton("📥 Download Now", callback_data=f"dl_{unique_id}")],
+        [InlineKeyboardButton("📥 Download Now", callback_data=callback_router.data('dl', unique_id))],
         [InlineKeyboardButton("🔗 Copy Share Link", url=share_link)],
         [InlineKeyboardButton("« Back to Menu", callback_data="menu")]
     ]
@@ -497,54 +3324,174 @@ async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     response_text = (
         f"✅ *File Stored Successfully!*\n\n"
-        f"{type_emoji} *File Details:*\n"
-        f"├ *Name:* `{file_name}`\n"
+        f"{type_emoji(file_type)} *File Details:*\n"
+        f"├ *Name:* `{file_data['file_name']}`\n"
         f"├ *Size:* {size_str}\n"
         f"├ *Type:* {file_type.title()}\n"
         f"└ *ID:* `{unique_id}`\n\n"
         f"📍 *Storage Info:*\n"
         f"├ Channel Message: {channel_msg_id}\n"
-        f"└ Stored in database ✓\n\n"
+        f"└ {storage_note}\n\n"
         f"🔗 *Share Link:*\n`{share_link}`\n\n"
         f"💡 *Tip:* Click 'Copy Share Link' to open in browser and copy easily!"
     )
     
     await processing_msg.edit_text(response_text, parse_mode='Markdown', reply_markup=reply_markup)
 
-async def send_file_to_user(context, chat_id, file_data, unique_id):
-    """Helper function to send file to user based on type"""
-    file_type = file_data.get('file_type', 'document')
-    file_id = file_data['file_id']
+@timed_handler()
+async def handle_media_group(context, messages):
+    """Store the files of a media group together and reply with one bundle link"""
+    message = messages[0]
+    user = message.from_user
+    entries = [extracted for extracted in map(extract_file, messages) if extracted]
+    if not entries:
+        return
+    
+    # Reuse stored copies like handle_file; only new content goes to the channel
+    unique_ids = [None] * len(entries)
+    channel_msg_ids = {}  # entry index -> channel message ID for new records
+    to_store = []
+    for index, (file, file_name, file_size, file_type) in enumerate(entries):
+        duplicates = storage.find_by_content(file.file_unique_id, file_size)
+        own_copy = next((item for item in duplicates if item[1].get('uploader_id') == user.id), None)
+        stored_copy = next((item for item in duplicates if item[1].get('channel_message_id')), None)
+        if own_copy:
+            unique_ids[index] = own_copy[0]
+        elif stored_copy:
+            channel_msg_ids[index] = stored_copy[1]['channel_message_id']
+        else:
+            to_store.append(index)
+    
+    stored_ids = await store_files_in_channel(context, [(entries[i][0], entries[i][3]) for i in to_store])
+    channel_msg_ids.update(zip(to_store, stored_ids))
+    
+    upload_date = datetime.now().isoformat()
+    records = []
+    for index in sorted(channel_msg_ids):
+        if not channel_msg_ids[index]:
+            continue
+        file, file_name, file_size, file_type = entries[index]
+        unique_id = id_allocator.next_id(storage.exists)
+        records.append((unique_id, {
+            'file_id': file.file_id,
+            'file_unique_id': file.file_unique_id,
+            'file_name': file_name,
+            'file_size': file_size,
+            'file_size_bytes': file_size,
+            'file_type': file_type,
+            'uploader_id': user.id,
+            'username': user.username,
+            'upload_date': upload_date,
+            'channel_message_id': channel_msg_ids[index],
+            'downloads': 0,
+            'share_link': build_share_link(unique_id)
+        }))
+        unique_ids[index] = unique_id
+    await storage.add_many_to_cache(records)
     
-    # Get file type emoji
-    type_emoji = {
-        'document': '📄',
-        'photo': '🖼️',
-        'video': '🎥',
-        'audio': '🎵',
-        'voice': '🎤'
-    }.get(file_type, '📄')
+    file_ids = [unique_id for unique_id in unique_ids if unique_id]
+    failed = len(entries) - len(file_ids)
+    if not file_ids:
+        await message.reply_text(
+            "❌ *Error storing files*\n\n"
+            "Please check:\n"
+            "• Bot has admin rights in channels\n"
+            "• Bot can post messages\n"
+            "• Channel IDs are correct",
+            parse_mode='Markdown'
+        )
+        return
+    
+    bundle_id = id_allocator.next_id(lambda bid: storage.get_bundle(bid) is not None)
+    storage.save_bundle(bundle_id, file_ids, user.id, upload_date)
+    bundle_link = build_bundle_link(bundle_id)
     
-    caption = f"{type_emoji} {file_data['file_name']}\n🆔 File ID: {unique_id}\n📥 Downloads: {file_data.get('downloads', 0)}"
+    # One consolidated log entry for the whole group
+    log_writer.enqueue('bundle', {
+        'bundle_id': bundle_id,
+        'uploader_id': user.id,
+        'username': user.username,
+        'upload_date': upload_date,
+        'file_ids': file_ids,
+        'bundle_link': bundle_link,
+        'files': [dict(file_data, unique_id=unique_id) for unique_id, file_data in records]
+    })
+    logger.info(f"Stored media group as bundle {bundle_id} ({len(file_ids)} files, {len(records)} new)")
+    
+    file_lines = "".join(
+        f"├ {type_emoji(entries[i][3])} `{entries[i][1][:40]}`\n"
+        for i in range(len(entries)) if unique_ids[i]
+    )
+    failed_note = f"⚠️ {failed} file(s) could not be stored\n\n" if failed else ""
+    keyboard = [
+        [InlineKeyboardButton("📥 Download All", callback_data=callback_router.data('gb', bundle_id))],
+        [InlineKeyboardButton("🔗 Copy Bundle Link", url=bundle_link)],
+        [InlineKeyboardButton("« Back to Menu", callback_data="menu")]
+    ]
+    await message.reply_text(
+        f"✅ *Album Stored Successfully!*\n\n"
+        f"📦 *Bundle:* {len(file_ids)} files\n"
+        f"{file_lines}"
+        f"└ *ID:* `{bundle_id}`\n\n"
+        f"{failed_note}"
+        f"🔗 *Bundle Link:*\n`{bundle_link}`\n\n"
+        f"💡 *Tip:* Anyone with this link gets all files at once!",
+        parse_mode='Markdown',
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+async def send_file_to_user(context, chat_id, file_data, unique_id):
+    """Helper function to send file to user"""
+    caption = render_cache.get('caption', unique_id, file_data, render_caption)
     
     try:
-        if file_type == 'document':
-            await context.bot.send_document(chat_id=chat_id, document=file_id, caption=caption)
-        elif file_type == 'photo':
-            await context.bot.send_photo(chat_id=chat_id, photo=file_id, caption=caption)
-        elif file_type == 'video':
-            await context.bot.send_video(chat_id=chat_id, video=file_id, caption=caption)
-        elif file_type == 'audio':
-            await context.bot.send_audio(chat_id=chat_id, audio=file_id, caption=caption)
-        elif file_type == 'voice':
-            await context.bot.send_voice(chat_id=chat_id, voice=file_id)
-        
+        await delivery.send(context.bot, chat_id, unique_id, file_data, caption)
         logger.info(f"Sent file {unique_id} to user {chat_id}")
         return True
     except Exception as e:
         logger.error(f"Error sending file: {e}")
         return False
 
+async def send_bundle_to_user(context, chat_id, bundle, downloader_user):
+    """Send every file of a bundle, counting and logging each download; returns files sent
+
+    Files go out as media groups of up to 10 where their types allow, the rest
+    one by one; every send is paced by the scheduler.
+    """
+    items = []
+    for unique_id in bundle['files']:
+        file_data = storage.get_from_cache(unique_id)
+        if file_data:
+            items.append((unique_id, file_data))
+    
+    sent = 0
+    for batch in plan_media_groups([file_data.get('file_type', 'document') for _, file_data in items]):
+        delivered = []
+        if len(batch) > 1:
+            media = [
+                INPUT_MEDIA[items[i][1]['file_type']](
+                    items[i][1]['file_id'],
+                    caption=render_cache.get('caption', items[i][0], items[i][1], render_caption)
+                )
+                for i in batch
+            ]
+            try:
+                await scheduler.send(context.bot.send_media_group, chat_id, PRIORITY_DOWNLOAD, media=media)
+                delivered = batch
+                logger.info(f"Sent media group of {len(batch)} files to user {chat_id}")
+            except TelegramError as e:
+                logger.warning(f"Sending media group failed, sending files one by one: {e}")
+        if not delivered:
+            delivered = [i for i in batch if await send_file_to_user(context, chat_id, items[i][1], items[i][0])]
+        
+        for i in delivered:
+            unique_id, file_data = items[i]
+            await storage.update_downloads(unique_id)
+            await log_download_activity(context, unique_id, file_data['file_name'], downloader_user)
+        sent += len(delivered)
+    return sent
+
+@timed_handler()
 async def handle_start_parameter(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /start command with file parameter."""
     if not context.args:
@@ -570,32 +3517,13 @@ async def handle_start_parameter(update: Update, context: ContextTypes.DEFAULT_T
         # For non-admins: show join channel prompt
         if not is_admin(user_id):
             keyboard = [
-                [InlineKeyboardButton("📥 Get File", callback_data=f"get_{unique_id}")],
+                [InlineKeyboardButton("📥 Get File", callback_data=callback_router.data('g', unique_id))],
                 [InlineKeyboardButton("📢 Join Our Channel", url=BACKUP_CHANNEL_LINK)]
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
             
-            # Get file info
-            size_mb = file_data.get('file_size', 0) / (1024 * 1024)
-            size_str = f"{size_mb:.2f} MB" if size_mb >= 1 else f"{file_data.get('file_size', 0) / 1024:.2f} KB"
-            
-            type_emoji = {
-                'document': '📄',
-                'photo': '🖼️',
-                'video': '🎥',
-                'audio': '🎵',
-                'voice': '🎤'
-            }.get(file_data.get('file_type', 'document'), '📄')
-            
             await update.message.reply_text(
-                f"🔒 *File Ready for Download*\n\n"
-                f"{type_emoji} *File Details:*\n"
-                f"├ *Name:* `{file_data['file_name']}`\n"
-                f"├ *Size:* {size_str}\n"
-                f"├ *Type:* {file_data.get('file_type', 'document').title()}\n"
-                f"└ *Downloads:* {file_data.get('downloads', 0)}\n\n"
-                f"👇 Click below to get your file!\n\n"
-                f"💡 *Support us by joining our backup channel!*",
+                render_cache.get('card', unique_id, file_data, render_download_card),
                 parse_mode='Markdown',
                 reply_markup=reply_markup
             )
@@ -611,442 +3539,403 @@ async def handle_start_parameter(update: Update, context: ContextTypes.DEFAULT_T
             await log_download_activity(context, unique_id, file_data['file_name'], update.effective_user)
         else:
             await update.message.reply_text("❌ Error retrieving file. Please try again.")
-
-async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle button callbacks."""
-    query = update.callback_query
-    await query.answer()
-    
-    user_id = query.from_user.id
-    data = query.data
-    
-    # Back/Cancel - Delete message for clean UI
-    if data in ["back", "cancel"]:
-        try:
-            await query.message.delete()
-        except:
-            await query.message.edit_text("✅ Cancelled", reply_markup=None)
-        return
-    
-    # Main Menu
-    if data == "menu":
-        user_name = query.from_user.first_name
-        welcome_text = (
-            f"👋 *Welcome back, {user_name}!*\n\n"
-            "🗄️ *File Storage Bot - Main Menu*\n\n"
-            "Choose an option below:"
-        )
-        
-        await query.edit_message_text(
-            welcome_text,
-            parse_mode='Markdown',
-            reply_markup=get_main_menu_keyboard(user_id)
-        )
-        return
     
-    # My Files
-    if data == "myfiles":
-        user_files = storage.get_user_files(user_id)
+    elif param.startswith('bundle_'):
+        bundle_id = param.replace('bundle_', '')
+        bundle = storage.get_bundle(bundle_id)
         
-        if not user_files:
-            await query.edit_message_text(
-                "📭 *No Files Yet*\n\n"
-                "You haven't uploaded any files.\n\n"
-                "💡 Send me a file to get started!",
-                parse_mode='Markdown',
-                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("« Back to Menu", callback_data="menu")]])
+        if not bundle:
+            await update.message.reply_text(
+                "❌ *Bundle Not Found*\n\n"
+                "This link may be incorrect.",
+                parse_mode='Markdown'
             )
             return
         
-        bot = await context.bot.get_me()
-        response = "📁 *Your Uploaded Files*\n\n"
-        
-        for uid, d in user_files[-15:]:  # Show last 15 files
-            file_size = d.get('file_size', 0)
-            size_mb = file_size / (1024 * 1024)
-            size_str = f"{size_mb:.2f} MB" if size_mb >= 1 else f"{file_size / 1024:.2f} KB"
-            
-            share_link = f"https://t.me/{bot.username}?start=file_{uid}"
-            
-            type_emoji = {
-                'document': '📄',
-                'photo': '🖼️',
-                'video': '🎥',
-                'audio': '🎵',
-                'voice': '🎤'
-            }.get(d.get('file_type', 'document'), '📄')
-            
-            # Truncate long filenames
-            display_name = d['file_name'][:40] + "..." if len(d['file_name']) > 40 else d['file_name']
-            
-            response += (
-                f"{type_emoji} *{display_name}*\n"
-                f"├ 🆔 ID: `{uid}`\n"
-                f"├ 💾 Size: {size_str}\n"
-                f"├ 📥 Downloads: {d.get('downloads', 0)}\n"
-                f"├ 📅 Date: {d['upload_date'][:10]}\n"
-                f"└ 🔗 [Share Link]({share_link})\n\n"
+        # For non-admins: show join channel prompt
+        if not is_admin(update.effective_user.id):
+            keyboard = [
+                [InlineKeyboardButton("📥 Get All Files", callback_data=callback_router.data('gb', bundle_id))],
+                [InlineKeyboardButton("📢 Join Our Channel", url=BACKUP_CHANNEL_LINK)]
+            ]
+            await update.message.reply_text(
+                f"🔒 *Files Ready for Download*\n\n"
+                f"📦 *Bundle:* {len(bundle['files'])} files\n\n"
+                f"👇 Click below to get all files!\n\n"
+                f"💡 *Support us by joining our backup channel!*",
+                parse_mode='Markdown',
+                reply_markup=InlineKeyboardMarkup(keyboard)
             )
+            return
         
-        if len(user_files) > 15:
-            response += f"_Showing last 15 of {len(user_files)} total files_\n\n"
-        
-        response += f"📊 *Total Files:* {len(user_files)}"
-        
+        # Admin: direct access
+        sent = await send_bundle_to_user(context, update.effective_chat.id, bundle, update.effective_user)
+        if not sent:
+            await update.message.reply_text("❌ Error retrieving files. Please try again.")
+
+# ===== BUTTON CALLBACKS =====
+
+@callback_router.exact("back", "cancel")
+async def cancel_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Back/Cancel - Delete message for clean UI"""
+    query = update.callback_query
+    try:
+        await query.message.delete()
+    except:
+        await query.message.edit_text("✅ Cancelled", reply_markup=None)
+
+@callback_router.exact("menu")
+async def menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Main Menu"""
+    query = update.callback_query
+    user_name = query.from_user.first_name
+    welcome_text = (
+        f"👋 *Welcome back, {user_name}!*\n\n"
+        "🗄️ *File Storage Bot - Main Menu*\n\n"
+        "Choose an option below:"
+    )
+    
+    await query.edit_message_text(
+        welcome_text,
+        parse_mode='Markdown',
+        reply_markup=get_main_menu_keyboard(query.from_user.id)
+    )
+
+async def show_files_page(query, show_all, direction=None, cursor=None):
+    """My Files / All Files, paginated by cursor"""
+    response, nav_buttons = build_files_page(query.from_user.id, show_all, direction, cursor)
+    
+    if response is None:
+        empty_text = (
+            "📭 *No Files in System*\n\n"
+            "No files have been uploaded yet."
+        ) if show_all else (
+            "📭 *No Files Yet*\n\n"
+            "You haven't uploaded any files.\n\n"
+            "💡 Send me a file to get started!"
+        )
         await query.edit_message_text(
-            response,
+            empty_text,
             parse_mode='Markdown',
-            disable_web_page_preview=True,
             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("« Back to Menu", callback_data="menu")]])
         )
         return
     
-    # All Files (Admin Only)
-    if data == "allfiles":
-        if not is_admin(user_id):
-            await query.answer("❌ Admin access required!", show_alert=True)
-            return
-        
-        all_files = storage.get_all_files()
+    keyboard = [nav_buttons] if nav_buttons else []
+    keyboard.append([InlineKeyboardButton("« Back to Menu", callback_data="menu")])
+    
+    await query.edit_message_text(
+        response,
+        parse_mode='Markdown',
+        disable_web_page_preview=True,
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+@callback_router.exact("myfiles")
+@callback_router.prefix('mf', fields=(str, str), legacy='mf')
+async def my_files_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, direction=None, cursor=None):
+    """My Files page"""
+    await show_files_page(update.callback_query, False, direction, cursor)
+
+@callback_router.exact("allfiles", admin=True)
+@callback_router.prefix('af', fields=(str, str), legacy='af', admin=True)
+async def all_files_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, direction=None, cursor=None):
+    """All Files page (admin only)"""
+    await show_files_page(update.callback_query, True, direction, cursor)
+
+@callback_router.prefix('sr', fields=(str, int, str))
+async def search_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, order, offset, text):
+    """Search results page or order change"""
+    query = update.callback_query
+    response, keyboard = build_search_page(query.from_user.id, text.split(), order, offset)
+    
+    if response is None:
+        await query.edit_message_text(f"📭 No files match `{text}` anymore.", parse_mode='Markdown')
+        return
+    
+    await query.edit_message_text(
+        response,
+        parse_mode='Markdown',
+        disable_web_page_preview=True,
+        reply_markup=keyboard
+    )
+
+@callback_router.exact("stats")
+async def stats_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Statistics"""
+    query = update.callback_query
+    response = build_stats_text(query.from_user.id)
+    
+    await query.edit_message_text(
+        response,
+        parse_mode='Markdown',
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("« Back to Menu", callback_data="menu")]])
+    )
+
+@callback_router.exact("help")
+async def help_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Help"""
+    help_text = message_manager.get_message('help_message')
+    
+    await update.callback_query.edit_message_text(
+        help_text,
+        parse_mode='Markdown',
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("« Back to Menu", callback_data="menu")]])
+    )
+
+@callback_router.exact("about")
+async def about_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """About"""
+    about_text = message_manager.get_message('about_message')
+    
+    await update.callback_query.edit_message_text(
+        about_text,
+        parse_mode='Markdown',
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("« Back to Menu", callback_data="menu")]])
+    )
+
+@callback_router.exact("editmessages", admin=True)
+async def edit_messages_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Edit Messages menu (admin only)"""
+    keyboard = [
+        [InlineKeyboardButton("📝 Edit Start Message", callback_data=callback_router.data('ed', 'start_message'))],
+        [InlineKeyboardButton("📝 Edit Help Message", callback_data=callback_router.data('ed', 'help_message'))],
+        [InlineKeyboardButton("📝 Edit About Message", callback_data=callback_router.data('ed', 'about_message'))],
+        [InlineKeyboardButton("« Back to Menu", callback_data="menu")]
+    ]
+    
+    await update.callback_query.edit_message_text(
+        "✏️ *Edit Bot Messages*\n\n"
+        "Select which message you want to edit:\n\n"
+        "*Available Variables:*\n"
+        "• `{user_name}` - User's first name\n"
+        "• `{user_id}` - User's ID\n\n"
+        "*Note:* Messages support Markdown formatting.",
+        parse_mode='Markdown',
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+@callback_router.prefix('ed', legacy='edit', admin=True)
+async def edit_message_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, message_type):
+    """Start editing one message type (admin only)"""
+    # Store editing state in context
+    context.user_data['editing_message'] = message_type
+    
+    # Get current message
+    current_msg = message_manager.messages.get(message_type, "")
+    
+    # Truncate if too long for display
+    display_msg = current_msg[:500] + "..." if len(current_msg) > 500 else current_msg
+    
+    message_names = {
+        'start_message': 'Start Message',
+        'help_message': 'Help Message',
+        'about_message': 'About Message'
+    }
+    
+    await update.callback_query.edit_message_text(
+        f"✏️ *Editing {message_names.get(message_type, 'Message')}*\n\n"
+        f"*Current Message:*\n"
+        f"```\n{display_msg}\n```\n\n"
+        f"📝 Send me the new message text.\n\n"
+        f"*Available Variables:*\n"
+        f"• `{{user_name}}` - User's first name\n"
+        f"• `{{user_id}}` - User's ID\n\n"
+        f"Use /cancel to cancel editing.",
+        parse_mode='Markdown',
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("« Cancel", callback_data="editmessages")]])
+    )
+
+@callback_router.prefix('pv', legacy='preview', admin=True)
+async def preview_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, message_type):
+    """Preview the edited message (admin only)"""
+    query = update.callback_query
+    preview_text = context.user_data.get('preview_text', '')
+    
+    # Show preview of the unsaved text with variables replaced
+    preview_display = message_manager.render_preview(
+        preview_text,
+        user_name=query.from_user.first_name,
+        user_id=query.from_user.id
+    )
+    
+    keyboard = [
+        [InlineKeyboardButton("✅ Save", callback_data=callback_router.data('sv', message_type)),
+         InlineKeyboardButton("❌ Cancel", callback_data="editmessages")]
+    ]
+    
+    await query.edit_message_text(
+        f"👁️ *Preview*\n\n{preview_display}\n\n"
+        f"Save this message?",
+        parse_mode='Markdown',
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+@callback_router.prefix('sv', legacy='save', admin=True)
+async def save_message_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, message_type):
+    """Save the edited message (admin only)"""
+    query = update.callback_query
+    new_content = context.user_data.get('new_message_content', '')
+    
+    if new_content:
+        success = message_manager.update_message(message_type, new_content)
         
-        if not all_files:
+        if success:
+            # Clear editing state
+            context.user_data.pop('editing_message', None)
+            context.user_data.pop('new_message_content', None)
+            context.user_data.pop('preview_text', None)
+            
             await query.edit_message_text(
-                "📭 *No Files in System*\n\n"
-                "No files have been uploaded yet.",
+                "✅ *Message Updated Successfully!*\n\n"
+                "The new message has been saved and will be used immediately.",
                 parse_mode='Markdown',
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("« Back to Menu", callback_data="menu")]])
             )
-            return
-        
-        bot = await context.bot.get_me()
-        response = "📂 *All Files in System*\n\n"
-        
-        for uid, d in all_files[-15:]:  # Show last 15 files
-            file_size = d.get('file_size', 0)
-            size_mb = file_size / (1024 * 1024)
-            size_str = f"{size_mb:.2f} MB" if size_mb >= 1 else f"{file_size / 1024:.2f} KB"
-            
-            share_link = f"https://t.me/{bot.username}?start=file_{uid}"
-            
-            type_emoji = {
-                'document': '📄',
-                'photo': '🖼️',
-                'video': '🎥',
-                'audio': '🎵',
-                'voice': '🎤'
-            }.get(d.get('file_type', 'document'), '📄')
-            
-            display_name = d['file_name'][:35] + "..." if len(d['file_name']) > 35 else d['file_name']
-            
-            response += (
-                f"{type_emoji} *{display_name}*\n"
-                f"├ 🆔 ID: `{uid}`\n"
-                f"├ 👤 By: @{d.get('username', 'Unknown')} (`{d.get('uploader_id', 'N/A')}`)\n"
-                f"├ 💾 Size: {size_str}\n"
-                f"├ 📥 Downloads: {d.get('downloads', 0)}\n"
-                f"├ 📅 Date: {d['upload_date'][:10]}\n"
-                f"└ 🔗 [Link]({share_link})\n\n"
-            )
-        
-        if len(all_files) > 15:
-            response += f"_Showing last 15 of {len(all_files)} total files_\n\n"
-        
-        response += f"📊 *Total Files:* {len(all_files)}"
-        
-        await query.edit_message_text(
-            response,
-            parse_mode='Markdown',
-            disable_web_page_preview=True,
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("« Back to Menu", callback_data="menu")]])
-        )
-        return
-    
-    # Statistics
-    if data == "stats":
-        total_files = len(storage.cache)
-        total_downloads = storage.get_total_downloads()
-        
-        if is_admin(user_id):
-            # Admin statistics
-            response = (
-                f"📊 *Bot Statistics (Admin View)*\n\n"
-                f"*Global Stats:*\n"
-                f"├ 📁 Total Files: {total_files}\n"
-                f"├ 📥 Total Downloads: {total_downloads}\n"
-                f"└ 👥 Total Users: {len(set(d.get('uploader_id') for d in storage.cache.values()))}\n\n"
-                f"*Storage Info:*\n"
-                f"├ 🗄️ Files Channel: `{FILES_CHANNEL_ID}`\n"
-                f"├ 📝 Logs Channel: `{LOGS_CHANNEL_ID}`\n"
-                f"└ 💾 Cache Entries: {len(storage.cache)}\n\n"
-                f"*Average Stats:*\n"
-                f"├ Avg Downloads/File: {total_downloads/total_files if total_files > 0 else 0:.1f}\n"
-                f"└ Cache Status: {'✅ Healthy' if len(storage.cache) > 0 else '⚠️ Empty'}"
-            )
         else:
-            # User statistics - only show personal stats
-            user_files = storage.get_user_files(user_id)
-            user_downloads = sum(d.get('downloads', 0) for _, d in user_files)
-            
-            response = (
-                f"📊 *Your Statistics*\n\n"
-                f"*Your Activity:*\n"
-                f"├ 📁 Files Uploaded: {len(user_files)}\n"
-                f"├ 📥 Total Downloads: {user_downloads}\n"
-                f"└ 📈 Avg Downloads/File: {user_downloads/len(user_files) if len(user_files) > 0 else 0:.1f}\n\n"
-                f"💡 *Tip:* Upload more files to track your sharing activity!"
+            await query.edit_message_text(
+                "❌ *Error Saving Message*\n\n"
+                "There was an error saving the message. Please try again.",
+                parse_mode='Markdown',
+                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("« Back", callback_data="editmessages")]])
             )
-        
-        await query.edit_message_text(
-            response,
-            parse_mode='Markdown',
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("« Back to Menu", callback_data="menu")]])
-        )
-        return
+
+@callback_router.exact("rebuild", admin=True)
+async def rebuild_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Rebuild Cache (admin only)"""
+    # Refresh the cached bot identity in case the username changed
+    await refresh_bot_identity(context.bot)
     
-    # Help
-    if data == "help":
-        help_text = message_manager.get_message('help_message')
-        
-        await query.edit_message_text(
-            help_text,
-            parse_mode='Markdown',
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("« Back to Menu", callback_data="menu")]])
-        )
-        return
+    await update.callback_query.edit_message_text(
+        "🔄 *Cache Rebuild*\n\n"
+        "Current cache status:\n"
+        f"├ 📊 Files stored: {storage.count_files()}\n"
+        f"├ 🧠 Loaded in memory: {len(storage.cache)} / {storage.cache.max_size}\n"
+        f"├ 🎯 Hits / misses: {storage.cache.hits + storage.cache.negative_hits} / {storage.cache.misses}\n"
+        f"├ ♻️ Evictions: {storage.cache.evictions}\n"
+        f"├ 🗃️ Backend: {type(storage.backend).__name__}\n"
+        f"├ 💾 Storage file: `{storage.backend.path}`\n"
+        f"└ ✅ Status: Operational\n\n"
+        "*About Cache:*\n"
+        "File metadata is persisted locally and survives restarts. "
+        "All data is also logged in the Logs Channel for permanent backup.\n\n"
+        "*Recovery:*\n"
+        f"├ 🧾 Records in snapshot: {len(recovery.records)}\n"
+        f"└ 📍 Last log message: {recovery.last_message_id}\n\n"
+        "If metadata is lost, forward messages from the Logs Channel to this bot, "
+        "or run `python filestore_bot.py recover result.json` with a channel export. "
+        "Recovery resumes from the last ingested message.",
+        parse_mode='Markdown',
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("« Back to Menu", callback_data="menu")]])
+    )
+
+@callback_router.prefix('g', legacy='get')
+async def get_file_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, unique_id):
+    """Get File (with join prompt)"""
+    query = update.callback_query
+    file_data = storage.get_from_cache(unique_id)
     
-    # About
-    if data == "about":
-        about_text = message_manager.get_message('about_message')
-        
+    if not file_data:
         await query.edit_message_text(
-            about_text,
-            parse_mode='Markdown',
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("« Back to Menu", callback_data="menu")]])
+            "❌ *File Not Found*\n\n"
+            "This file may have been deleted or the link is incorrect.",
+            parse_mode='Markdown'
         )
         return
     
-    # Edit Messages (Admin Only)
-    if data == "editmessages":
-        if not is_admin(user_id):
-            await query.answer("❌ Admin access required!", show_alert=True)
-            return
+    # Send file to user
+    success = await send_file_to_user(context, query.message.chat_id, file_data, unique_id)
+    
+    if success:
+        await storage.update_downloads(unique_id)
         
+        # Show join channel button after sending
         keyboard = [
-            [InlineKeyboardButton("📝 Edit Start Message", callback_data="edit_start_message")],
-            [InlineKeyboardButton("📝 Edit Help Message", callback_data="edit_help_message")],
-            [InlineKeyboardButton("📝 Edit About Message", callback_data="edit_about_message")],
-            [InlineKeyboardButton("« Back to Menu", callback_data="menu")]
+            [InlineKeyboardButton("📢 Join Our Backup Channel", url=BACKUP_CHANNEL_LINK)],
+            [InlineKeyboardButton("✅ Done", callback_data="cancel")]
         ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
         
         await query.edit_message_text(
-            "✏️ *Edit Bot Messages*\n\n"
-            "Select which message you want to edit:\n\n"
-            "*Available Variables:*\n"
-            "• `{user_name}` - User's first name\n"
-            "• `{user_id}` - User's ID\n\n"
-            "*Note:* Messages support Markdown formatting.",
+            "✅ *File Sent Successfully!*\n\n"
+            "Your file has been sent to this chat.\n\n"
+            "💡 *Support us by joining our backup channel!*\n"
+            "Get updates, exclusive content, and more files.",
             parse_mode='Markdown',
-            reply_markup=InlineKeyboardMarkup(keyboard)
+            reply_markup=reply_markup
         )
-        return
-    
-    # Edit specific message types
-    if data.startswith('edit_'):
-        if not is_admin(user_id):
-            await query.answer("❌ Admin access required!", show_alert=True)
-            return
-        
-        message_type = data.replace('edit_', '')
-        
-        # Store editing state in context
-        context.user_data['editing_message'] = message_type
-        
-        # Get current message
-        current_msg = message_manager.messages.get(message_type, "")
-        
-        # Truncate if too long for display
-        display_msg = current_msg[:500] + "..." if len(current_msg) > 500 else current_msg
-        
-        message_names = {
-            'start_message': 'Start Message',
-            'help_message': 'Help Message',
-            'about_message': 'About Message'
-        }
         
+        # Log download activity with detailed user info
+        await log_download_activity(context, unique_id, file_data['file_name'], query.from_user)
+    else:
         await query.edit_message_text(
-            f"✏️ *Editing {message_names.get(message_type, 'Message')}*\n\n"
-            f"*Current Message:*\n"
-            f"```\n{display_msg}\n```\n\n"
-            f"📝 Send me the new message text.\n\n"
-            f"*Available Variables:*\n"
-            f"• `{{user_name}}` - User's first name\n"
-            f"• `{{user_id}}` - User's ID\n\n"
-            f"Use /cancel to cancel editing.",
-            parse_mode='Markdown',
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("« Cancel", callback_data="editmessages")]])
+            "❌ *Error Sending File*\n\n"
+            "There was an error retrieving your file. Please try again later.",
+            parse_mode='Markdown'
         )
+
+@callback_router.prefix('gb', legacy='getb', answer=False)
+async def get_bundle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, bundle_id):
+    """Get every file of a bundle"""
+    query = update.callback_query
+    bundle = storage.get_bundle(bundle_id)
+    
+    if not bundle:
+        await query.answer("❌ Bundle not found!", show_alert=True)
         return
+    await query.answer()
     
-    # Preview edited message
-    if data.startswith('preview_'):
-        if not is_admin(user_id):
-            await query.answer("❌ Admin access required!", show_alert=True)
-            return
-        
-        message_type = data.replace('preview_', '')
-        preview_text = context.user_data.get('preview_text', '')
-        
-        # Show preview with variables replaced
-        preview_display = message_manager.get_message(
-            message_type,
-            user_name=query.from_user.first_name,
-            user_id=user_id
-        ) if message_type in message_manager.messages else preview_text
-        
+    sent = await send_bundle_to_user(context, query.message.chat_id, bundle, query.from_user)
+    
+    if sent:
         keyboard = [
-            [InlineKeyboardButton("✅ Save", callback_data=f"save_{message_type}"),
-             InlineKeyboardButton("❌ Cancel", callback_data="editmessages")]
+            [InlineKeyboardButton("📢 Join Our Backup Channel", url=BACKUP_CHANNEL_LINK)],
+            [InlineKeyboardButton("✅ Done", callback_data="cancel")]
         ]
-        
-        await query.edit_message_text(
-            f"👁️ *Preview*\n\n{preview_display}\n\n"
-            f"Save this message?",
+        await query.message.reply_text(
+            f"✅ *{sent} Files Sent Successfully!*\n\n"
+            "💡 *Support us by joining our backup channel!*",
             parse_mode='Markdown',
             reply_markup=InlineKeyboardMarkup(keyboard)
         )
-        return
-    
-    # Save edited message
-    if data.startswith('save_'):
-        if not is_admin(user_id):
-            await query.answer("❌ Admin access required!", show_alert=True)
-            return
-        
-        message_type = data.replace('save_', '')
-        new_content = context.user_data.get('new_message_content', '')
-        
-        if new_content:
-            success = message_manager.update_message(message_type, new_content)
-            
-            if success:
-                # Clear editing state
-                context.user_data.pop('editing_message', None)
-                context.user_data.pop('new_message_content', None)
-                context.user_data.pop('preview_text', None)
-                
-                await query.edit_message_text(
-                    "✅ *Message Updated Successfully!*\n\n"
-                    "The new message has been saved and will be used immediately.",
-                    parse_mode='Markdown',
-                    reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("« Back to Menu", callback_data="menu")]])
-                )
-            else:
-                await query.edit_message_text(
-                    "❌ *Error Saving Message*\n\n"
-                    "There was an error saving the message. Please try again.",
-                    parse_mode='Markdown',
-                    reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("« Back", callback_data="editmessages")]])
-                )
-        return
+    else:
+        await query.message.reply_text("❌ Error sending files. Please try again.")
+
+@callback_router.prefix('dl', legacy='dl', answer=False)
+async def download_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, unique_id):
+    """Download File (from file upload message)"""
+    query = update.callback_query
+    file_data = storage.get_from_cache(unique_id)
     
-    # Rebuild Cache (Admin Only)
-    if data == "rebuild":
-        if not is_admin(user_id):
-            await query.answer("❌ Admin access required!", show_alert=True)
-            return
-        
-        await query.edit_message_text(
-            "🔄 *Cache Rebuild*\n\n"
-            "Current cache status:\n"
-            f"├ 📊 Files in cache: {len(storage.cache)}\n"
-            f"├ 💾 Cache file: `{CACHE_FILE}`\n"
-            f"└ ✅ Status: Operational\n\n"
-            "*About Cache:*\n"
-            "The cache stores file metadata locally for fast access. "
-            "All data is also logged in the Logs Channel for permanent backup.\n\n"
-            "*Recovery:*\n"
-            "If cache is lost, files are automatically recovered from the Logs Channel "
-            "when accessed via their share links.",
-            parse_mode='Markdown',
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("« Back to Menu", callback_data="menu")]])
-        )
+    if not file_data:
+        await query.answer("❌ File not found!", show_alert=True)
         return
     
-    # Get File (with join prompt)
-    if data.startswith('get_'):
-        unique_id = data.replace('get_', '')
-        
-        file_data = storage.get_from_cache(unique_id)
-        
-        if not file_data:
-            await query.edit_message_text(
-                "❌ *File Not Found*\n\n"
-                "This file may have been deleted or the link is incorrect.",
-                parse_mode='Markdown'
-            )
-            return
-        
-        # Send file to user
-        success = await send_file_to_user(context, query.message.chat_id, file_data, unique_id)
-        
-        if success:
-            await storage.update_downloads(unique_id)
-            
-            # Show join channel button after sending
-            keyboard = [
-                [InlineKeyboardButton("📢 Join Our Backup Channel", url=BACKUP_CHANNEL_LINK)],
-                [InlineKeyboardButton("✅ Done", callback_data="cancel")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await query.edit_message_text(
-                "✅ *File Sent Successfully!*\n\n"
-                "Your file has been sent to this chat.\n\n"
-                "💡 *Support us by joining our backup channel!*\n"
-                "Get updates, exclusive content, and more files.",
-                parse_mode='Markdown',
-                reply_markup=reply_markup
-            )
-            
-            # Log download activity with detailed user info
-            await log_download_activity(context, unique_id, file_data['file_name'], query.from_user)
-        else:
-            await query.edit_message_text(
-                "❌ *Error Sending File*\n\n"
-                "There was an error retrieving your file. Please try again later.",
-                parse_mode='Markdown'
-            )
-        return
+    success = await send_file_to_user(context, query.message.chat_id, file_data, unique_id)
     
-    # Download File (from file upload message)
-    if data.startswith('dl_'):
-        unique_id = data.replace('dl_', '')
-        file_data = storage.get_from_cache(unique_id)
-        
-        if not file_data:
-            await query.answer("❌ File not found!", show_alert=True)
-            return
-        
-        success = await send_file_to_user(context, query.message.chat_id, file_data, unique_id)
+    if success:
+        await storage.update_downloads(unique_id)
+        await query.answer("✅ File sent successfully!", show_alert=False)
         
-        if success:
-            await storage.update_downloads(unique_id)
-            await query.answer("✅ File sent successfully!", show_alert=False)
-            
-            # Log download activity with detailed user info
-            await log_download_activity(context, unique_id, file_data['file_name'], query.from_user)
-        else:
-            await query.answer("❌ Error sending file. Please try again.", show_alert=True)
-        return
+        # Log download activity with detailed user info
+        await log_download_activity(context, unique_id, file_data['file_name'], query.from_user)
+    else:
+        await query.answer("❌ Error sending file. Please try again.", show_alert=True)
+
+@timed_handler(route=callback_route)
+async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle button callbacks."""
+    await callback_router.dispatch(update, context)
 
 # ===== COMMAND HANDLERS =====
 
+@timed_handler()
 async def my_files_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Command version of my files with detailed view"""
     user_id = update.message.from_user.id
-    user_files = storage.get_user_files(user_id)
+    response, nav_buttons = build_files_page(user_id, False)
     
-    if not user_files:
+    if response is None:
         await update.message.reply_text(
             "📭 *No Files Yet*\n\n"
             "You haven't uploaded any files.\n\n"
@@ -1055,81 +3944,130 @@ async def my_files_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    bot = await context.bot.get_me()
-    response = "📁 *Your Uploaded Files*\n\n"
+    await update.message.reply_text(
+        response,
+        parse_mode='Markdown',
+        disable_web_page_preview=True,
+        reply_markup=InlineKeyboardMarkup([nav_buttons]) if nav_buttons else None
+    )
+
+@timed_handler()
+async def bundle_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Create one bundle link from existing file IDs or share links"""
+    user = update.message.from_user
+    file_ids = []
+    for arg in context.args or []:
+        unique_id = arg.rsplit('file_', 1)[-1]
+        if unique_id not in file_ids:
+            file_ids.append(unique_id)
     
-    for uid, d in user_files[-15:]:
-        file_size = d.get('file_size', 0)
-        size_mb = file_size / (1024 * 1024)
-        size_str = f"{size_mb:.2f} MB" if size_mb >= 1 else f"{file_size / 1024:.2f} KB"
-        
-        share_link = f"https://t.me/{bot.username}?start=file_{uid}"
-        
-        type_emoji = {
-            'document': '📄',
-            'photo': '🖼️',
-            'video': '🎥',
-            'audio': '🎵',
-            'voice': '🎤'
-        }.get(d.get('file_type', 'document'), '📄')
-        
-        display_name = d['file_name'][:40] + "..." if len(d['file_name']) > 40 else d['file_name']
-        
-        response += (
-            f"{type_emoji} *{display_name}*\n"
-            f"├ 🆔 ID: `{uid}`\n"
-            f"├ 💾 Size: {size_str}\n"
-            f"├ 📥 Downloads: {d.get('downloads', 0)}\n"
-            f"├ 📅 Date: {d['upload_date'][:10]}\n"
-            f"└ 🔗 [Share Link]({share_link})\n\n"
+    if len(file_ids) < 2:
+        await update.message.reply_text(
+            "📦 *Create a Bundle*\n\n"
+            "Send at least two file IDs or share links:\n"
+            "`/bundle <id> <id> ...`",
+            parse_mode='Markdown'
+        )
+        return
+    if len(file_ids) > BUNDLE_MAX_FILES:
+        await update.message.reply_text(f"❌ A bundle can hold at most {BUNDLE_MAX_FILES} files.")
+        return
+    
+    missing = [unique_id for unique_id in file_ids if not storage.exists(unique_id)]
+    if missing:
+        await update.message.reply_text(
+            f"❌ *Files Not Found*\n\n" + "\n".join(f"• `{unique_id}`" for unique_id in missing[:20]),
+            parse_mode='Markdown'
         )
+        return
+    
+    created_at = datetime.now().isoformat()
+    bundle_id = id_allocator.next_id(lambda bid: storage.get_bundle(bid) is not None)
+    storage.save_bundle(bundle_id, file_ids, user.id, created_at)
+    bundle_link = build_bundle_link(bundle_id)
+    log_writer.enqueue('bundle', {
+        'bundle_id': bundle_id,
+        'uploader_id': user.id,
+        'username': user.username,
+        'upload_date': created_at,
+        'file_ids': file_ids,
+        'bundle_link': bundle_link,
+        'files': []
+    })
+    logger.info(f"Created bundle {bundle_id} ({len(file_ids)} files) for user {user.id}")
+    
+    keyboard = [
+        [InlineKeyboardButton("📥 Download All", callback_data=callback_router.data('gb', bundle_id))],
+        [InlineKeyboardButton("🔗 Copy Bundle Link", url=bundle_link)]
+    ]
+    await update.message.reply_text(
+        f"✅ *Bundle Created!*\n\n"
+        f"📦 *Bundle:* {len(file_ids)} files\n"
+        f"└ *ID:* `{bundle_id}`\n\n"
+        f"🔗 *Bundle Link:*\n`{bundle_link}`",
+        parse_mode='Markdown',
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+@timed_handler()
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Search file names (admins search every file, users their own)"""
+    user_id = update.message.from_user.id
+    terms = fit_search_terms(query_terms(' '.join(context.args or [])))
     
-    if len(user_files) > 15:
-        response += f"_Showing last 15 of {len(user_files)} total files_\n\n"
+    if not terms:
+        await update.message.reply_text(
+            "🔍 *Search Files*\n\n"
+            "Send words from the file name (at least 2 letters each):\n"
+            "`/search <words>`\n\n"
+            f"💡 You can also search from any chat by typing `@{bot_username or 'bot'} <words>`",
+            parse_mode='Markdown'
+        )
+        return
     
-    response += f"📊 *Total Files:* {len(user_files)}"
+    response, keyboard = build_search_page(user_id, terms)
+    if response is None:
+        await update.message.reply_text(
+            f"📭 No {'' if is_admin(user_id) else 'uploaded '}files match `{' '.join(terms)}`.",
+            parse_mode='Markdown'
+        )
+        return
     
     await update.message.reply_text(
         response,
         parse_mode='Markdown',
-        disable_web_page_preview=True
+        disable_web_page_preview=True,
+        reply_markup=keyboard
+    )
+
+@timed_handler()
+async def inline_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Inline mode: search file names and send a match into any chat"""
+    inline_query = update.inline_query
+    user_id = inline_query.from_user.id
+    terms = query_terms(inline_query.query)
+    try:
+        offset = max(0, int(inline_query.offset or 0))
+    except ValueError:
+        offset = 0
+    
+    items, has_more = [], False
+    if terms:
+        items, has_more = storage.search_files(
+            terms, None if is_admin(user_id) else user_id, 'downloads', offset, SEARCH_INLINE_LIMIT
+        )
+    await inline_query.answer(
+        [build_inline_result(uid, d) for uid, d in items],
+        cache_time=10,
+        is_personal=True,
+        next_offset=str(offset + len(items)) if has_more else ''
     )
 
+@timed_handler()
 async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Command version of statistics"""
     user_id = update.message.from_user.id
-    total_files = len(storage.cache)
-    total_downloads = storage.get_total_downloads()
-    
-    if is_admin(user_id):
-        # Admin statistics
-        response = (
-            f"📊 *Bot Statistics (Admin View)*\n\n"
-            f"*Global Stats:*\n"
-            f"├ 📁 Total Files: {total_files}\n"
-            f"├ 📥 Total Downloads: {total_downloads}\n"
-            f"└ 👥 Total Users: {len(set(d.get('uploader_id') for d in storage.cache.values()))}\n\n"
-            f"*Storage Info:*\n"
-            f"├ 🗄️ Files Channel: `{FILES_CHANNEL_ID}`\n"
-            f"├ 📝 Logs Channel: `{LOGS_CHANNEL_ID}`\n"
-            f"└ 💾 Cache Entries: {len(storage.cache)}\n\n"
-            f"*Average Stats:*\n"
-            f"├ Avg Downloads/File: {total_downloads/total_files if total_files > 0 else 0:.1f}\n"
-            f"└ Cache Status: {'✅ Healthy' if len(storage.cache) > 0 else '⚠️ Empty'}"
-        )
-    else:
-        # User statistics - only show personal stats
-        user_files = storage.get_user_files(user_id)
-        user_downloads = sum(d.get('downloads', 0) for _, d in user_files)
-        
-        response = (
-            f"📊 *Your Statistics*\n\n"
-            f"*Your Activity:*\n"
-            f"├ 📁 Files Uploaded: {len(user_files)}\n"
-            f"├ 📥 Total Downloads: {user_downloads}\n"
-            f"└ 📈 Avg Downloads/File: {user_downloads/len(user_files) if len(user_files) > 0 else 0:.1f}\n\n"
-            f"💡 *Tip:* Upload more files to track your sharing activity!"
-        )
+    response = build_stats_text(user_id)
     
     await update.message.reply_text(response, parse_mode='Markdown')
 
@@ -1163,6 +4101,7 @@ async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         await update.message.reply_text("No active editing session.")
 
+@timed_handler()
 async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle text messages for message editing"""
     user_id = update.message.from_user.id
@@ -1176,22 +4115,15 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
         context.user_data['new_message_content'] = new_content
         context.user_data['preview_text'] = new_content
         
-        # Temporarily update message for preview
-        old_content = message_manager.messages.get(message_type, '')
-        message_manager.messages[message_type] = new_content
-        
-        # Show preview with variables replaced
-        preview_display = message_manager.get_message(
-            message_type,
+        # Show preview with variables replaced (nothing is saved yet)
+        preview_display = message_manager.render_preview(
+            new_content,
             user_name=update.message.from_user.first_name,
             user_id=user_id
         )
         
-        # Restore old content (don't save yet)
-        message_manager.messages[message_type] = old_content
-        
         keyboard = [
-            [InlineKeyboardButton("✅ Save", callback_data=f"save_{message_type}"),
+            [InlineKeyboardButton("✅ Save", callback_data=callback_router.data('sv', message_type)),
              InlineKeyboardButton("❌ Cancel", callback_data="editmessages")]
         ]
         
@@ -1211,6 +4143,28 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
         )
 
 
+@timed_handler()
+async def handle_forwarded_log(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Recover metadata from log messages forwarded by an admin"""
+    message = update.message
+    origin = message.forward_origin
+    
+    # Anything not forwarded from the logs channel is a normal text message
+    if not isinstance(origin, MessageOriginChannel) or origin.chat.id != LOGS_CHANNEL_ID:
+        await handle_text_message(update, context)
+        return
+    
+    # The JSON block is sent as a code block, so prefer the 'pre' entity text
+    pre_blocks = list(message.parse_entities([MessageEntity.PRE]).values())
+    text = pre_blocks[0] if pre_blocks else message.text
+    
+    if recovery.ingest_messages([(origin.message_id, text)]):
+        restored = recovery.restore(storage)
+        logger.info(f"Ingested forwarded log message {origin.message_id} ({restored} restored)")
+    
+    if recovery.unsaved >= 50:
+        recovery.save_snapshot()
+
 async def post_init(application: Application):
     """Set up bot commands after initialization"""
     from telegram import BotCommand
@@ -1218,6 +4172,8 @@ async def post_init(application: Application):
     commands = [
         BotCommand("start", "Start the bot and see menu"),
         BotCommand("myfiles", "View your uploaded files"),
+        BotCommand("search", "Search files by name"),
+        BotCommand("bundle", "Share several files with one link"),
         BotCommand("stats", "View bot statistics"),
         BotCommand("help", "Show help guide"),
         BotCommand("about", "About this bot"),
@@ -1225,22 +4181,374 @@ async def post_init(application: Application):
     ]
     await application.bot.set_my_commands(commands)
     logger.info("Bot commands configured successfully!")
+    
+    # Resolve bot username once for share links
+    await refresh_bot_identity(application.bot)
+    
+    # Start delivering queued log channel messages
+    log_writer.start(application.bot)
+    
+    # Start writing batched download counts
+    storage.start_flusher()
+    
+    # Serve metrics on the local port
+    global metrics_runner
+    metrics.callbacks['update_queue_depth'] = application.update_queue.qsize
+    if METRICS_PORT:
+        metrics_runner = await start_metrics_server()
+    
+    # Resume logs channel recovery from the last checkpoint
+    if RECOVERY_EXPORT_FILE and os.path.exists(RECOVERY_EXPORT_FILE):
+        recovery.ingest_export(RECOVERY_EXPORT_FILE)
+    recovery.restore(storage)
+
+async def post_stop(application: Application):
+    """Deliver pending log messages while the bot is still connected"""
+    await storage.stop_flusher()
+    await log_writer.stop()
+    await scheduler.stop()
+    global metrics_runner
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+        metrics_runner = None
+
+async def post_shutdown(application: Application):
+    """Flush and close storage on shutdown"""
+    recovery.save_snapshot()
+    storage.close()
+    logger.info("Storage closed")
+
+def recover_from_export(export_path):
+    """Offline recovery: ingest a logs channel export into the snapshot and storage"""
+    logger.info(f"Recovering metadata from {export_path}...")
+    recovery.ingest_export(export_path)
+    restored = recovery.restore(storage, full=True)
+    storage.close()
+    logger.info(f"Recovery finished: {len(recovery.records)} records in snapshot, {restored} restored")
+
+class OrderedUpdateProcessor(BaseUpdateProcessor):
+    """Handle updates concurrently, but one at a time per user (or chat)
+
+    The first update of a user runs in its max_concurrent_updates slot and then
+    runs the user's updates that arrived meanwhile, in order. Those return their
+    own slot right away, so one busy user holds at most one slot.
+    """
+    def __init__(self, max_concurrent_updates=MAX_CONCURRENT_UPDATES):
+        super().__init__(max_concurrent_updates)
+        self.queues = {}  # ordering key -> coroutines waiting behind the running update
+
+    @staticmethod
+    def ordering_key(update):
+        """User an update belongs to, or its chat when there is no user"""
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user:
+            return update.effective_user.id
+        if update.effective_chat:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        """Run the update now, or queue it behind the running update of its key"""
+        key = self.ordering_key(update)
+        if key is None:
+            await coroutine
+            return
+        
+        queue = self.queues.get(key)
+        if queue is not None:
+            queue.append(coroutine)
+            return
+        
+        queue = self.queues[key] = deque([coroutine])
+        try:
+            while queue:
+                try:
+                    await queue[0]
+                except Exception as e:
+                    logger.error(f"Error processing update: {e}")
+                queue.popleft()
+        finally:
+            del self.queues[key]
+            for pending in queue:
+                # Cancelled - close the coroutines that never started
+                pending.close()
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+def stop_signal_event():
+    """Event set on SIGINT/SIGTERM"""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+    return stop_event
+
+async def run_application(application: Application, serve):
+    """Run the application lifecycle (as run_polling does) while serve() feeds it updates"""
+    async with application:
+        await application.post_init(application)
+        await application.start()
+        try:
+            await serve()
+        finally:
+            await application.stop()
+            await application.post_stop(application)
+    await application.post_shutdown(application)
+
+async def set_webhook(bot):
+    """Register WEBHOOK_URL with Telegram (skipped when it is empty)"""
+    if WEBHOOK_URL:
+        await bot.set_webhook(
+            url=WEBHOOK_URL + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=ALLOWED_UPDATES,
+            max_connections=WEBHOOK_MAX_CONNECTIONS
+        )
+        logger.info(f"Webhook set to {WEBHOOK_URL + WEBHOOK_PATH}")
+
+async def serve_webhook(on_update, health, stop_event):
+    """Accept webhook updates with the secret token until stop_event is set"""
+    from aiohttp import web
+    
+    async def receive_update(request):
+        token = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+        if not hmac.compare_digest(token.encode(), WEBHOOK_SECRET.encode()):
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        await on_update(data)
+        return web.Response()
+    
+    async def health_check(request):
+        return web.json_response(health())
+    
+    web_app = web.Application()
+    web_app.router.add_post(WEBHOOK_PATH, receive_update)
+    web_app.router.add_get('/health', health_check)
+    runner = web.AppRunner(web_app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_LISTEN, WEBHOOK_PORT).start()
+    logger.info(f"Webhook server listening on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}")
+    
+    await stop_event.wait()
+    
+    logger.info("Stopping webhook server...")
+    await runner.cleanup()
+
+async def run_webhook(application: Application):
+    """Serve updates from an aiohttp webhook server until SIGINT/SIGTERM"""
+    stop_event = stop_signal_event()
+    
+    async def on_update(data):
+        await application.update_queue.put(Update.de_json(data, application.bot))
+    
+    def health():
+        return {
+            'status': 'ok' if application.running else 'starting',
+            'worker': WORKER_ID,
+            'pending_updates': application.update_queue.qsize(),
+        }
+    
+    async def serve():
+        await set_webhook(application.bot)
+        await serve_webhook(on_update, health, stop_event)
+    
+    await run_application(application, serve)
+
+def update_shard_key(data):
+    """User (or chat) an update belongs to, used to pick its worker"""
+    for value in data.values():
+        if isinstance(value, dict):
+            sender = value.get('from') or value.get('chat')
+            if sender and 'id' in sender:
+                return sender['id']
+    return data.get('update_id', 0)
+
+class WorkerPool:
+    """Bot worker processes fed update JSON lines on stdin by the webhook server
+
+    Updates are routed by user, so each user's updates are handled in order by
+    one process. Workers share the sqlite backend and get their own WORKER_ID,
+    log outbox and recovery snapshot; only the first one ingests the export.
+    """
+    def __init__(self, count=WORKERS):
+        self.count = count
+        self.procs = [None] * count
+
+    def worker_env(self, index):
+        env = dict(os.environ, WORKER_ID=str(WORKER_ID + index))
+        # Workers share the bot's global and logs channel limits; a private chat
+        # is only ever served by one worker, so its limit stays as is
+        env['SEND_GLOBAL_RATE'] = str(SEND_GLOBAL_RATE / self.count)
+        env['SEND_GROUP_PER_MINUTE'] = str(SEND_GROUP_RATE * 60 / self.count)
+        if METRICS_PORT:
+            env['METRICS_PORT'] = str(METRICS_PORT + index)
+        if index:
+            root, ext = os.path.splitext(LOG_OUTBOX_FILE)
+            env['LOG_OUTBOX_FILE'] = f"{root}.{index}{ext}"
+            root, ext = os.path.splitext(RECOVERY_SNAPSHOT_FILE)
+            env['RECOVERY_SNAPSHOT_FILE'] = f"{root}.{index}{ext}"
+            env['RECOVERY_EXPORT_FILE'] = ''
+        return env
+
+    async def spawn(self, index):
+        """Start (or restart) one worker process"""
+        self.procs[index] = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.abspath(__file__), 'worker',
+            stdin=asyncio.subprocess.PIPE, env=self.worker_env(index),
+            start_new_session=True  # Shut down through stdin EOF, not the terminal's SIGINT
+        )
+        logger.info(f"Started worker {index} (pid {self.procs[index].pid})")
+
+    async def start(self):
+        for index in range(self.count):
+            await self.spawn(index)
+
+    async def dispatch(self, data):
+        """Hand an update to the worker that owns its user"""
+        index = update_shard_key(data) % self.count
+        line = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b"\n"
+        for attempt in range(2):
+            proc = self.procs[index]
+            if proc.returncode is None:
+                try:
+                    proc.stdin.write(line)
+                    await proc.stdin.drain()
+                    return
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+            logger.warning(f"Worker {index} is gone, restarting it")
+            await self.spawn(index)
+        logger.error(f"Dropped update {data.get('update_id')}: worker {index} unavailable")
+
+    def alive(self):
+        return sum(1 for proc in self.procs if proc is not None and proc.returncode is None)
+
+    async def stop(self, timeout=30):
+        """Close the workers' stdin and wait for them to shut down"""
+        for proc in self.procs:
+            if proc is not None and proc.returncode is None:
+                proc.stdin.close()
+        for index, proc in enumerate(self.procs):
+            if proc is None:
+                continue
+            try:
+                await asyncio.wait_for(proc.wait(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Worker {index} did not stop in time, killing it")
+                proc.kill()
+                await proc.wait()
+
+async def run_webhook_workers():
+    """Webhook server process that spreads updates over WORKERS bot processes"""
+    from telegram import Bot
+    
+    stop_event = stop_signal_event()
+    pool = WorkerPool()
+    await pool.start()
+    
+    def health():
+        alive = pool.alive()
+        return {
+            'status': 'ok' if alive == pool.count else 'degraded',
+            'workers': alive,
+            'expected_workers': pool.count,
+        }
+    
+    try:
+        async with Bot(BOT_TOKEN) as bot:
+            await set_webhook(bot)
+        await serve_webhook(pool.dispatch, health, stop_event)
+    finally:
+        await pool.stop()
+
+async def run_worker(application: Application):
+    """Worker process: handle update JSON lines from the webhook server on stdin"""
+    stop_event = stop_signal_event()
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=16 * 1024 * 1024)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    
+    async def read_updates():
+        while True:
+            line = await reader.readline()
+            if not line:
+                break  # Webhook server closed the pipe
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError:
+                logger.error("Worker received a malformed update line")
+                continue
+            await application.update_queue.put(Update.de_json(data, application.bot))
+        stop_event.set()
+    
+    async def serve():
+        reader_task = asyncio.create_task(read_updates())
+        await stop_event.wait()
+        reader_task.cancel()
+    
+    await run_application(application, serve)
 
 def main():
     """Start the bot."""
+    if len(sys.argv) == 3 and sys.argv[1] == 'recover':
+        recover_from_export(sys.argv[2])
+        return
+    
+    # Mode can be given on the command line (e.g. from the Procfile)
+    mode = sys.argv[1] if len(sys.argv) == 2 else BOT_MODE
+    if mode not in ('polling', 'webhook', 'worker'):
+        logger.error(f"Unknown mode '{mode}', use 'polling' or 'webhook'")
+        return
+    if mode == 'webhook' and not WEBHOOK_SECRET:
+        logger.error("WEBHOOK_SECRET must be set in webhook mode")
+        return
+    if mode == 'webhook' and WORKERS > 1:
+        if not isinstance(storage.backend, SQLiteBackend):
+            logger.error("WORKERS > 1 needs the shared sqlite backend (STORAGE_BACKEND=sqlite)")
+            return
+        logger.info(f"Starting webhook server with {WORKERS} workers...")
+        asyncio.run(run_webhook_workers())
+        return
+    
     logger.info("Starting File Storage Bot...")
     
     # Create application
-    application = Application.builder().token(BOT_TOKEN).post_init(post_init).build()
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .request(InstrumentedRequest(connection_pool_size=256))
+        .get_updates_request(InstrumentedRequest())
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+        .concurrent_updates(OrderedUpdateProcessor())
+        .build()
+    )
     
     # Add command handlers
     application.add_handler(CommandHandler("start", handle_start_parameter))
     application.add_handler(CommandHandler("myfiles", my_files_command))
+    application.add_handler(CommandHandler("bundle", bundle_command))
+    application.add_handler(CommandHandler("search", search_command))
     application.add_handler(CommandHandler("stats", stats_command))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("about", about_command))
     application.add_handler(CommandHandler("cancel", cancel_command))
     
+    # Add forwarded logs channel messages handler for recovery (admins only)
+    application.add_handler(MessageHandler(
+        filters.FORWARDED & filters.TEXT & filters.User(ADMIN_USER_IDS) & ~filters.COMMAND,
+        handle_forwarded_log
+    ))
+    
     # Add text message handler for editing messages (must be before file handler)
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_message))
     
@@ -1253,16 +4561,26 @@ def main():
     # Add callback query handler for inline buttons
     application.add_handler(CallbackQueryHandler(button_callback))
     
+    # Add inline query handler for searching from any chat
+    application.add_handler(InlineQueryHandler(inline_search))
+    
     # Start the bot
     logger.info("=" * 50)
     logger.info("Bot started successfully!")
     logger.info(f"Files Channel ID: {FILES_CHANNEL_ID}")
     logger.info(f"Logs Channel ID: {LOGS_CHANNEL_ID}")
     logger.info(f"Admin User IDs: {ADMIN_USER_IDS}")
-    logger.info(f"Cache File: {CACHE_FILE}")
+    logger.info(f"Storage Backend: {type(storage.backend).__name__} ({storage.backend.path})")
+    logger.info(f"Update Mode: {mode}")
+    logger.info(f"Concurrent Updates: {MAX_CONCURRENT_UPDATES}")
     logger.info("=" * 50)
     
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if mode == 'webhook':
+        asyncio.run(run_webhook(application))
+    elif mode == 'worker':
+        asyncio.run(run_worker(application))
+    else:
+        application.run_polling(allowed_updates=ALLOWED_UPDATES)
 
 if __name__ == '__main__':
     main()